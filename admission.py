@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+בקרת כניסה לבקשות מהמרכזיה בזמן עומס (למשל בזמן קמפיין)
+
+    - תקרה לבקשות שבטיפול בו-זמנית בכל worker (ADMISSION_MAX_IN_FLIGHT)
+    - שיחות חדשות מקבלות רק חלק מהמקומות (ADMISSION_ENTRY_SHARE), והשאר
+      שמור לשיחות באמצע תהליך - מי שכבר בתוך התפריטים לא נזרק בגלל שיחות חדשות
+    - תקרה לשיחות חדשות מאותו PBXphone בחלון זמן (חיוג חוזר בלולאה)
+
+בקשה שלא התקבלה מקבלת תפריט "המערכת עמוסה" קבוע, בלי גישה למאגר.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+CAPACITY = 'capacity'
+CALLER_RATE = 'caller_rate'
+
+
+class AdmissionController:
+    """מונה הבקשות שבטיפול והחלטה אם לקבל בקשה חדשה"""
+
+    def __init__(self, max_in_flight: int = 32, entry_share: float = 0.75,
+                 caller_max_entries: int = 5, caller_window_seconds: float = 60):
+        self.max_in_flight = max_in_flight
+        # לפחות מקום אחד לשיחה חדשה, ולפחות אחד שמור לשיחות באמצע תהליך
+        self.entry_limit = max(1, min(max_in_flight - 1, int(max_in_flight * entry_share)))
+        self.caller_max_entries = caller_max_entries
+        self.caller_window = caller_window_seconds
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.caller_entries: Dict[str, Deque[float]] = {}
+        self.rejections: Dict[str, int] = {CAPACITY: 0, CALLER_RATE: 0}
+        self.last_purge = time.monotonic()
+
+    def admit(self, is_entry: bool, phone: Optional[str]) -> Optional[str]:
+        """קבלת בקשה. מחזיר None אם התקבלה (ואז חובה לקרוא ל-release), אחרת את הסיבה"""
+        now = time.monotonic()
+        with self.lock:
+            limit = self.entry_limit if is_entry else self.max_in_flight
+            if self.in_flight >= limit:
+                return self._reject(CAPACITY)
+            if is_entry and phone and self.caller_max_entries > 0:
+                entries = self.caller_entries.setdefault(phone, deque())
+                while entries and now - entries[0] > self.caller_window:
+                    entries.popleft()
+                if len(entries) >= self.caller_max_entries:
+                    return self._reject(CALLER_RATE)
+                entries.append(now)
+                self._purge(now)
+            self.in_flight += 1
+            return None
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def _reject(self, reason: str) -> str:
+        self.rejections[reason] += 1
+        return reason
+
+    def _purge(self, now: float):
+        # מספרים שלא חייגו בחלון האחרון - פעם בחלון, כדי שהמילון לא יגדל בלי סוף
+        if now - self.last_purge < self.caller_window:
+            return
+        self.last_purge = now
+        for phone in [p for p, e in self.caller_entries.items() if not e or now - e[-1] > self.caller_window]:
+            del self.caller_entries[phone]
+
+    def in_flight_count(self) -> int:
+        with self.lock:
+            return self.in_flight
+
+    def rejection_counts(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.rejections)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+הפקת דיווחים שנתיים ברקע
+
+בקשה לדיווח נרשמת ב-annual_reports (status='requested') בזמן השיחה. העובד תופס
+מנות של בקשות יחד עם סיכום השנה של כל לקוח (customer_year_totals), מחשב את
+הפירוט החודשי לכל הדיווחים במנה בשאילתת GROUP BY אחת, מפיק את קבצי הדיווח
+במקביל בכמה תהליכים, ומעדכן את הסטטוס, report_data ו-report_file של כל המנה
+בטרנזקציה אחת.
+
+דיווח שנכשל או שנתקע ב-generating נתפס שוב אחרי חצי שעה, עד ANNUAL_REPORT_MAX_ATTEMPTS
+ניסיונות. העובד רק מפיק את הקובץ - שליחתו ללקוח (sent_at) אינה חלק ממנו.
+
+    python annual_report_worker.py run             # כל הבקשות הממתינות עכשיו (למשל מ-cron)
+    python annual_report_worker.py watch           # בדיקה כל ANNUAL_REPORT_POLL_SECONDS
+    python annual_report_worker.py verify-totals   # customer_year_totals מול חישוב מחדש מהקבלות
+    python annual_report_worker.py rebuild-totals  # בנייה מחדש של customer_year_totals
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import Config
+from database_handler import DatabaseHandler
+
+logger = logging.getLogger(__name__)
+
+
+def build_report_data(report: Dict[str, Any], totals: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """נתוני הדיווח: הסיכום השנתי מהדיווח שנתפס, והפירוט משורות הסטטוס והחודש של הלקוח"""
+    months = {month: {'month': month, 'receipts': 0, 'amount': 0.0} for month in range(1, 13)}
+    by_status = {}
+    for row in totals:
+        status = by_status.setdefault(row['status'], {'receipts': 0, 'amount': 0.0})
+        status['receipts'] += row['receipts']
+        status['amount'] += row['amount']
+        if row['status'] == 'completed' and row['month'] in months:
+            months[row['month']]['receipts'] += row['receipts']
+            months[row['month']]['amount'] += row['amount']
+
+    return {
+        'customer_id': report['customer_id'],
+        'report_year': report['report_year'],
+        'receipts': report['completed_count'],
+        'total_amount': report['completed_cents'] / 100,
+        'cancelled_receipts': report['cancelled_count'],
+        'cancelled_amount': report['cancelled_cents'] / 100,
+        'months': [{**m, 'amount': round(m['amount'], 2)} for m in months.values()],
+        'by_status': {s: {**v, 'amount': round(v['amount'], 2)} for s, v in sorted(by_status.items())}
+    }
+
+
+def report_path(output_dir: str, report: Dict[str, Any]) -> str:
+    return os.path.join(output_dir, str(report['report_year']), f"{report['customer_id']}.txt")
+
+
+def render_report(job: Dict[str, Any]) -> Tuple[int, Optional[str], Optional[str]]:
+    """כתיבת קובץ הדיווח (רץ בתהליך נפרד). מחזיר (report_id, נתיב, שגיאה)"""
+    data = job['data']
+    lines = [
+        f"דיווח שנתי {data['report_year']}",
+        f"לקוח: {job.get('name') or ''} ({job.get('phone_number') or ''})",
+        '',
+        f"קבלות שהופקו: {data['receipts']}",
+        f"סה\"כ: {data['total_amount']:.2f} ₪",
+        f"קבלות שבוטלו: {data['cancelled_receipts']} ({data['cancelled_amount']:.2f} ₪)",
+        '',
+        'פירוט חודשי:'
+    ]
+    lines.extend(f"  {m['month']:02d}  {m['receipts']:>4} קבלות  {m['amount']:>12.2f} ₪" for m in data['months'])
+
+    path = job['path']
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
+    except OSError as e:
+        return job['id'], None, str(e)
+    return job['id'], path, None
+
+
+class AnnualReportWorker:
+    """הפקת דיווחים שנתיים במנות"""
+
+    def __init__(self, db: DatabaseHandler = None, batch_size: int = None, processes: int = None,
+                 output_dir: str = None):
+        self.db = db or DatabaseHandler()
+        self.batch_size = batch_size or Config.ANNUAL_REPORT_BATCH_SIZE
+        processes = processes if processes is not None else Config.ANNUAL_REPORT_PROCESSES
+        self.processes = processes or os.cpu_count() or 1
+        self.output_dir = output_dir or Config.ANNUAL_REPORT_DIR
+
+    def run_batch(self, pool: ProcessPoolExecutor = None) -> Optional[Dict[str, int]]:
+        """מנה אחת: תפיסה, סיכום הקבלות בשאילתה אחת, הפקת הקבצים ועדכון במרוכז.
+        מחזיר None כשאין בקשות ממתינות"""
+        claim_token, reports = self.db.claim_annual_reports(self.batch_size)
+        if not reports:
+            return None
+
+        totals = {}
+        for row in self.db.get_claimed_report_receipt_totals(claim_token):
+            totals.setdefault(row['report_id'], []).append(row)
+
+        jobs = [{'id': report['id'], 'name': report['name'], 'phone_number': report['phone_number'],
+                 'path': report_path(self.output_dir, report),
+                 'data': build_report_data(report, totals.get(report['id'], []))}
+                for report in reports]
+        data = {job['id']: job['data'] for job in jobs}
+
+        if pool:
+            rendered = pool.map(render_report, jobs, chunksize=max(1, len(jobs) // (self.processes * 4)))
+        else:
+            rendered = map(render_report, jobs)
+
+        results = []
+        failed = 0
+        for report_id, path, error in rendered:
+            if error:
+                failed += 1
+                logger.error(f"שגיאה בהפקת דיווח {report_id}: {error}")
+            results.append((report_id, 'failed' if error else 'generated',
+                            json.dumps(data[report_id], ensure_ascii=False), path, error))
+        self.db.finish_annual_reports(claim_token, results)
+        return {'reports': len(results), 'generated': len(results) - failed, 'failed': failed}
+
+    def run(self) -> Dict[str, Any]:
+        """הפקת כל הדיווחים הממתינים. מחזיר סיכום עם קצב ההפקה"""
+        started = time.monotonic()
+        summary = {'batches': 0, 'reports': 0, 'generated': 0, 'failed': 0}
+
+        pool = ProcessPoolExecutor(max_workers=self.processes) if self.processes > 1 else None
+        try:
+            while True:
+                batch = self.run_batch(pool)
+                if batch is None:
+                    break
+                summary['batches'] += 1
+                for key, value in batch.items():
+                    summary[key] += value
+        finally:
+            if pool:
+                pool.shutdown()
+
+        duration = time.monotonic() - started
+        summary['processes'] = self.processes
+        summary['duration_seconds'] = round(duration, 3)
+        summary['reports_per_second'] = round(summary['reports'] / duration, 2) if duration else 0.0
+        if summary['reports']:
+            logger.info(f"הפקת דיווחים שנתיים הסתיימה: {summary}")
+        return summary
+
+    def run_forever(self, poll_seconds: float = None):
+        poll_seconds = poll_seconds if poll_seconds is not None else Config.ANNUAL_REPORT_POLL_SECONDS
+        while True:
+            try:
+                self.run()
+            except Exception as e:
+                logger.error(f"שגיאה בהפקת דיווחים שנתיים: {str(e)}", exc_info=True)
+            time.sleep(poll_seconds)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='הפקת דיווחים שנתיים')
+    parser.add_argument('command', choices=['run', 'watch', 'verify-totals', 'rebuild-totals'])
+    parser.add_argument('--processes', type=int, help='מספר תהליכי ההפקה (ברירת מחדל ANNUAL_REPORT_PROCESSES)')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=getattr(logging, Config.LOG_LEVEL),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    if args.command == 'verify-totals':
+        result = DatabaseHandler().verify_customer_year_totals()
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        if result['mismatches']:
+            raise SystemExit(1)
+    elif args.command == 'rebuild-totals':
+        print(json.dumps(DatabaseHandler().rebuild_customer_year_totals(), ensure_ascii=False, indent=2))
+    elif args.command == 'run':
+        print(json.dumps(AnnualReportWorker(processes=args.processes).run(), ensure_ascii=False, indent=2))
+    else:
+        AnnualReportWorker(processes=args.processes).run_forever()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+מצב הגשה אסינכרוני (ASGI) לנקודות הקצה של המרכזיה
+
+אותם נתיבים (/pbx, /pbx/menu/<menu_name>) ואותו פורמט תגובה כמו ב-cloud_pbx_server,
+אבל ההמתנה לפעולות מאגר ו-iCount לא תופסת worker שלם: הפעולות רצות במאגר
+ה-threads של ה-worker (get_pending_operations) ולולאת האירועים ממשיכה לקבל שיחות.
+
+הפעלה (worker אחד - ראו gunicorn.conf.py):
+    uvicorn asgi_pbx_server:app --host 0.0.0.0 --port 5000
+או:
+    gunicorn -k uvicorn.workers.UvicornWorker -w 1 asgi_pbx_server:app
+
+פעולות שחרגו מהתקציב (hold-and-poll) ו-current_calls נשמרים בזיכרון של התהליך,
+ולכן כמה workers דורשים ניתוב דביק לפי PBXcallId לפני השרת - אחרת הפנייה
+החוזרת מגיעה ל-worker שלא מכיר את הפעולה.
+"""
+
+import contextlib
+import json
+import logging
+from urllib.parse import parse_qsl
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+from starlette.routing import Route
+
+import cloud_pbx_server as pbx
+import metrics
+import tracing
+import request_profiler
+from health import liveness
+from recording_ingest import RecordingUpload, UPLOAD_TOKEN_HEADER, upload_authorized
+import staff_inbox
+from request_budget import RequestBudget, OperationInProgress
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class PBXJSONResponse(Response):
+    """תגובת JSON זהה לזו של jsonify ב-Flask (ממוינת, דחוסה, ASCII)"""
+    media_type = 'application/json'
+
+    def render(self, content) -> bytes:
+        return (json.dumps(content, ensure_ascii=True, sort_keys=True, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+async def request_params(request) -> dict:
+    """פרמטרים מה-query string, או מגוף POST (form / JSON)"""
+    if request.method == 'POST':
+        content_type = request.headers.get('content-type', '')
+        body = await request.body()
+        if 'application/x-www-form-urlencoded' in content_type and body:
+            return dict(parse_qsl(body.decode('utf-8'), keep_blank_values=True))
+        if 'application/json' in content_type and body:
+            try:
+                data = json.loads(body)
+                if isinstance(data, dict) and data:
+                    return data
+            except ValueError:
+                pass
+    return dict(request.query_params)
+
+
+async def serve_pbx_request(request, menu_name: str = None) -> Response:
+    """טיפול בבקשה מהמרכזיה בתוך תקציב הזמן, בלי לחסום את לולאת האירועים"""
+    with tracing.request_span('pbx_request', menu=menu_name), \
+            request_profiler.profile_request(pbx.get_config(), request.headers.get(request_profiler.HEADER),
+                                             request.query_params.get(request_profiler.QUERY_PARAM),
+                                             request.client.host if request.client else None) as profile:
+        budget = RequestBudget(pbx.get_config().PBX_REQUEST_BUDGET_SECONDS)
+        params, plan = {}, {}
+        admitted = False
+        try:
+            params = await request_params(request)
+            plan = pbx.plan_pbx_request(pbx.extract_call_params(params), menu_name)
+
+            if 'response' in plan:
+                pbx.record_pbx_request(request.method, params, plan, 'rejected', plan['status'],
+                                        budget.elapsed(), plan['response'])
+                return PBXJSONResponse(plan['response'], status_code=plan['status'])
+
+            if not pbx.admit_pbx_request(params, plan):
+                pbx.record_pbx_request(request.method, params, plan, 'shed', 200, budget.elapsed())
+                return PBXJSONResponse(pbx.system_busy_menu())
+            admitted = True
+
+            if plan.get('poll'):
+                found, done, result = await pbx.get_pending_operations().poll_async(plan['call_id'], budget.remaining())
+                response = pbx.pending_poll_response(plan['call_id'], found, done, result)
+                pbx.record_pbx_request(request.method, params, plan, 'poll', 200, budget.elapsed(), response)
+                return PBXJSONResponse(response)
+
+            done, result = await pbx.get_pending_operations().run_async(
+                plan['call_id'], plan['node'], pbx.profiled_operation(profile, plan), budget.remaining()
+            )
+            if not done:
+                pbx.record_pbx_request(request.method, params, plan, 'hold', 200, budget.elapsed())
+                return PBXJSONResponse(pbx.hold_menu())
+            pbx.record_pbx_request(request.method, params, plan, 'done', 200, budget.elapsed(), result)
+            return PBXJSONResponse(result)
+
+        except OperationInProgress as e:
+            # הקלט לא בוצע; בפנייה הבאה נאספת התוצאה של הפעולה שרצה
+            logger.warning(str(e))
+            pbx.record_pbx_request(request.method, params, plan, 'busy', 200, budget.elapsed())
+            return PBXJSONResponse(pbx.hold_menu())
+        except Exception as e:
+            logger.error(f"שגיאה בטיפול בפנייה: {str(e)}", exc_info=True)
+            pbx.record_pbx_request(request.method, params, plan, 'error', 500, budget.elapsed())
+            return PBXJSONResponse({"error": "שגיאה בטיפול בבקשה"}, status_code=500)
+        finally:
+            if admitted:
+                pbx.get_admission().release()
+
+
+async def handle_pbx_request(request):
+    """נקודת הכניסה הראשית לפניות מהמרכזיה"""
+    return await serve_pbx_request(request)
+
+
+async def handle_menu_choice(request):
+    """פנייה מהמרכזיה עם בחירה בתפריט מסוים"""
+    return await serve_pbx_request(request, request.path_params['menu_name'])
+
+
+async def upload_recording(request):
+    """העלאת קובץ ההקלטה של הודעה מהמרכזיה - הגוף נקרא בזרימה והכתיבה לדיסק רצה ב-thread"""
+    config = pbx.get_config()
+    if not upload_authorized(config, request.headers.get(UPLOAD_TOKEN_HEADER)):
+        return PBXJSONResponse({"error": "אין הרשאה"}, status_code=403)
+
+    length = request.headers.get('content-length', '')
+    upload = RecordingUpload(pbx.get_pbx_handler().db, request.path_params['message_id'],
+                             int(length) if length.isdigit() else None, config)
+    response = await run_in_threadpool(upload.begin)
+    if response is None:
+        error = None
+        try:
+            async for chunk in request.stream():
+                await run_in_threadpool(upload.feed, chunk)
+        except Exception as e:
+            error = e
+        response = await run_in_threadpool(upload.end, error)
+    status, body = response
+    return PBXJSONResponse(body, status_code=status)
+
+
+async def inbox_response(request, func, *args) -> Response:
+    """נתיב של תיבת ההודעות: בדיקת ה-token והרצת פעולת המאגר ב-thread"""
+    if not staff_inbox.inbox_authorized(pbx.get_config(), request.headers.get(staff_inbox.TOKEN_HEADER)):
+        return PBXJSONResponse({"error": "אין הרשאה"}, status_code=403)
+    status, body = await run_in_threadpool(func, pbx.get_pbx_handler().db, *args)
+    return PBXJSONResponse(body, status_code=status)
+
+
+async def inbox_messages(request):
+    """עמוד הודעות לצוות (keyset)"""
+    return await inbox_response(request, staff_inbox.list_inbox, request.query_params, pbx.get_config())
+
+
+async def inbox_transition(request):
+    """מעבר מנת הודעות לסטטוס הבא"""
+    try:
+        payload = json.loads(await request.body())
+    except ValueError:
+        payload = None
+    return await inbox_response(request, staff_inbox.transition, payload, pbx.get_config())
+
+
+async def inbox_unread(request):
+    """מספר ההודעות החדשות, מהמונים"""
+    return await inbox_response(request, staff_inbox.unread)
+
+
+async def metrics_endpoint(request):
+    """מדדים בפורמט הטקסט של Prometheus"""
+    return Response(metrics.render(), headers={'content-type': metrics.CONTENT_TYPE})
+
+
+async def healthz(request):
+    """בדיקת חיות - בלי מאגר ובלי רשת"""
+    return PBXJSONResponse(liveness())
+
+
+async def readyz(request):
+    """בדיקת מוכנות מהתוצאה האחרונה של בדיקות הרקע (503 כשלא מוכן)"""
+    # הקריאה הראשונה מריצה את בדיקת המאגר באופן סינכרוני - לא בלולאת האירועים
+    ready, details = await run_in_threadpool(lambda: pbx.get_health().readiness())
+    return PBXJSONResponse(details, status_code=200 if ready else 503)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # המצב המשותף (הגדרות, מבנה המאגר, תפריטים - init_worker מריץ את init_shared בפעם הראשונה)
+    # ומשאבי ה-worker נוצרים בעליית השרת ולא בייבוא, בלי ליצור את אפליקציית Flask
+    pbx.init_worker()
+    yield
+
+
+app = Starlette(lifespan=lifespan, routes=[
+    Route('/pbx', handle_pbx_request, methods=['GET', 'POST']),
+    Route('/pbx/menu/{menu_name}', handle_menu_choice, methods=['GET', 'POST']),
+    Route('/recordings/{message_id:int}', upload_recording, methods=['POST']),
+    Route('/inbox/messages', inbox_messages, methods=['GET']),
+    Route('/inbox/messages/transition', inbox_transition, methods=['POST']),
+    Route('/inbox/unread', inbox_unread, methods=['GET']),
+    Route('/metrics', metrics_endpoint, methods=['GET']),
+    Route('/healthz', healthz, methods=['GET']),
+    Route('/readyz', readyz, methods=['GET']),
+])
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host=Config.HOST, port=Config.PORT)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+אורך הקלטה מכותרות הקובץ, בלי לפענח את השמע
+
+    WAV - קצב הבתים מ-fmt וגודל ה-data (גם RF64, וגם data בגודל 0/לא ידוע
+          כפי שכותבות מרכזיות שמקליטות בזרימה - לפי גודל הקובץ)
+    MP3 - מספר המסגרות מכותרת Xing/Info/VBRI, ובלעדיה (CBR) לפי קצב הסיביות
+          של המסגרת הראשונה וגודל הקובץ
+
+נקרא רק מה שצריך (עם seek על פני הנתונים), כך שאפשר לבדוק גם את תחילת
+הקובץ בזמן ההורדה, עם הגודל הצפוי מ-Content-Length.
+"""
+
+import struct
+from typing import BinaryIO, Optional, Tuple
+
+# מספיק לכותרות בכל המקרים הרגילים (ID3 עם תמונה גדולה - לא יזוהה מוקדם, רק בסוף)
+HEADER_BYTES = 64 * 1024
+
+_MP3_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_MP3_SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 25: (11025, 12000, 8000)}
+
+
+def _wav_duration(f: BinaryIO, total_size: Optional[int]) -> Optional[float]:
+    riff = f.read(12)
+    if len(riff) < 12 or riff[:4] not in (b'RIFF', b'RF64') or riff[8:12] != b'WAVE':
+        return None
+
+    byte_rate = None
+    ds64_data_size = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            return None
+        chunk_id, size = chunk[:4], struct.unpack('<I', chunk[4:])[0]
+        if chunk_id == b'fmt ':
+            fmt = f.read(min(size, 16))
+            if len(fmt) < 12:
+                return None
+            byte_rate = struct.unpack('<I', fmt[8:12])[0]
+            f.seek(size - len(fmt) + (size & 1), 1)
+        elif chunk_id == b'ds64':
+            ds64 = f.read(min(size, 16))
+            if len(ds64) == 16:
+                ds64_data_size = struct.unpack('<Q', ds64[8:16])[0]
+            f.seek(size - len(ds64) + (size & 1), 1)
+        elif chunk_id == b'data':
+            data_offset = f.tell()
+            if size == 0xFFFFFFFF:
+                size = ds64_data_size
+            available = total_size - data_offset if total_size is not None else None
+            # גודל לא ידוע (הקלטה בזרימה) או קובץ קטוע - לפי מה שבפועל בקובץ
+            if not size or (available is not None and size > available):
+                size = available
+            if not byte_rate or size is None:
+                return None
+            return size / byte_rate
+        else:
+            f.seek(size + (size & 1), 1)
+
+
+def _mp3_frame(header: bytes) -> Optional[Tuple[int, int, int, int, int, int]]:
+    """(גרסה, שכבה, קצב סיביות, קצב דגימה, דגימות למסגרת, אורך מסגרת) או None"""
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = {3: 1, 2: 2, 0: 25}.get((header[1] >> 3) & 3)
+    layer = {3: 1, 2: 2, 1: 3}.get((header[1] >> 1) & 3)
+    bitrate_index, rate_index = header[2] >> 4, (header[2] >> 2) & 3
+    if version is None or layer is None or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    bitrate = _MP3_BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+    padding = (header[2] >> 1) & 1
+    if layer == 1:
+        samples, length = 384, (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 1152 if layer == 2 or version == 1 else 576
+        length = samples // 8 * bitrate // sample_rate + padding
+    return version, layer, bitrate, sample_rate, samples, length
+
+
+def _mp3_duration(f: BinaryIO, total_size: Optional[int]) -> Optional[float]:
+    start = 0
+    id3 = f.read(10)
+    if id3[:3] == b'ID3' and len(id3) == 10:
+        size = (id3[6] & 0x7F) << 21 | (id3[7] & 0x7F) << 14 | (id3[8] & 0x7F) << 7 | (id3[9] & 0x7F)
+        start = 10 + size + (10 if id3[5] & 0x10 else 0)
+    f.seek(start)
+    buf = f.read(8192)
+
+    # המסגרת הראשונה: סנכרון שמאומת על ידי כותרת תקינה גם במסגרת שאחריה
+    for i in range(len(buf) - 3):
+        frame = _mp3_frame(buf[i:i + 4])
+        if not frame:
+            continue
+        following = buf[i + frame[5]:i + frame[5] + 4]
+        if len(following) == 4 and not _mp3_frame(following):
+            continue
+        break
+    else:
+        return None
+    version, layer, bitrate, sample_rate, samples, _ = frame
+
+    mono = buf[i + 3] >> 6 == 3
+    side_info = (17 if mono else 32) if version == 1 else (9 if mono else 17)
+    xing = i + 4 + side_info
+    if buf[xing:xing + 4] in (b'Xing', b'Info') and len(buf) >= xing + 12:
+        flags = struct.unpack('>I', buf[xing + 4:xing + 8])[0]
+        if flags & 1:
+            frames = struct.unpack('>I', buf[xing + 8:xing + 12])[0]
+            return frames * samples / sample_rate
+    vbri = i + 36
+    if buf[vbri:vbri + 4] == b'VBRI' and len(buf) >= vbri + 18:
+        frames = struct.unpack('>I', buf[vbri + 14:vbri + 18])[0]
+        return frames * samples / sample_rate
+
+    if total_size is None:
+        return None
+    return (total_size - start - i) * 8 / bitrate
+
+
+def probe_duration(f: BinaryIO, total_size: int = None) -> Tuple[Optional[str], Optional[float]]:
+    """(פורמט, אורך בשניות) מכותרות הקובץ. total_size - גודל הקובץ המלא אם ידוע
+    (נדרש ל-WAV בזרימה ול-MP3 בלי כותרת Xing)"""
+    f.seek(0)
+    magic = f.read(4)
+    f.seek(0)
+    if magic in (b'RIFF', b'RF64'):
+        return 'wav', _wav_duration(f, total_size)
+    if magic[:3] == b'ID3' or _mp3_frame(magic):
+        return 'mp3', _mp3_duration(f, total_size)
+    return None, None
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+הפקת דיווחים שנתיים: קצב הפקה (דיווחים לשנייה) של annual_report_worker
+
+המאגר נבנה כמו ב-db_micro_bench ומקבל קבלות על פני שלוש שנים. נמדדים:
+    - סיכומי הקבלות של מנה: שאילתה לכל לקוח מול GROUP BY אחד למנה (ובדיקה שהתוצאות זהות)
+    - הפקה מלאה של דיווח לכל לקוח, בתהליך אחד ובכמה תהליכים
+
+    python benchmarks/annual_report_bench.py --size 100000 --output reports.json
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from bench_utils import environment_metadata
+from db_micro_bench import build_database
+
+from annual_report_worker import AnnualReportWorker
+from database_handler import DatabaseHandler
+
+SEED = 4242
+REPORT_YEAR = 2025
+
+
+def build_reports_database(path: str, size: int, receipts_per_customer: int):
+    """מאגר המדידה של db_micro_bench עם קבלות לכל לקוח (2024-2026)"""
+    if os.path.exists(path):
+        return
+    base = os.path.join(os.path.dirname(path), f'micro_{size}.db')
+    build_database(base, size)
+    tmp_path = path + '.building'
+    shutil.copyfile(base, tmp_path)
+    DatabaseHandler(tmp_path)
+
+    rng = random.Random(SEED)
+    statuses = ['completed'] * 8 + ['cancelled', 'failed']
+    conn = sqlite3.connect(tmp_path)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    chunk = 20000
+    for start in range(1, size + 1, chunk):
+        conn.executemany(
+            '''INSERT INTO receipts (customer_id, receipt_data, amount, status, created_at)
+               VALUES (?, '{}', ?, ?, ?)''',
+            ((customer_id, rng.randint(50, 5000), rng.choice(statuses),
+              f"{rng.randint(REPORT_YEAR - 1, REPORT_YEAR + 1)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} "
+              f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00")
+             for customer_id in range(start, min(size + 1, start + chunk))
+             for _ in range(receipts_per_customer))
+        )
+        conn.commit()
+    conn.close()
+    os.replace(tmp_path, path)
+
+
+def request_all(path: str, size: int):
+    """בקשת דיווח לכל הלקוחות (מחליף הפקות קודמות)"""
+    conn = sqlite3.connect(path)
+    conn.execute('DELETE FROM annual_reports')
+    conn.executemany("INSERT INTO annual_reports (customer_id, report_year, status) VALUES (?, ?, 'requested')",
+                     ((customer_id, REPORT_YEAR) for customer_id in range(1, size + 1)))
+    conn.commit()
+    conn.close()
+
+
+def per_customer_totals(db: DatabaseHandler, reports):
+    """הדרך הישנה: שאילתה נפרדת לכל לקוח"""
+    conn = db.get_connection()
+    totals = []
+    for report in reports:
+        rows = conn.execute('''
+            SELECT status, CAST(strftime('%m', created_at) AS INTEGER) AS month,
+                   COUNT(*) AS receipts, COALESCE(SUM(amount), 0) AS amount
+            FROM receipts
+            WHERE customer_id = ? AND created_at >= ? AND created_at < ?
+            GROUP BY status, month
+        ''', (report['customer_id'], f"{report['report_year']}-01-01",
+              f"{report['report_year'] + 1}-01-01")).fetchall()
+        totals.extend((report['id'], row['status'], row['month'], row['receipts'], row['amount']) for row in rows)
+    conn.close()
+    return totals
+
+
+def best_of(func, *args, repeat: int = 3):
+    """התוצאה והזמן הקצר מבין כמה הרצות (בלי השפעת מטמון קר על הראשונה)"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='קצב הפקת דיווחים שנתיים')
+    parser.add_argument('--size', type=int, default=100000)
+    parser.add_argument('--receipts', type=int, default=12, help='קבלות ללקוח')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    path = os.path.join(args.data_dir, f'reports_{args.size}_{args.receipts}.db')
+    build_reports_database(path, args.size, args.receipts)
+    db = DatabaseHandler(path)
+
+    # סיכומי מנה אחת: שאילתה לכל לקוח מול GROUP BY אחד
+    request_all(path, args.size)
+    claim_token, reports = db.claim_annual_reports(args.batch_size)
+    grouped, grouped_seconds = best_of(db.get_claimed_report_receipt_totals, claim_token)
+    single, single_seconds = best_of(per_customer_totals, db, reports)
+    mismatches = len(set(single) ^ {(r['report_id'], r['status'], r['month'], r['receipts'], r['amount'])
+                                    for r in grouped})
+    print(f"סיכומי מנה ({len(reports)} דיווחים): שאילתה ללקוח {single_seconds * 1000:.1f}ms  "
+          f"GROUP BY {grouped_seconds * 1000:.1f}ms  אי-התאמות: {mismatches}")
+
+    runs = {}
+    output_dir = tempfile.mkdtemp(prefix='annual-reports-')
+    try:
+        for processes in sorted({1, args.processes}):
+            request_all(path, args.size)
+            worker = AnnualReportWorker(db, batch_size=args.batch_size, processes=processes, output_dir=output_dir)
+            summary = worker.run()
+            runs[processes] = summary
+            print(f"הפקה: {summary['reports']} דיווחים, {processes} תהליכים - {summary['duration_seconds']:.2f}s "
+                  f"({summary['reports_per_second']:.0f} דיווחים לשנייה, {summary['failed']} נכשלו)")
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    report = {
+        'environment': environment_metadata(),
+        'settings': vars(args),
+        'batch_totals': {'reports': len(reports), 'per_customer_seconds': single_seconds,
+                         'group_by_seconds': grouped_seconds, 'mismatches': mismatches},
+        'runs': runs
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if mismatches:
+        raise SystemExit(1)
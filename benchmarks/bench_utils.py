@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""פונקציות עזר משותפות לסקריפטי המדידה"""
+
+import asyncio
+import os
+import platform
+import sys
+from datetime import datetime
+from typing import Dict, Any, List
+
+# הסקריפטים רצים מתוך benchmarks/ - מוסיפים את שורש הפרויקט לנתיב הייבוא
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """אחוזון מתוך רשימה ממוינת (שיטת nearest-rank)"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """סיכום השהיות בשניות לאלפיות שנייה"""
+    values = sorted(latencies)
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean_ms': sum(values) / len(values) * 1000,
+        'p50_ms': percentile(values, 50) * 1000,
+        'p95_ms': percentile(values, 95) * 1000,
+        'p99_ms': percentile(values, 99) * 1000,
+        'max_ms': values[-1] * 1000
+    }
+
+
+def environment_metadata() -> Dict[str, Any]:
+    """פרטי הסביבה שבה רצה המדידה"""
+    import sqlite3
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'sqlite': sqlite3.sqlite_version
+    }
+
+
+async def http_get(host: str, port: int, path: str, timeout: float):
+    """בקשת GET מינימלית (ללא תלות בספריות חיצוניות). מחזיר (קוד, גוף)"""
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        data = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    head, _, body = data.partition(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1]) if head else 0
+    return status, body
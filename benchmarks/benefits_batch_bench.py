@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+חישוב זכויות לכל הלקוחות: המסלול הבודד (BenefitsCalculator לכל לקוח) מול האצווה (NumPy)
+
+המאגר נבנה כמו ב-db_micro_bench (אותו seed ואותו קובץ ב-data-dir). נמדדים:
+    - חישוב בלי שמירה: טעינת עמודות JSON וחישוב בודד, מול iter_benefits (דמי הלידה
+      נסכמים במאגר מ-customer_children), ובדיקה שהתוצאות זהות
+    - מקצה לקצה: טעינה במנות, חישוב ושמירה ל-customer_benefits (באצווה דמי הלידה
+      נסכמים במאגר מ-customer_children), ובדיקה שהשמור זהה לחישוב הבודד
+
+    python benchmarks/benefits_batch_bench.py --size 1000000 --output benefits.json
+"""
+
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+from itertools import chain
+
+from bench_utils import environment_metadata
+from db_micro_bench import build_database
+
+from benefit_rules import rules_for_year
+from benefits_batch import as_benefit_dicts, iter_benefits, recalculate_all
+from database_handler import DatabaseHandler
+from icount_handler import BenefitsCalculator
+
+
+def scalar_benefits(spouse1, spouse2, children):
+    return [BenefitsCalculator.calculate_total_benefits({
+        'spouse1_workplaces': s1, 'spouse2_workplaces': s2, 'children_birth_years': c
+    }) for s1, s2, c in zip(spouse1, spouse2, children)]
+
+
+def recalculate_scalar(db: DatabaseHandler, chunk_size: int, year: int) -> int:
+    """מקצה לקצה במסלול הבודד, עם אותה טעינה ושמירה כמו באצווה"""
+    customers = 0
+    version = BenefitsCalculator.rules_version()
+    for customer_ids, spouse1, spouse2, children, updated_at in db.iter_customer_details_columns(chunk_size):
+        results = scalar_benefits(spouse1, spouse2, children)
+        db.save_customer_benefits([(cid, r['work_benefit'], r['birth_benefit'], r['total_benefit'], year, version,
+                                    details_updated_at)
+                                   for cid, r, details_updated_at in zip(customer_ids, results, updated_at)])
+        customers += len(results)
+    return customers
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='חישוב זכויות: בודד מול אצווה')
+    parser.add_argument('--size', type=int, default=1000000)
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    path = os.path.join(args.data_dir, f'micro_{args.size}.db')
+    build_database(path, args.size)
+    # מאגר שנבנה לפני customer_benefits - השלמת המבנה
+    db = DatabaseHandler(path)
+    # החישוב הבודד משתמש בשנה הנוכחית - גם האצווה
+    year = datetime.now().year
+
+    columns, load_seconds = timed(lambda: [c for c in db.iter_customer_details_columns(args.chunk_size)])
+    spouse1 = [v for chunk in columns for v in chunk[1]]
+    spouse2 = [v for chunk in columns for v in chunk[2]]
+    children = [v for chunk in columns for v in chunk[3]]
+    print(f"טעינה: {len(children)} לקוחות ב-{load_seconds:.2f}s")
+
+    scalar, scalar_seconds = timed(scalar_benefits, spouse1, spouse2, children)
+    scalar_seconds += load_seconds
+    chunks, batch_seconds = timed(lambda: list(iter_benefits(db, rules_for_year(year), args.chunk_size)))
+    batch = list(chain.from_iterable(as_benefit_dicts(work, birth, total) for _, work, birth, total, _ in chunks))
+    mismatches = sum(1 for a, b in zip(scalar, batch) if a != b) + abs(len(scalar) - len(batch))
+    print(f"טעינה וחישוב: בודד {scalar_seconds:.2f}s  אצווה {batch_seconds:.2f}s  "
+          f"(פי {scalar_seconds / batch_seconds:.1f})  אי-התאמות: {mismatches}")
+
+    _, scalar_e2e = timed(recalculate_scalar, db, args.chunk_size, year)
+    summary, batch_e2e = timed(recalculate_all, db, args.chunk_size, year)
+    conn = db.get_connection()
+    stored = conn.execute('SELECT work_benefit, birth_benefit, total_benefit FROM customer_benefits '
+                          'ORDER BY customer_id').fetchall()
+    conn.close()
+    stored_mismatches = sum(1 for a, b in zip(scalar, stored)
+                            if (a['work_benefit'], a['birth_benefit'], a['total_benefit']) != tuple(b))
+    stored_mismatches += abs(len(scalar) - len(stored))
+    print(f"מקצה לקצה (טעינה, חישוב, שמירה): בודד {scalar_e2e:.2f}s  אצווה {batch_e2e:.2f}s  "
+          f"(פי {scalar_e2e / batch_e2e:.1f})  אי-התאמות: {stored_mismatches}")
+
+    report = {
+        'environment': environment_metadata(),
+        'settings': vars(args),
+        'customers': len(children),
+        'load_seconds': load_seconds,
+        'compute': {'scalar_seconds': scalar_seconds, 'batch_seconds': batch_seconds, 'mismatches': mismatches},
+        'end_to_end': {'scalar_seconds': scalar_e2e, 'batch_seconds': batch_e2e, 'chunks': summary['chunks'],
+                       'mismatches': stored_mismatches}
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if mismatches or stored_mismatches:
+        raise SystemExit(1)
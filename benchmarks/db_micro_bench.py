@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+מיקרו-מדידות לנתיבים החמים של DatabaseHandler ו-BenefitsCalculator
+
+המאגר נבנה בכל גודל (לקוחות, פרטים ושיחות) עם seed קבוע ונשמר ב-data-dir.
+לפני כל ריצה המאגר השמור מעודכן למבנה הנוכחי (init_database) והמקרים רצים על
+עותק שלו, כך שריצות חוזרות מודדות על אותם נתונים. כל מקרה נמדד פעולה-פעולה.
+
+    python benchmarks/db_micro_bench.py --sizes 1000,100000,1000000 --output before.json
+    python benchmarks/db_micro_bench.py --output after.json
+    python benchmarks/db_micro_bench.py --compare before.json after.json --threshold 0.10
+
+בהשוואה: מקרה שה-p50 שלו עלה ביותר מהסף מסומן כנסיגה, וקוד היציאה הוא 1.
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import time
+import uuid
+from typing import Callable, Dict, List
+
+from bench_utils import latency_summary, environment_metadata
+
+from database_handler import DatabaseHandler
+from icount_handler import BenefitsCalculator
+
+SEED = 20240601
+
+
+def phone_for(index: int) -> str:
+    return f"05{index:08d}"
+
+
+def call_id_for(index: int) -> str:
+    return f"bench-call-{index}"
+
+
+def build_database(path: str, size: int):
+    """מאגר עם size לקוחות (עם פרטים) ו-size שיחות"""
+    if os.path.exists(path):
+        return
+    rng = random.Random(SEED)
+    tmp_path = path + '.building'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    DatabaseHandler(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    chunk = 50000
+    for start in range(0, size, chunk):
+        rows = range(start, min(size, start + chunk))
+        conn.executemany(
+            '''INSERT INTO customers (phone_number, name, subscription_start_date, subscription_end_date)
+               VALUES (?, ?, '2024-01-01', '2030-12-31')''',
+            ((phone_for(i), f"לקוח {i}") for i in rows)
+        )
+        conn.executemany(
+            '''INSERT INTO customer_details
+               (customer_id, num_children, children_birth_years, spouse1_workplaces, spouse2_workplaces)
+               VALUES (?, ?, ?, ?, ?)''',
+            ((i + 1, n, json.dumps([rng.randint(1995, 2024) for _ in range(n)]),
+              rng.randint(0, 2), rng.randint(0, 2))
+             for i, n in ((i, rng.randint(0, 5)) for i in rows))
+        )
+        conn.executemany(
+            '''INSERT INTO calls (call_id, phone_number, call_type, call_status, call_data)
+               VALUES (?, ?, 'incoming', 'CALL', ?)''',
+            ((call_id_for(i), phone_for(i), json.dumps({'mainMenu': '1'})) for i in rows)
+        )
+        conn.commit()
+    conn.close()
+    # הפרטים נכתבו ישירות - customer_children מתמלאת מה-JSON כמו במאגר קיים
+    DatabaseHandler(tmp_path, initialize=False).backfill_customer_children()
+    os.replace(tmp_path, path)
+
+
+def measure(func: Callable[[int], None], iterations: int, warmup: int) -> Dict:
+    for i in range(warmup):
+        func(i)
+    latencies = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        op_started = time.perf_counter()
+        func(i)
+        latencies.append(time.perf_counter() - op_started)
+    total = time.perf_counter() - started
+    return {**latency_summary(latencies), 'ops_per_second': iterations / total if total else 0}
+
+
+def prepare_run_copy(path: str) -> str:
+    """עדכון המאגר השמור למבנה הנוכחי (מאגר שנבנה לפני שינוי סכמה) והעתק לריצה -
+    מקרי הכתיבה לא משנים את הנתונים של הריצה הבאה"""
+    DatabaseHandler(path)
+    run_path = f"{path}.run-{os.getpid()}"
+    shutil.copyfile(path, run_path)
+    return run_path
+
+
+def run_size(path: str, size: int, iterations: int, benefit_iterations: int, warmup: int) -> List[Dict]:
+    db = DatabaseHandler(path, initialize=False)
+    rng = random.Random(SEED + size)
+    customers = [rng.randrange(size) for _ in range(iterations + warmup)]
+    run_id = uuid.uuid4().hex[:8]
+    receipt_ids = []
+
+    def create_receipt(i):
+        receipt_ids.append(db.create_receipt(customers[i] + 1, call_id_for(customers[i]),
+                                             {'amount': 100 + i, 'description': 'bench'}))
+
+    cases = {
+        'get_customer_by_phone': lambda i: db.get_customer_by_phone(phone_for(customers[i])),
+        'log_call': lambda i: db.log_call({'PBXcallId': f"bench-new-{run_id}-{i}",
+                                           'PBXphone': phone_for(customers[i]),
+                                           'PBXcallType': 'incoming', 'PBXcallStatus': 'CALL'}),
+        'update_call_data': lambda i: db.update_call_data(call_id_for(customers[i]), {'receiptAmount': str(i)}),
+        'create_receipt': create_receipt,
+        'update_receipt': lambda i: db.update_receipt(receipt_ids[i % len(receipt_ids)], status='completed',
+                                                      icount_doc_num=str(i)),
+        'update_customer_details': lambda i: db.update_customer_details(customers[i] + 1, num_children=i % 6,
+                                                                        spouse1_workplaces=i % 3),
+        'get_customer_year_totals': lambda i: db.get_customer_year_totals(customers[i] + 1),
+    }
+
+    results = []
+    for name, func in cases.items():
+        result = measure(func, iterations, warmup)
+        results.append({'size': size, 'case': name, 'iterations': iterations, **result})
+        print(f"{size:>9} {name:<26} p50={result['p50_ms']:8.4f}ms p95={result['p95_ms']:8.4f}ms "
+              f"{result['ops_per_second']:10.0f} ops/s")
+
+    details = [db.get_customer_details(c + 1) or {} for c in customers[:1000]]
+    result = measure(lambda i: BenefitsCalculator.calculate_total_benefits(details[i % len(details)]),
+                     benefit_iterations, warmup)
+    results.append({'size': size, 'case': 'calculate_total_benefits', 'iterations': benefit_iterations, **result})
+    print(f"{size:>9} {'calculate_total_benefits':<26} p50={result['p50_ms']:8.4f}ms "
+          f"p95={result['p95_ms']:8.4f}ms {result['ops_per_second']:10.0f} ops/s")
+    return results
+
+
+def compare(old_path: str, new_path: str, threshold: float) -> int:
+    """השוואת שתי ריצות לפי p50. מחזיר את מספר הנסיגות"""
+    with open(old_path, encoding='utf-8') as f:
+        old = {(r['size'], r['case']): r for r in json.load(f)['results']}
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)['results']
+
+    regressions = 0
+    for result in new:
+        before = old.get((result['size'], result['case']))
+        if not before or not before['p50_ms']:
+            continue
+        change = (result['p50_ms'] - before['p50_ms']) / before['p50_ms']
+        flag = ''
+        if change > threshold:
+            flag = '  << נסיגה'
+            regressions += 1
+        print(f"{result['size']:>9} {result['case']:<26} {before['p50_ms']:8.4f}ms -> "
+              f"{result['p50_ms']:8.4f}ms ({change:+.1%}){flag}")
+    print(f"{regressions} נסיגות מעל {threshold:.0%}")
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='מיקרו-מדידות למאגר ולחישוב הזכויות')
+    parser.add_argument('--sizes', default='1000,100000,1000000')
+    parser.add_argument('--iterations', type=int, default=2000)
+    parser.add_argument('--benefit-iterations', type=int, default=100000)
+    parser.add_argument('--warmup', type=int, default=100)
+    parser.add_argument('--data-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+    parser.add_argument('--output')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    parser.add_argument('--threshold', type=float, default=0.10)
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(args.compare[0], args.compare[1], args.threshold) else 0)
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = []
+    for size in (int(x) for x in args.sizes.split(',')):
+        path = os.path.join(args.data_dir, f'micro_{size}.db')
+        started = time.perf_counter()
+        build_database(path, size)
+        run_path = prepare_run_copy(path)
+        print(f"מאגר {size}: {time.perf_counter() - started:.1f}s ({path})")
+        try:
+            results.extend(run_size(run_path, size, args.iterations, args.benefit_iterations, args.warmup))
+        finally:
+            for leftover in (run_path, run_path + '-journal'):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+    report = {'environment': environment_metadata(), 'settings': vars(args), 'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
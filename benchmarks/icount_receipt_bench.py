@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+מדידת תפוקה והשהיות של יצירת קבלות מול iCount (בדרך כלל מול icount_mock_server.py)
+
+    python icount_mock_server.py --latency-dist lognormal --latency-ms 120 --latency-jitter 0.5 --seed 1 &
+    python benchmarks/icount_receipt_bench.py --url http://127.0.0.1:5050 --requests 2000 --concurrency 16
+"""
+
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_utils import latency_summary, environment_metadata
+
+from config import Config
+from icount_handler import ICountHandler
+
+
+def run(url: str, total: int, concurrency: int) -> dict:
+    Config.ICOUNT_API_URL = url
+    handler = ICountHandler()
+    latencies = []
+    failures = {}
+    lock = threading.Lock()
+
+    def one(i: int):
+        started = time.perf_counter()
+        result = handler.create_receipt({
+            'amount': 100 + i % 50,
+            'description': 'bench',
+            'client_name': 'bench',
+            'client_phone': '0500000000'
+        })
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            if not result.get('status'):
+                message = result.get('message', 'unknown')
+                failures[message] = failures.get(message, 0) + 1
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    wall = time.perf_counter() - wall_start
+
+    return {
+        'environment': environment_metadata(),
+        'url': url,
+        'requests': total,
+        'concurrency': concurrency,
+        'wall_seconds': wall,
+        'throughput_rps': total / wall if wall else 0,
+        'latency': latency_summary(latencies),
+        'failures': failures,
+        'error_rate': sum(failures.values()) / total if total else 0
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='מדידת יצירת קבלות מול iCount')
+    parser.add_argument('--url', default='http://127.0.0.1:5050')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--output', help='שמירת התוצאות כקובץ JSON')
+    args = parser.parse_args()
+
+    report = run(args.url, args.requests, args.concurrency)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+מחולל עומס: שיחות וירטואליות שעוברות מסלולי IVR מלאים מול /pbx
+
+כל שיחה וירטואלית בוחרת תרחיש, שולחת את רצף הפניות שהמרכזיה שולחת
+(פרמטרי PBX וכל הקלטים שנאספו בשיחה, האחרון ראשון), וממתינה "זמן מתקשר"
+אקראי בין תפריט לתפריט. התפריט שחוזר נבדק מול התפריט הצפוי בכל שלב;
+תפריט המתנה (pleaseWait) מטופל כמו במרכזיה - פנייה חוזרת אחרי ה-timeout.
+
+    # לקוחות עם מנוי בתוקף במאגר של השרת
+    python benchmarks/ivr_load_test.py --prepare-db pbx_system.db --subscribers 5000
+
+    python benchmarks/ivr_load_test.py --url http://127.0.0.1:5000 \\
+        --levels 100,500,1000,2000,4000 --duration 60 --think-mean 3 --output load.json
+
+לכל רמת מקביליות: שיחות ופניות לשנייה, p50/p95/p99 לכל שלב, שיעור שגיאות
+ושיעור תפריטים לא צפויים. נקודת הרוויה היא הרמה האחרונה שבה התפוקה עוד
+עלתה ו-p95 ושיעור השגיאות עמדו בסף.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+from typing import Dict, List, Tuple
+from urllib.parse import urlencode, urlsplit
+
+from bench_utils import latency_summary, environment_metadata, http_get
+
+SUBSCRIBER_PREFIX = '058'
+
+# צעד בתרחיש: (שם הקלט, ערך, התפריטים הצפויים בתגובה). קלט None = פנייה ראשונית
+Step = Tuple[str, str, Tuple[str, ...]]
+
+
+def registration_steps(rng: random.Random) -> List[Step]:
+    return [
+        (None, None, ('newCustomer',)),
+        ('newCustomer', '1', ('newCustomerID',)),
+        ('newCustomerID', str(rng.randint(100000000, 999999999)), ('customerName',)),
+        ('customerName', str(rng.randint(1000, 99999999)), ('registrationComplete',)),
+    ]
+
+
+def receipt_steps(rng: random.Random) -> List[Step]:
+    return [
+        (None, None, ('mainMenu',)),
+        ('mainMenu', '1', ('receiptAmount',)),
+        ('receiptAmount', str(rng.randint(50, 2000)), ('receiptDescription',)),
+        ('receiptDescription', str(rng.randint(1, 99)), ('receiptSuccess', 'receiptPending', 'receiptQueued')),
+    ]
+
+
+def details_steps(rng: random.Random, max_children: int) -> List[Step]:
+    children = rng.randint(1, max_children)
+    steps = [
+        (None, None, ('mainMenu',)),
+        ('mainMenu', '3', ('numChildren',)),
+        ('numChildren', str(children), ('child_birth_year_1',)),
+    ]
+    for child in range(1, children + 1):
+        expected = f'child_birth_year_{child + 1}' if child < children else 'spouse1_workplaces'
+        steps.append((f'child_birth_year_{child}', str(rng.randint(2005, 2024)), (expected,)))
+    steps += [
+        ('spouse1_workplaces', str(rng.randint(0, 3)), ('spouse2_workplaces',)),
+        ('spouse2_workplaces', str(rng.randint(0, 3)), ('detailsUpdated',)),
+    ]
+    return steps
+
+
+def message_steps(rng: random.Random) -> List[Step]:
+    return [
+        (None, None, ('mainMenu',)),
+        ('mainMenu', '5', ('customerMessage',)),
+        ('customerMessage', f'recordings/{uuid.uuid4().hex}.wav', ('messageReceived',)),
+    ]
+
+
+def annual_report_steps(rng: random.Random) -> List[Step]:
+    return [
+        (None, None, ('mainMenu',)),
+        ('mainMenu', '6', ('annualReport',)),
+        ('annualReport', '1', ('reportRequested',)),
+    ]
+
+
+SCENARIOS = {
+    'registration': registration_steps,
+    'receipt': receipt_steps,
+    'details': lambda rng, max_children=4: details_steps(rng, max_children),
+    'message': message_steps,
+    'annual_report': annual_report_steps,
+}
+
+
+def step_key(scenario: str, input_name: str) -> str:
+    if input_name and input_name.startswith('child_birth_year_'):
+        input_name = 'child_birth_year'
+    return f"{scenario}:{input_name or 'entry'}"
+
+
+class LevelStats:
+    """תוצאות של רמת מקביליות אחת"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.requests = 0
+        self.errors = 0
+        self.unexpected = 0
+        self.holds = 0
+        self.calls_completed: Dict[str, int] = {}
+        self.calls_failed: Dict[str, Dict[str, int]] = {}
+
+    def call_finished(self, scenario: str, outcome: str):
+        if outcome == 'ok':
+            self.calls_completed[scenario] = self.calls_completed.get(scenario, 0) + 1
+        else:
+            failed = self.calls_failed.setdefault(scenario, {})
+            failed[outcome] = failed.get(outcome, 0) + 1
+
+    def record(self, key: str, latency: float):
+        self.latencies.setdefault(key, []).append(latency)
+        self.requests += 1
+
+    def summary(self, concurrency: int, wall: float) -> Dict:
+        all_latencies = [value for values in self.latencies.values() for value in values]
+        calls = sum(self.calls_completed.values())
+        return {
+            'concurrency': concurrency,
+            'requests': self.requests,
+            'requests_per_second': self.requests / wall if wall else 0,
+            'calls_completed': calls,
+            'calls_per_second': calls / wall if wall else 0,
+            'calls_by_scenario': dict(self.calls_completed),
+            'calls_failed_by_scenario': self.calls_failed,
+            'error_rate': self.errors / self.requests if self.requests else 0,
+            'unexpected_menu_rate': self.unexpected / self.requests if self.requests else 0,
+            'holds': self.holds,
+            'latency': latency_summary(all_latencies),
+            'steps': {key: latency_summary(values) for key, values in sorted(self.latencies.items())}
+        }
+
+
+class VirtualCaller:
+    def __init__(self, args, stats: LevelStats, rng: random.Random, semaphore: asyncio.Semaphore = None):
+        parts = urlsplit(args.url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.args = args
+        self.stats = stats
+        self.rng = rng
+        self.semaphore = semaphore
+        self.mix = [(name, weight) for name, weight in parse_mix(args.mix).items() if weight > 0]
+
+    def think_time(self) -> float:
+        """זמן מתקשר (הקראת התפריט והקשה) - התפלגות לוג-נורמלית סביב הממוצע"""
+        mean = self.args.think_mean
+        if mean <= 0:
+            return 0.0
+        sigma = self.args.think_sigma
+        return self.rng.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma)
+
+    async def request(self, params: Dict) -> Tuple[int, Dict]:
+        path = f"/pbx?{urlencode(params)}"
+        if self.semaphore:
+            async with self.semaphore:
+                status, body = await http_get(self.host, self.port, path, self.args.timeout)
+        else:
+            status, body = await http_get(self.host, self.port, path, self.args.timeout)
+        try:
+            return status, json.loads(body)
+        except ValueError:
+            return status, {}
+
+    async def run_call(self, scenario: str) -> str:
+        """שיחה אחת. מחזיר 'ok', 'error' (תקלה/שגיאת שרת) או 'unexpected' (תפריט לא צפוי)"""
+        if scenario == 'registration':
+            phone = '059' + ''.join(self.rng.choice('0123456789') for _ in range(7))
+        else:
+            phone = f"{SUBSCRIBER_PREFIX}{self.rng.randrange(self.args.subscribers):07d}"
+        base = {'PBXcallId': uuid.uuid4().hex, 'PBXphone': phone, 'PBXcallType': 'incoming',
+                'PBXdid': '0773000000', 'PBXcallStatus': 'CALL'}
+        collected: List[Tuple[str, str]] = []
+
+        for input_name, value, expected in SCENARIOS[scenario](self.rng):
+            if input_name:
+                # המרכזיה שולחת את כל מה שנאסף בשיחה - הקלט האחרון ראשון
+                collected.insert(0, (input_name, value))
+            params = {**dict(collected), **base}
+            key = step_key(scenario, input_name)
+
+            while True:
+                started = time.perf_counter()
+                try:
+                    status, menu = await self.request(params)
+                except Exception:
+                    self.stats.record(key, time.perf_counter() - started)
+                    self.stats.errors += 1
+                    return 'error'
+                self.stats.record(key, time.perf_counter() - started)
+
+                if status != 200 or menu.get('name') == 'systemError' or 'error' in menu:
+                    self.stats.errors += 1
+                    return 'error'
+                if menu.get('name') != 'pleaseWait':
+                    break
+                # תפריט המתנה: המרכזיה פונה שוב אחרי ה-timeout שלו
+                self.stats.holds += 1
+                await asyncio.sleep(menu.get('timeout', 5) * self.args.hold_scale)
+                params = {'pleaseWait': '1', **base}
+                key = step_key(scenario, 'pleaseWait')
+
+            if menu.get('name') not in expected:
+                self.stats.unexpected += 1
+                return 'unexpected'
+            await asyncio.sleep(self.think_time())
+        return 'ok'
+
+    async def run(self, deadline: float):
+        names = [name for name, _ in self.mix]
+        weights = [weight for _, weight in self.mix]
+        # פיזור תחילת השיחות כדי שלא יתחילו כולן באותו רגע
+        await asyncio.sleep(self.rng.uniform(0, self.args.think_mean))
+        while time.monotonic() < deadline:
+            scenario = self.rng.choices(names, weights)[0]
+            self.stats.call_finished(scenario, await self.run_call(scenario))
+
+
+async def run_level(args, concurrency: int, seed: int) -> Dict:
+    stats = LevelStats()
+    semaphore = asyncio.Semaphore(args.max_inflight) if args.max_inflight else None
+    deadline = time.monotonic() + args.duration
+    callers = [VirtualCaller(args, stats, random.Random(seed * 100003 + i), semaphore) for i in range(concurrency)]
+    started = time.perf_counter()
+    await asyncio.gather(*(caller.run(deadline) for caller in callers))
+    return stats.summary(concurrency, time.perf_counter() - started)
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in SCENARIOS:
+            raise SystemExit(f"תרחיש לא מוכר: {name} (אפשרויות: {', '.join(SCENARIOS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def find_saturation(results: List[Dict], slo_p95_ms: float, max_error_rate: float, min_gain: float) -> Dict:
+    """הרמה האחרונה שבה התפוקה עוד עלתה והשהיה ושגיאות בתוך הסף"""
+    best, previous = None, None
+    for result in results:
+        within_slo = (result['latency'].get('p95_ms', 0) <= slo_p95_ms
+                      and result['error_rate'] <= max_error_rate)
+        gained = previous is None or result['requests_per_second'] >= previous['requests_per_second'] * (1 + min_gain)
+        if not within_slo or not gained:
+            return {'saturated': True, 'last_good_concurrency': best and best['concurrency'],
+                    'max_requests_per_second': best and best['requests_per_second'],
+                    'reason': 'slo' if not within_slo else 'throughput_plateau',
+                    'at_concurrency': result['concurrency']}
+        best = previous = result
+    return {'saturated': False, 'last_good_concurrency': best and best['concurrency'],
+            'max_requests_per_second': best and best['requests_per_second']}
+
+
+def prepare_db(path: str, subscribers: int):
+    """יצירת לקוחות עם מנוי בתוקף (טלפונים 058xxxxxxx) במאגר של השרת"""
+    from database_handler import DatabaseHandler
+    db = DatabaseHandler(path)
+    end = time.strftime('%Y-%m-%d', time.localtime(time.time() + 365 * 86400))
+    conn = db.get_connection()
+    try:
+        conn.executemany(
+            '''INSERT OR IGNORE INTO customers
+               (phone_number, name, subscription_start_date, subscription_end_date, is_active)
+               VALUES (?, ?, date('now'), ?, 1)''',
+            ((f"{SUBSCRIBER_PREFIX}{i:07d}", f"לקוח עומס {i}", end) for i in range(subscribers))
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    print(f"{subscribers} לקוחות מוכנים ב-{path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='מחולל עומס לשיחות IVR')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--levels', default='50,100,250,500,1000,2000')
+    parser.add_argument('--duration', type=float, default=60, help='שניות לכל רמה')
+    parser.add_argument('--mix', default='registration=1,receipt=4,details=2,message=1,annual_report=1')
+    parser.add_argument('--subscribers', type=int, default=1000, help='מספר לקוחות 058xxxxxxx במאגר')
+    parser.add_argument('--think-mean', type=float, default=3.0, help='זמן מתקשר ממוצע בין תפריטים (שניות)')
+    parser.add_argument('--think-sigma', type=float, default=0.5)
+    parser.add_argument('--hold-scale', type=float, default=1.0, help='מכפיל ל-timeout של תפריט ההמתנה')
+    parser.add_argument('--max-inflight', type=int, default=0, help='תקרת חיבורים פתוחים (0 = ללא)')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--slo-p95-ms', type=float, default=1000)
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--min-gain', type=float, default=0.05, help='עלייה מינימלית בתפוקה בין רמות')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--prepare-db', metavar='PATH', help='רק יצירת לקוחות במאגר ויציאה')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    if args.prepare_db:
+        prepare_db(args.prepare_db, args.subscribers)
+        return
+    parse_mix(args.mix)
+
+    results = []
+    for index, level in enumerate(int(x) for x in args.levels.split(',')):
+        result = asyncio.run(run_level(args, level, args.seed + index))
+        results.append(result)
+        latency = result['latency']
+        print(f"{level:6d} calls: {result['requests_per_second']:8.1f} req/s  {result['calls_per_second']:6.1f} calls/s  "
+              f"p50={latency.get('p50_ms', 0):7.1f}ms p95={latency.get('p95_ms', 0):7.1f}ms "
+              f"p99={latency.get('p99_ms', 0):7.1f}ms  errors={result['error_rate']:.2%}  "
+              f"unexpected={result['unexpected_menu_rate']:.2%}")
+
+    saturation = find_saturation(results, args.slo_p95_ms, args.max_error_rate, args.min_gain)
+    print(f"רוויה: {saturation}")
+
+    report = {
+        'environment': environment_metadata(),
+        'settings': {key: value for key, value in vars(args).items() if key != 'prepare_db'},
+        'saturation': saturation,
+        'levels': results
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
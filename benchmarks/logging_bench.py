@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+השהיית בקשות תחת עומס: לוג דרך תור (QueueListener) מול כתיבה ישירה
+
+כל מצב רץ בתהליך נפרד (הגדרות הלוג גלובליות לתהליך) עם מאגר ולוג זמניים.
+threads מקבילים שולחים רצף שיחה (כניסה ותפריט ראשי) דרך ה-test client של Flask.
+
+    python benchmarks/logging_bench.py --threads 16 --calls 200
+    python benchmarks/logging_bench.py --log-dir /mnt/slow-disk --dump-rate 0.05
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from bench_utils import PROJECT_ROOT, latency_summary, environment_metadata
+
+CHILD_CODE = '''
+import json, sys, threading, time, uuid
+import cloud_pbx_server as pbx
+
+threads, calls = int(sys.argv[1]), int(sys.argv[2])
+app = pbx.create_app()
+pbx.get_pbx_handler().db.create_customer('0501234567', 'bench')
+latencies, lock = [], threading.Lock()
+
+def caller():
+    client = app.test_client()
+    local = []
+    for _ in range(calls):
+        base = {'PBXcallId': uuid.uuid4().hex, 'PBXphone': '0501234567'}
+        for params in (base, dict(base, mainMenu='1')):
+            started = time.perf_counter()
+            client.get('/pbx', query_string=params)
+            local.append(time.perf_counter() - started)
+    with lock:
+        latencies.extend(local)
+
+wall = time.perf_counter()
+workers = [threading.Thread(target=caller) for _ in range(threads)]
+for t in workers: t.start()
+for t in workers: t.join()
+wall = time.perf_counter() - wall
+print(json.dumps({'latencies': latencies, 'wall': wall}))
+'''
+
+
+def run_mode(queue_enabled: bool, args, log_dir: str, round_index: int = 0):
+    # מאגר ולוג חדשים לכל סבב (הלקוח נוצר מחדש בכל תהליך)
+    env = dict(os.environ,
+               DATABASE_PATH=os.path.join(log_dir, f'bench_{round_index}_{queue_enabled}.db'),
+               LOG_FILE=os.path.join(log_dir, f'bench_{round_index}_{queue_enabled}.log'),
+               LOG_QUEUE_ENABLED=str(queue_enabled),
+               LOG_DUMP_SAMPLE_RATE=str(args.dump_rate),
+               CANCELLATION_WORKER_ENABLED='False')
+    proc = subprocess.run([sys.executable, '-c', CHILD_CODE, str(args.threads), str(args.calls)],
+                          cwd=PROJECT_ROOT, env=env, capture_output=True, text=True, check=True)
+    data = json.loads(proc.stdout.strip().splitlines()[-1])
+    return {
+        'log_queue': queue_enabled,
+        'requests': len(data['latencies']),
+        'requests_per_second': len(data['latencies']) / data['wall'],
+        'latency': latency_summary(data['latencies'])
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='השהיית בקשות: לוג דרך תור מול כתיבה ישירה')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--calls', type=int, default=200, help='שיחות לכל thread')
+    parser.add_argument('--dump-rate', type=float, default=0.01)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--log-dir', help='תיקיית הלוג (למשל דיסק איטי); ברירת מחדל: תיקייה זמנית')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.log_dir) as log_dir:
+        for round_index in range(args.rounds):
+            for queue_enabled in (True, False):
+                result = run_mode(queue_enabled, args, log_dir, round_index)
+                results.append(result)
+                latency = result['latency']
+                print(f"queue={queue_enabled!s:5}  {result['requests_per_second']:8.1f} req/s  "
+                      f"p50={latency['p50_ms']:6.2f}ms  p95={latency['p95_ms']:6.2f}ms  p99={latency['p99_ms']:6.2f}ms")
+
+    report = {'environment': environment_metadata(), 'threads': args.threads, 'runs': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+השוואת שיחות מקבילות לליבה: Flask/gunicorn מול מצב ASGI
+
+מריצים את iCount המדומה עם השהיה, ואז כל שרת בתורו עם worker אחד (hold-and-poll
+נשמר בזיכרון של התהליך - כמה workers דורשים ניתוב דביק לפי PBXcallId):
+
+    python icount_mock_server.py --latency-dist lognormal --latency-ms 300 --latency-jitter 0.4 --seed 1 &
+    export ICOUNT_API_URL=http://127.0.0.1:5050 RECEIPT_SUBMISSION_MODE=immediate
+    export ADMISSION_CALLER_MAX_ENTRIES=1000000  # כל השיחות מגיעות מאותו מספר
+
+    gunicorn -w 1 -k gthread --threads 32 -b 127.0.0.1:5000 cloud_pbx_server:app
+    python benchmarks/pbx_concurrency_bench.py --url http://127.0.0.1:5000 --label flask
+
+    uvicorn asgi_pbx_server:app --port 5000
+    python benchmarks/pbx_concurrency_bench.py --url http://127.0.0.1:5000 --label asgi
+
+תוצאות שנמדדו: benchmarks/results/pbx_concurrency.md
+
+כל "שיחה" שולחת את רצף הפניות של הנפקת קבלה. הרמה המקסימלית שעומדת ב-SLO
+(p95 והשגיאות, כולל תפריט העומס) מחולקת במספר הליבות של השרת.
+"""
+
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from urllib.parse import urlencode, urlsplit
+
+from bench_utils import latency_summary, environment_metadata, http_get
+
+
+def receipt_call_steps(phone: str):
+    """רצף הפניות של שיחת הנפקת קבלה"""
+    call_id = uuid.uuid4().hex
+    base = {'PBXcallId': call_id, 'PBXphone': phone, 'PBXcallType': 'incoming'}
+    return [
+        base,
+        {**base, 'mainMenu': '1'},
+        {**base, 'receiptAmount': '120'},
+        {**base, 'receiptDescription': '7', 'receiptAmount': '120'},
+    ]
+
+
+async def run_level(url: str, concurrency: int, duration: float, phone: str, timeout: float):
+    """הרצת concurrency שיחות במקביל למשך duration שניות"""
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    latencies, errors, completed = [], 0, 0
+    deadline = time.monotonic() + duration
+
+    async def caller():
+        nonlocal errors, completed
+        while time.monotonic() < deadline:
+            for params in receipt_call_steps(phone):
+                started = time.perf_counter()
+                try:
+                    status, body = await http_get(host, port, f"/pbx?{urlencode(params)}", timeout)
+                    # תפריט עומס (פנייה שנדחתה ב-admission) אינו שיחה שקיבלה שירות
+                    if status != 200 or b'systemError' in body or b'systemBusy' in body:
+                        errors += 1
+                except Exception:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+            completed += 1
+
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(caller() for _ in range(concurrency)))
+    wall = time.perf_counter() - wall_start
+
+    return {
+        'concurrency': concurrency,
+        'calls_completed': completed,
+        'requests': len(latencies),
+        'requests_per_second': len(latencies) / wall if wall else 0,
+        'error_rate': errors / len(latencies) if latencies else 0,
+        'latency': latency_summary(latencies)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='השוואת שיחות מקבילות לליבה')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--label', default='server')
+    parser.add_argument('--levels', default='8,16,32,64,128,256')
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--server-cores', type=int, default=1)
+    parser.add_argument('--phone', default='0501234567', help='טלפון של לקוח קיים עם מנוי בתוקף')
+    parser.add_argument('--slo-p95-ms', type=float, default=3000)
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    results = []
+    for level in [int(x) for x in args.levels.split(',')]:
+        result = asyncio.run(run_level(args.url, level, args.duration, args.phone, args.timeout))
+        results.append(result)
+        print(f"[{args.label}] {level:5d} calls: {result['requests_per_second']:8.1f} req/s  "
+              f"p95={result['latency'].get('p95_ms', 0):8.1f}ms  errors={result['error_rate']:.2%}")
+
+    passing = [r['concurrency'] for r in results
+               if r['latency'].get('p95_ms', 0) <= args.slo_p95_ms and r['error_rate'] <= args.max_error_rate]
+    best = max(passing) if passing else 0
+    report = {
+        'label': args.label,
+        'environment': environment_metadata(),
+        'server_cores': args.server_cores,
+        'slo': {'p95_ms': args.slo_p95_ms, 'max_error_rate': args.max_error_rate},
+        'max_concurrent_calls_within_slo': best,
+        'concurrent_calls_per_core': best / args.server_cores,
+        'levels': results
+    }
+    print(f"[{args.label}] שיחות מקבילות לליבה בתוך ה-SLO: {report['concurrent_calls_per_core']:.1f}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+זמן עלייה של השרת ופרופיל זמני ייבוא
+
+כל סבב מריץ תהליך Python חדש (כמו worker חדש) ומודד:
+ייבוא המודול, יצירת האפליקציה, ואתחול משאבי ה-worker.
+הפרופיל נלקח מ-python -X importtime - המודולים הכבדים ביותר לפי זמן מצטבר.
+
+    python benchmarks/startup_bench.py --rounds 10 --output startup.json
+    python benchmarks/startup_bench.py --baseline startup.json   # השוואה למדידה קודמת
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from bench_utils import PROJECT_ROOT, latency_summary, environment_metadata
+
+# קוד שרץ בתהליך הנמדד. מדפיס את הזמנים כשורת JSON אחרונה
+CHILD_CODE = '''
+import json, sys, time
+started = time.perf_counter()
+import {module} as target
+imported = time.perf_counter()
+app = {app_expr}
+created = time.perf_counter()
+import cloud_pbx_server
+cloud_pbx_server.init_worker()
+ready = time.perf_counter()
+print(json.dumps({{
+    'import': imported - started,
+    'create_app': created - imported,
+    'init_worker': ready - created,
+    'total': ready - started,
+    'flask_loaded': 'flask' in sys.modules,
+    'requests_loaded': 'requests' in sys.modules
+}}))
+'''
+
+TARGETS = {
+    'flask': ('cloud_pbx_server', 'target.app'),
+    'asgi': ('asgi_pbx_server', 'target.app'),
+}
+
+
+def run_child(module: str, app_expr: str, env: dict, importtime: bool = False):
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ['-X', 'importtime']
+    cmd += ['-c', CHILD_CODE.format(module=module, app_expr=app_expr)]
+    proc = subprocess.run(cmd, cwd=PROJECT_ROOT, env=env, capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout.strip().splitlines()[-1]), proc.stderr
+
+
+def import_profile(stderr: str, top: int):
+    """המודולים עם הזמן המצטבר הגבוה ביותר מפלט -X importtime"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace('import time:', '|').split('|')]
+        rows.append({'module': name, 'self_ms': int(self_us) / 1000, 'cumulative_ms': int(cumulative_us) / 1000})
+    rows.sort(key=lambda r: r['cumulative_ms'], reverse=True)
+    return rows[:top]
+
+
+def measure(label: str, rounds: int, top: int, env: dict):
+    module, app_expr = TARGETS[label]
+    timings = {'import': [], 'create_app': [], 'init_worker': [], 'total': []}
+    flags = {}
+    for _ in range(rounds):
+        result, _ = run_child(module, app_expr, env)
+        for key in timings:
+            timings[key].append(result[key])
+        flags = {'flask_loaded': result['flask_loaded'], 'requests_loaded': result['requests_loaded']}
+
+    _, stderr = run_child(module, app_expr, env, importtime=True)
+    return {
+        'target': label,
+        'module': module,
+        'rounds': rounds,
+        **{f'{key}_ms': latency_summary(values) for key, values in timings.items()},
+        **flags,
+        'import_profile': import_profile(stderr, top)
+    }
+
+
+def compare(current: dict, baseline: dict):
+    old = {r['target']: r for r in baseline['results']}
+    for result in current['results']:
+        before = old.get(result['target'])
+        if not before:
+            continue
+        for key in ('import_ms', 'total_ms'):
+            a, b = before[key].get('p50_ms', 0), result[key].get('p50_ms', 0)
+            change = (b - a) / a if a else 0
+            print(f"[{result['target']}] {key} p50: {a:.1f}ms -> {b:.1f}ms ({change:+.1%})")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='זמן עלייה ופרופיל ייבוא')
+    parser.add_argument('--targets', default='flask,asgi')
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--top', type=int, default=15, help='מספר מודולים בפרופיל הייבוא')
+    parser.add_argument('--baseline', help='קובץ JSON של מדידה קודמת להשוואה')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # מאגר ולוג זמניים - לא נוגעים בנתונים האמיתיים
+        env = dict(os.environ,
+                   DATABASE_PATH=os.path.join(tmp, 'startup.db'),
+                   LOG_FILE=os.path.join(tmp, 'startup.log'),
+                   CANCELLATION_WORKER_ENABLED='False')
+        results = []
+        for label in args.targets.split(','):
+            result = measure(label, args.rounds, args.top, env)
+            results.append(result)
+            print(f"[{label}] import p50={result['import_ms'].get('p50_ms', 0):.1f}ms  "
+                  f"ready p50={result['total_ms'].get('p50_ms', 0):.1f}ms  "
+                  f"flask={result['flask_loaded']} requests={result['requests_loaded']}")
+            for row in result['import_profile'][:5]:
+                print(f"    {row['cumulative_ms']:8.1f}ms  {row['module']}")
+
+    report = {'environment': environment_metadata(), 'results': results}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            compare(report, json.load(f))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+מדידת זמן הקמת worker של gunicorn, עם preload ובלעדיו
+
+    python benchmarks/worker_spawn_bench.py --workers 4 --rounds 3
+
+הזמן נמדד ב-gunicorn.conf.py מ-pre_fork ועד סיום post_worker_init
+(כולל יצירת משאבי ה-worker), ונקרא מהלוג של gunicorn.
+"""
+
+import argparse
+import json
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from bench_utils import PROJECT_ROOT, environment_metadata
+
+SPAWN_LINE = re.compile(r'worker spawn: pid=(\d+) preload=(\w+) ms=([\d.]+)')
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def measure(preload: bool, workers: int, timeout: float) -> dict:
+    env = dict(os.environ,
+               GUNICORN_PRELOAD='true' if preload else 'false',
+               WEB_CONCURRENCY=str(workers),
+               HOST='127.0.0.1',
+               PORT=str(free_port()),
+               CANCELLATION_WORKER_ENABLED='False')
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'cloud_pbx_server:app'],
+        cwd=PROJECT_ROOT, env=env, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True
+    )
+    spawn_ms = []
+    try:
+        deadline = time.monotonic() + timeout
+        while len(spawn_ms) < workers and time.monotonic() < deadline:
+            line = proc.stderr.readline()
+            if not line:
+                break
+            match = SPAWN_LINE.search(line)
+            if match:
+                spawn_ms.append(float(match.group(3)))
+        all_ready = time.perf_counter() - started
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=30)
+
+    return {
+        'preload': preload,
+        'workers_ready': len(spawn_ms),
+        'spawn_ms': spawn_ms,
+        'mean_spawn_ms': sum(spawn_ms) / len(spawn_ms) if spawn_ms else None,
+        'max_spawn_ms': max(spawn_ms) if spawn_ms else None,
+        'all_workers_ready_seconds': all_ready
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='זמן הקמת worker של gunicorn')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    runs = []
+    for _ in range(args.rounds):
+        for preload in (True, False):
+            result = measure(preload, args.workers, args.timeout)
+            runs.append(result)
+            print(f"preload={preload!s:5}  mean={result['mean_spawn_ms'] or 0:8.1f}ms  "
+                  f"max={result['max_spawn_ms'] or 0:8.1f}ms  all ready={result['all_workers_ready_seconds']:.2f}s")
+
+    report = {'environment': environment_metadata(), 'workers': args.workers, 'runs': runs}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
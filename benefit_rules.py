@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+כללי הזכויות לפי שנת מס (BENEFIT_RULES_FILE, ברירת מחדל benefit_rules.json)
+
+לכל שנה טבלה עם גרסה:
+    work_tiers      - סכום מענק העבודה לפי מספר מקומות העבודה (מ-min_workplaces ומעלה)
+    birth_brackets  - סכום דמי הלידה לילד לפי גיל בשנת המס (min_age עד max_age;
+                      בלי min_age - גם ילד שנולד אחרי שנת המס)
+
+בטעינה כל שנה מהודרת לטבלאות חיפוש: סכום לפי מספר מקומות עבודה וסכום לפי
+שנת לידה, כך שחישוב ללקוח הוא כמה גישות לפי אינדקס. שנה בלי טבלה משתמשת
+בשנה האחרונה שלפניה (או בראשונה בקובץ). שינוי כללים נעשה בהוספת שנה או בהעלאת הגרסה שלה -
+טבלאות של שנים קודמות לא משתנות, כך שחישובים ישנים ניתנים לשחזור.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+from config import Config
+
+_lock = threading.Lock()
+_tables = {'years': None}
+_compiled: Dict[int, 'RuleSet'] = {}
+# הכללים של השנה הנוכחית עד תחילת השנה הבאה - בלי datetime.now() בכל חישוב
+_current = {'rules': None, 'until': 0.0}
+
+
+class RuleSet:
+    """כללי שנת מס אחת אחרי הידור לטבלאות חיפוש"""
+
+    __slots__ = ('tax_year', 'source_year', 'version', 'work_amounts', 'first_birth_year',
+                 'birth_amounts', 'rules_version')
+
+    def __init__(self, tax_year: int, source_year: int, table: Dict):
+        self.tax_year = tax_year
+        self.source_year = source_year
+        self.version = int(table['version'])
+
+        # work_amounts[n] - הסכום ל-n מקומות עבודה (האחרון חל גם על יותר)
+        tiers = sorted(table['work_tiers'], key=lambda t: t['min_workplaces'])
+        top = max([t['min_workplaces'] for t in tiers] + [0])
+        amounts = [0.0] * (top + 1)
+        for tier in tiers:
+            for count in range(max(0, tier['min_workplaces']), top + 1):
+                amounts[count] = float(tier['amount'])
+        self.work_amounts = tuple(amounts)
+
+        # birth_amounts לפי שנת לידה, מ-first_birth_year: האינדקס הראשון - מבוגר מכל
+        # הטווחים (0), והאחרון - נולד אחרי שנת המס
+        brackets = table['birth_brackets']
+        oldest = max([b['max_age'] for b in brackets] + [-1])
+        self.first_birth_year = tax_year - oldest - 1
+        amounts = []
+        for birth_year in range(self.first_birth_year, tax_year + 2):
+            age = tax_year - birth_year
+            amounts.append(next((float(b['amount']) for b in brackets
+                                 if age <= b['max_age'] and (b.get('min_age') is None or age >= b['min_age'])),
+                                0.0))
+        self.birth_amounts = tuple(amounts)
+
+        fingerprint = hashlib.sha256(json.dumps(table, sort_keys=True).encode('utf-8')).hexdigest()[:8]
+        self.rules_version = f"{source_year}.{self.version}-{fingerprint}"
+
+    def work_benefit(self, total_workplaces: int) -> float:
+        amounts = self.work_amounts
+        if total_workplaces >= len(amounts):
+            return amounts[-1]
+        return amounts[total_workplaces] if total_workplaces > 0 else amounts[0]
+
+    def birth_amount(self, birth_year: int) -> float:
+        index = min(max(birth_year - self.first_birth_year, 0), len(self.birth_amounts) - 1)
+        return self.birth_amounts[index]
+
+    def birth_benefit(self, children_birth_years: list) -> float:
+        """סכום דמי הלידה לכל הילדים (שנת לידה לא תקינה לא נספרת)"""
+        amounts = self.birth_amounts
+        first, last = self.first_birth_year, len(amounts) - 1
+        total = 0
+        for birth_year in children_birth_years:
+            try:
+                index = int(birth_year) - first
+            except (ValueError, TypeError):
+                continue
+            total += amounts[0 if index < 0 else last if index > last else index]
+        return total
+
+
+def load_tables(path: str = None) -> Dict[int, Dict]:
+    """טבלאות הכללים מהקובץ, לפי שנת מס"""
+    path = path or getattr(Config, 'BENEFIT_RULES_FILE', None) or \
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benefit_rules.json')
+    with open(path, encoding='utf-8') as f:
+        years = {int(year): table for year, table in json.load(f).items()}
+    if not years:
+        raise ValueError(f"אין כללי זכויות ב-{path}")
+    return years
+
+
+def rules_for_year(tax_year: Optional[int] = None) -> RuleSet:
+    """הכללים המהודרים לשנת מס (ברירת מחדל: השנה הנוכחית). נטען ומהודר פעם אחת לכל שנה"""
+    if tax_year is None:
+        if time.time() < _current['until']:
+            return _current['rules']
+        tax_year = datetime.now().year
+        rules = rules_for_year(tax_year)
+        _current.update(rules=rules, until=datetime(tax_year + 1, 1, 1).timestamp())
+        return rules
+
+    rules = _compiled.get(tax_year)
+    if rules is not None:
+        return rules
+
+    with _lock:
+        if _tables['years'] is None:
+            _tables['years'] = load_tables()
+        years = _tables['years']
+        earlier = [year for year in years if year <= tax_year]
+        source_year = max(earlier) if earlier else min(years)
+        rules = _compiled[tax_year] = RuleSet(tax_year, source_year, years[source_year])
+    return rules
+
+
+def reload_rules():
+    """קריאה מחדש של קובץ הכללים (אחרי עדכון)"""
+    with _lock:
+        _tables['years'] = None
+        _compiled.clear()
+        _current.update(rules=None, until=0.0)
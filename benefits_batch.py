@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+חישוב זכויות לכל הלקוחות באצווה (NumPy)
+
+אותם כללים כמו BenefitsCalculator.calculate_total_benefits (טבלאות החיפוש של
+שנת המס מ-benefit_rules), אבל על מנה של לקוחות בבת אחת: דמי הלידה נסכמים במאגר
+מ-customer_children מול טבלת הסכומים לפי שנת לידה, מענק העבודה מחושב כגישה
+לטבלה לפי אינדקס, והתוצאות נשמרות ב-customer_benefits בטרנזקציה אחת לכל מנה,
+עם השנה וגרסת הכללים.
+
+    python benefits_batch.py run                  # חישוב מחדש לכל הלקוחות
+    python benefits_batch.py refresh              # רק אם הכללים או השנה השתנו (למשל מ-cron)
+    python benefits_batch.py export --year 2025 --output benefits_2025.csv   # שנת מס קודמת, בלי לשמור
+    python benefits_batch.py backfill-children    # מילוי customer_children מחדש מה-JSON
+    python benefits_batch.py children --year 2020 # כמה ילדים (ולקוחות) לפי שנת לידה
+
+לקוח שעדכן פרטים מאבד את הזכויות השמורות ומחושב מחדש בשיחה הבאה שלו.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+from benefit_rules import RuleSet, rules_for_year
+from database_handler import DatabaseHandler
+
+logger = logging.getLogger(__name__)
+
+def work_benefits(rules: RuleSet, spouse1_workplaces: Sequence[int],
+                  spouse2_workplaces: Sequence[int]) -> np.ndarray:
+    """מענק עבודה לכל לקוח - אינדקס בטבלה לפי מספר מקומות העבודה"""
+    total = np.asarray(spouse1_workplaces, dtype=np.int64) + np.asarray(spouse2_workplaces, dtype=np.int64)
+    amounts = np.asarray(rules.work_amounts)
+    return amounts[np.clip(total, 0, len(amounts) - 1)]
+
+
+def iter_benefits(db: DatabaseHandler, rules: RuleSet, chunk_size: int = 50000):
+    """(customer_ids, מענק עבודה, דמי לידה, סה"כ, details_updated_at) לכל מנה; דמי הלידה מסוכמים במאגר"""
+    for customer_ids, spouse1, spouse2, birth, updated_at in db.iter_benefit_columns(rules.first_birth_year,
+                                                                                    rules.birth_amounts, chunk_size):
+        work = work_benefits(rules, spouse1, spouse2)
+        birth = np.asarray(birth, dtype=np.float64)
+        yield customer_ids, work, birth, work + birth, updated_at
+
+
+def recalculate_all(db: DatabaseHandler = None, chunk_size: int = 50000, tax_year: int = None) -> Dict[str, Any]:
+    """חישוב מחדש ושמירה של הזכויות של כל הלקוחות, מנה אחר מנה"""
+    db = db or DatabaseHandler()
+    tax_year = tax_year or datetime.now().year
+    rules = rules_for_year(tax_year)
+    rules_version = rules.rules_version
+    started = time.perf_counter()
+    customers = chunks = skipped = 0
+
+    for customer_ids, work, birth, total, updated_at in iter_benefits(db, rules, chunk_size):
+        rows = list(zip(customer_ids, work.tolist(), birth.tolist(), total.tolist(),
+                        [tax_year] * len(customer_ids), [rules_version] * len(customer_ids), updated_at))
+        saved = db.save_customer_benefits(rows)
+        customers += saved
+        # לקוחות שעדכנו פרטים בזמן החישוב - יחושבו מחדש בשיחה הבאה שלהם
+        skipped += len(rows) - saved
+        chunks += 1
+
+    duration = time.perf_counter() - started
+    logger.info(f"חושבו זכויות ל-{customers} לקוחות ב-{chunks} מנות ({duration:.1f}s), {skipped} דולגו")
+    return {'customers': customers, 'skipped': skipped, 'chunks': chunks, 'tax_year': tax_year,
+            'rules_version': rules_version, 'duration_seconds': duration}
+
+
+def refresh_if_stale(db: DatabaseHandler = None, chunk_size: int = 50000) -> Dict[str, Any]:
+    """חישוב מחדש של כולם אם יש זכויות שמורות משנה אחרת או מגרסת כללים אחרת"""
+    db = db or DatabaseHandler()
+    tax_year = datetime.now().year
+    stale = db.count_stale_benefits(tax_year, rules_for_year(tax_year).rules_version)
+    if not stale:
+        return {'stale': 0}
+    logger.info(f"{stale} זכויות שמורות לא עדכניות - חישוב מחדש לכל הלקוחות")
+    return {'stale': stale, **recalculate_all(db, chunk_size, tax_year)}
+
+
+def export_year(path: str, tax_year: int, db: DatabaseHandler = None, chunk_size: int = 50000) -> Dict[str, Any]:
+    """הזכויות של כל הלקוחות לשנת מס מסוימת לקובץ CSV (customer_benefits לא משתנה)"""
+    db = db or DatabaseHandler()
+    rules = rules_for_year(tax_year)
+    customers = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['customer_id', 'work_benefit', 'birth_benefit', 'total_benefit'])
+        for customer_ids, work, birth, total, _ in iter_benefits(db, rules, chunk_size):
+            writer.writerows(zip(customer_ids, work.tolist(), birth.tolist(), total.tolist()))
+            customers += len(customer_ids)
+    return {'customers': customers, 'tax_year': tax_year, 'rules_version': rules.rules_version, 'path': path}
+
+
+def as_benefit_dicts(work: np.ndarray, birth: np.ndarray, total: np.ndarray) -> List[Dict[str, float]]:
+    """התוצאות בפורמט של BenefitsCalculator.calculate_total_benefits (להשוואה)"""
+    return [{'work_benefit': w, 'birth_benefit': b, 'total_benefit': t}
+            for w, b, t in zip(work.tolist(), birth.tolist(), total.tolist())]
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description='חישוב זכויות באצווה')
+    parser.add_argument('command', choices=['run', 'refresh', 'export', 'backfill-children', 'children'])
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    parser.add_argument('--year', type=int, help='שנת המס ל-export, או שנת הלידה ל-children')
+    parser.add_argument('--output', help='קובץ CSV ל-export')
+    args = parser.parse_args()
+
+    if args.command == 'refresh':
+        result = refresh_if_stale(chunk_size=args.chunk_size)
+    elif args.command == 'export':
+        if not args.year or not args.output:
+            parser.error('export דורש --year ו---output')
+        result = export_year(args.output, args.year, chunk_size=args.chunk_size)
+    elif args.command == 'backfill-children':
+        result = DatabaseHandler().backfill_customer_children(args.chunk_size)
+    elif args.command == 'children':
+        result = DatabaseHandler().children_by_birth_year(args.year, args.year)
+    else:
+        result = recalculate_all(chunk_size=args.chunk_size)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
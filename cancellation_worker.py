@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ביצוע בקשות ביטול קבלות ברקע
+
+בקשות נרשמות בטבלת receipt_cancellations בזמן השיחה, והעובד מבצע אותן
+מול iCount ומעדכן את הקבלה ל-status='cancelled'.
+ניתן להריץ בתוך השרת (thread) או כתהליך נפרד:
+    python cancellation_worker.py
+"""
+
+import logging
+import threading
+from typing import Dict
+
+from config import Config
+from database_handler import DatabaseHandler
+from icount_handler import ICountHandler
+
+logger = logging.getLogger(__name__)
+
+
+class CancellationWorker:
+    """עובד רקע לביטול קבלות ב-iCount"""
+
+    def __init__(self, db: DatabaseHandler = None, icount: ICountHandler = None,
+                 poll_seconds: float = None, batch_size: int = None, max_attempts: int = None):
+        self.db = db or DatabaseHandler()
+        self.icount = icount or ICountHandler()
+        self.poll_seconds = poll_seconds if poll_seconds is not None else Config.CANCELLATION_POLL_SECONDS
+        self.batch_size = batch_size or Config.CANCELLATION_BATCH_SIZE
+        self.max_attempts = max_attempts or Config.CANCELLATION_MAX_ATTEMPTS
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._thread = None
+
+    def run_once(self) -> Dict[str, int]:
+        """טיפול במנה אחת של בקשות. מחזיר ספירת תוצאות"""
+        results = {'completed': 0, 'failed': 0, 'retry': 0}
+
+        for cancellation in self.db.claim_cancellation_requests(self.batch_size):
+            outcome = self.process_request(cancellation)
+            results[outcome] += 1
+
+        if any(results.values()):
+            logger.info(f"סבב ביטולים הסתיים: {results}")
+        return results
+
+    def process_request(self, cancellation: Dict) -> str:
+        """ביצוע בקשת ביטול אחת"""
+        request_id = cancellation['id']
+        claim_token = cancellation['claim_token']
+        doc_id = cancellation.get('icount_doc_id')
+
+        if cancellation.get('receipt_status') == 'cancelled':
+            self.db.finish_cancellation_request(request_id, claim_token, 'completed')
+            return 'completed'
+
+        if not doc_id:
+            self.db.finish_cancellation_request(request_id, claim_token, 'failed', 'לקבלה אין מזהה מסמך ב-iCount')
+            return 'failed'
+
+        result = self.icount.cancel_receipt(doc_id)
+
+        if result.get('status'):
+            self.db.update_receipt(cancellation['receipt_id'], status='cancelled')
+            self.db.finish_cancellation_request(request_id, claim_token, 'completed')
+            logger.info(f"קבלה {cancellation['receipt_num']} בוטלה (בקשה {request_id})")
+            return 'completed'
+
+        error = result.get('message', 'שגיאה לא ידועה')
+        if cancellation.get('attempts', 0) >= self.max_attempts:
+            self.db.finish_cancellation_request(request_id, claim_token, 'failed', error)
+            logger.error(f"ביטול קבלה {cancellation['receipt_num']} נכשל סופית: {error}")
+            return 'failed'
+
+        # החזרה לתור לניסיון נוסף בסבב הבא
+        self.db.finish_cancellation_request(request_id, claim_token, 'requested', error)
+        logger.warning(f"ביטול קבלה {cancellation['receipt_num']} נכשל, ינוסה שוב: {error}")
+        return 'retry'
+
+    def notify(self):
+        """העירה מיידית של העובד (למשל אחרי רישום בקשה חדשה)"""
+        self._wake_event.set()
+
+    def run_forever(self):
+        """לולאת העובד - רצה עד stop()"""
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"שגיאה בעובד הביטולים: {str(e)}", exc_info=True)
+            self._wake_event.wait(self.poll_seconds)
+            self._wake_event.clear()
+
+    def start(self):
+        """הפעלת העובד ב-thread רקע"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run_forever, name='cancellation-worker', daemon=True)
+        self._thread.start()
+        logger.info("עובד ביטול הקבלות הופעל")
+
+    def stop(self, timeout: float = 5):
+        """עצירת העובד"""
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=getattr(logging, Config.LOG_LEVEL),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    worker = CancellationWorker()
+    worker.run_forever()
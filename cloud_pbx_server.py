@@ -1,338 +1,54 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from flask import Flask, request, jsonify
 import json
 import logging
 import sqlite3
 import os
+import threading
 from datetime import datetime
 from typing import Dict, Any, Optional
 
-# ייבוא המודולים שלנו
-try:
-    from database_handler import DatabaseHandler
-    from icount_handler import ICountHandler, BenefitsCalculator
-    from config import Config
-except ImportError:
-    # אם המודולים לא קיימים, ניצור תחליפים בסיסיים
-    class Config:
-        LOG_LEVEL = 'INFO'
-        LOG_FILE = 'pbx_system.log'
-        DATABASE_PATH = 'pbx_system.db'
-    
-    class DatabaseHandler:
-        def __init__(self):
-            self.db_path = Config.DATABASE_PATH
-            self.init_database()
-        
-        def init_database(self):
-            """יצירת מבנה מאגר הנתונים"""
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # טבלת לקוחות
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS customers (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    phone_number TEXT UNIQUE NOT NULL,
-                    name TEXT,
-                    email TEXT,
-                    subscription_start_date DATE,
-                    subscription_end_date DATE,
-                    is_active BOOLEAN DEFAULT 1,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # טבלת פרטים אישיים לזכויות
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS customer_details (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    customer_id INTEGER,
-                    num_children INTEGER DEFAULT 0,
-                    children_birth_years TEXT, -- JSON array של שנות לידה
-                    spouse1_workplaces INTEGER DEFAULT 0,
-                    spouse2_workplaces INTEGER DEFAULT 0,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (customer_id) REFERENCES customers (id)
-                )
-            ''')
-            
-            # טבלת שיחות
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS calls (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    call_id TEXT UNIQUE,
-                    phone_number TEXT,
-                    pbx_num TEXT,
-                    pbx_did TEXT,
-                    call_type TEXT,
-                    call_status TEXT,
-                    extension_id TEXT,
-                    extension_path TEXT,
-                    call_data TEXT, -- JSON של כל הנתונים שנאספו
-                    started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    ended_at DATETIME
-                )
-            ''')
-            
-            # טבלת קבלות
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS receipts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    customer_id INTEGER,
-                    call_id TEXT,
-                    receipt_data TEXT, -- JSON של פרטי הקבלה
-                    icount_doc_id TEXT,
-                    icount_doc_num TEXT,
-                    icount_response TEXT, -- תגובה מ-iCount
-                    status TEXT DEFAULT 'pending',
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (customer_id) REFERENCES customers (id)
-                )
-            ''')
-            
-            # טבלת הודעות
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    customer_id INTEGER,
-                    call_id TEXT,
-                    message_file TEXT,
-                    duration INTEGER,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (customer_id) REFERENCES customers (id)
-                )
-            ''')
-            
-            # טבלת בקשות דיווחים
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS annual_reports (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    customer_id INTEGER,
-                    requested_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    status TEXT DEFAULT 'pending',
-                    FOREIGN KEY (customer_id) REFERENCES customers (id)
-                )
-            ''')
-            
-            conn.commit()
-            conn.close()
-        
-        def get_customer_by_phone(self, phone_number: str) -> Optional[Dict]:
-            """קבלת פרטי לקוח לפי מספר טלפון"""
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT * FROM customers WHERE phone_number = ?', (phone_number,))
-            customer = cursor.fetchone()
-            conn.close()
-            
-            return dict(customer) if customer else None
-        
-        def is_subscription_active(self, customer: Dict) -> bool:
-            """בדיקת תוקף מנוי"""
-            if not customer or not customer.get('subscription_end_date'):
-                return False
-            
-            end_date = datetime.strptime(customer['subscription_end_date'], '%Y-%m-%d')
-            return end_date >= datetime.now()
-        
-        def log_call(self, call_params: Dict):
-            """רישום שיחה במאגר נתונים"""
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT OR REPLACE INTO calls 
-                (call_id, phone_number, pbx_num, pbx_did, call_type, call_status, 
-                 extension_id, extension_path, call_data)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                call_params.get('PBXcallId'),
-                call_params.get('PBXphone'),
-                call_params.get('PBXnum'),
-                call_params.get('PBXdid'),
-                call_params.get('PBXcallType'),
-                call_params.get('PBXcallStatus'),
-                call_params.get('PBXextensionId'),
-                call_params.get('PBXextensionPath'),
-                json.dumps(call_params, ensure_ascii=False)
-            ))
-            
-            conn.commit()
-            conn.close()
-        
-        def update_call_data(self, call_id: str, data: Dict):
-            """עדכון נתוני שיחה"""
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT call_data FROM calls WHERE call_id = ?', (call_id,))
-            result = cursor.fetchone()
-            
-            if result:
-                existing_data = json.loads(result[0] or '{}')
-                existing_data.update(data)
-                
-                cursor.execute(
-                    'UPDATE calls SET call_data = ? WHERE call_id = ?',
-                    (json.dumps(existing_data, ensure_ascii=False), call_id)
-                )
-            
-            conn.commit()
-            conn.close()
-        
-        def create_receipt(self, customer_id: int, call_id: str, receipt_data: Dict) -> int:
-            """יצירת קבלה במאגר נתונים"""
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO receipts (customer_id, call_id, receipt_data)
-                VALUES (?, ?, ?)
-            ''', (customer_id, call_id, json.dumps(receipt_data, ensure_ascii=False)))
-            
-            receipt_id = cursor.lastrowid
-            conn.commit()
-            conn.close()
-            
-            return receipt_id
-        
-        def update_receipt(self, receipt_id: int, **kwargs):
-            """עדכון קבלה"""
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            fields = []
-            values = []
-            
-            for key, value in kwargs.items():
-                fields.append(f"{key} = ?")
-                values.append(value)
-            
-            if fields:
-                values.append(receipt_id)
-                cursor.execute(f"UPDATE receipts SET {', '.join(fields)} WHERE id = ?", values)
-            
-            conn.commit()
-            conn.close()
-        
-        def get_customer_details(self, customer_id: int) -> Optional[Dict]:
-            """קבלת פרטי לקוח מפורטים"""
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT * FROM customer_details WHERE customer_id = ?', (customer_id,))
-            details = cursor.fetchone()
-            conn.close()
-            
-            return dict(details) if details else None
-        
-        def update_customer_details(self, customer_id: int, **kwargs):
-            """עדכון פרטי לקוח"""
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            # בדיקה אם יש כבר רשומה
-            cursor.execute('SELECT id FROM customer_details WHERE customer_id = ?', (customer_id,))
-            existing = cursor.fetchone()
-            
-            if existing:
-                fields = []
-                values = []
-                for key, value in kwargs.items():
-                    fields.append(f"{key} = ?")
-                    values.append(value)
-                
-                if fields:
-                    values.append(customer_id)
-                    cursor.execute(
-                        f"UPDATE customer_details SET {', '.join(fields)} WHERE customer_id = ?",
-                        values
-                    )
-            else:
-                # יצירת רשומה חדשה
-                fields = ['customer_id'] + list(kwargs.keys())
-                values = [customer_id] + list(kwargs.values())
-                placeholders = ','.join(['?'] * len(values))
-                
-                cursor.execute(
-                    f"INSERT INTO customer_details ({','.join(fields)}) VALUES ({placeholders})",
-                    values
-                )
-            
-            conn.commit()
-            conn.close()
-        
-        def save_message(self, customer_id: int, call_id: str, message_file: str, duration: int):
-            """שמירת הודעה"""
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO messages (customer_id, call_id, message_file, duration)
-                VALUES (?, ?, ?, ?)
-            ''', (customer_id, call_id, message_file, duration))
-            
-            conn.commit()
-            conn.close()
-        
-        def request_annual_report(self, customer_id: int):
-            """רישום בקשת דיווח שנתי"""
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO annual_reports (customer_id)
-                VALUES (?)
-            ''', (customer_id,))
-            
-            conn.commit()
-            conn.close()
-    
-    class ICountHandler:
-        def create_receipt(self, receipt_data: Dict) -> Dict:
-            """יצירת קבלה ב-iCount (דמה)"""
-            return {
-                'status': True,
-                'doc_id': f"DOC{datetime.now().strftime('%Y%m%d%H%M%S')}",
-                'doc_num': f"R{datetime.now().strftime('%y%m')}-{datetime.now().strftime('%d%H%M')}",
-                'message': 'קבלה נוצרה בהצלחה'
-            }
-    
-    class BenefitsCalculator:
-        @staticmethod
-        def calculate_total_benefits(customer_details: Dict) -> Dict:
-            """חישוב זכויות (דמה)"""
-            work_benefit = 2000
-            birth_benefit = customer_details.get('num_children', 0) * 500
-            
-            return {
-                'work_benefit': work_benefit,
-                'birth_benefit': birth_benefit,
-                'total_benefit': work_benefit + birth_benefit
-            }
+# ייבוא המודולים שלנו - השרת תלוי במאגר, ב-iCount ובעובדים המלאים, ולכן ייבוא שנכשל עוצר את הטעינה
+from database_handler import DatabaseHandler, SCHEMA_VERSION
+from icount_handler import ICountHandler, BenefitsCalculator
+from cancellation_worker import CancellationWorker
+from recording_ingest import (RecordingIngestWorker, RecordingUpload, UPLOAD_TOKEN_HEADER, recording_source,
+                              upload_authorized)
+import staff_inbox
+from config import Config, config as config_by_name
+
+from request_budget import RequestBudget, PendingOperations, OperationInProgress
+from log_pipeline import configure_logging, structured, DumpSampler
+import metrics
+import tracing
+import request_profiler
+from admission import AdmissionController
+from health import HealthMonitor, liveness
 
-# הגדרת לוגים
-logging.basicConfig(
-    level=getattr(logging, Config.LOG_LEVEL),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(Config.LOG_FILE, encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
+# צמתי ה-IVR (שם הקלט שמגיע מהמרכזיה = שם התפריט). סדרות המדדים נרשמות מראש
+IVR_NODES = [
+    'entry', 'pleaseWait', 'newCustomer', 'newCustomerID', 'customerName', 'invalidID',
+    'registrationComplete', 'renewSubscription', 'renewalConfirm', 'renewalSuccess', 'renewalCanceled',
+    'mainMenu', 'invalidChoice', 'receiptAmount', 'invalidAmount', 'receiptDescription',
+    'receiptSuccess', 'receiptPending', 'receiptQueued', 'receiptFailed',
+    'cancelReceiptId', 'cancelNotFound', 'cancelResult', 'benefitsMenu', 'numChildren',
+    'child_birth_year', 'spouse1_workplaces', 'spouse2_workplaces', 'detailsUpdated',
+    'benefitsDisplay', 'customerMessage', 'messageReceived', 'annualReport', 'reportRequested',
+    'systemError'
+]
+PBX_REQUEST_SECONDS = metrics.histogram('pbx_request_seconds', 'זמן טיפול בבקשה מהמרכזיה לפי צומת IVR',
+                                        ['node'], [(n,) for n in IVR_NODES])
+PBX_RESPONSES = metrics.counter('pbx_responses_total', 'תגובות למרכזיה לפי קוד HTTP ותוצאה', ['status', 'outcome'],
+                                [('200', 'done'), ('200', 'hold'), ('200', 'poll'), ('200', 'rejected'),
+                                 ('200', 'shed'), ('200', 'busy'), ('400', 'rejected'), ('500', 'error')])
 
 class PBXHandler:
-    def __init__(self):
-        self.db = DatabaseHandler()
+    def __init__(self, config=None, db: DatabaseHandler = None):
+        self.config = config or Config
+        self.db = db or DatabaseHandler(self.config.DATABASE_PATH)
         self.icount = ICountHandler()
         self.current_calls = {}  # אחסון זמני של נתוני שיחות
     
@@ -344,6 +60,34 @@ class PBXHandler:
         """בדיקת תוקף מנוי"""
         return self.db.is_subscription_active(customer)
     
+    def process_call_input(self, call_id: str, call_params: Dict, input_name: str, input_value: str) -> Dict:
+        """רישום הפנייה וטיפול בקלט מהמשתמש"""
+        self.current_calls[call_id] = call_params
+        self.db.log_call(call_params)
+        return self.handle_user_input(call_id, input_name, input_value)
+    
+    def process_call_entry(self, call_id: str, call_params: Dict) -> Dict:
+        """רישום הפנייה וניתוב פנייה ראשונית לפי מצב הלקוח"""
+        self.current_calls[call_id] = call_params
+        self.db.log_call(call_params)
+        
+        customer = self.get_customer_by_phone(call_params.get('PBXphone'))
+        
+        if not customer:
+            # לקוח לא קיים - העברה לשלוחת הרשמה
+            logger.info("לקוח לא קיים - מציג תפריט לקוח חדש")
+            return handle_new_customer()
+        
+        # בדיקת תוקף מנוי
+        if not self.is_subscription_active(customer):
+            # מנוי לא בתוקף - העברה לשלוחת הצטרפות
+            logger.info("מנוי לא בתוקף - מציג תפריט חידוש מנוי")
+            return handle_subscription_renewal()
+        
+        # לקוח עם מנוי בתוקף - הצגת תפריט ראשי
+        logger.info("לקוח עם מנוי בתוקף - מציג תפריט ראשי")
+        return show_main_menu()
+    
     def handle_user_input(self, call_id: str, input_name: str, input_value: str) -> Dict:
         """טיפול בקלט מהמשתמש"""
         # שמירת הקלט בנתוני השיחה
@@ -376,6 +120,8 @@ class PBXHandler:
             return self.process_receipt_description(call_id, input_value)
         elif input_name == 'cancelReceiptId':
             return self.process_cancel_receipt(call_id, input_value)
+        elif input_name == 'cancelNotFound':
+            return self.process_cancel_not_found_choice(call_id, input_value)
         elif input_name == 'numChildren':
             return self.process_children_count(call_id, input_value)
         elif input_name.startswith('child_birth_year_'):
@@ -709,8 +455,45 @@ class PBXHandler:
             'client_email': customer.get('email', '')
         }
         
-        receipt_id = self.db.create_receipt(customer['id'], call_id, receipt_data)
-        icount_result = self.icount.create_receipt(receipt_data)
+        # מפתח אידמפוטנטיות - המרכזיה שולחת שוב את אותה בקשה כשהתגובה מתעכבת
+        idempotency_key = self.db.make_receipt_idempotency_key(call_id, customer['id'], receipt_data)
+        
+        if self.uses_batched_receipts(customer):
+            # מצב אצווה - רישום מקומי בלבד, השליחה ל-iCount בסוף היום
+            self.db.get_or_create_receipt(customer['id'], call_id, receipt_data, idempotency_key,
+                                          status='queued')
+            return self.receipt_queued_menu()
+        
+        receipt, created = self.db.get_or_create_receipt(customer['id'], call_id, receipt_data, idempotency_key)
+        receipt_id = receipt['id']
+        
+        if not created:
+            if receipt['status'] == 'completed':
+                logger.info(f"בקשה חוזרת לקבלה {receipt_id} - מחזיר תוצאה שמורה")
+                return self.receipt_success_menu(receipt.get('icount_doc_num'))
+            if not self.db.claim_receipt_retry(receipt_id, receipt['status']):
+                # הקבלה עדיין בטיפול בבקשה קודמת
+                logger.info(f"בקשה חוזרת לקבלה {receipt_id} בזמן טיפול - לא פונה שוב ל-iCount")
+                return self.receipt_pending_menu()
+            if receipt['status'] != 'failed':
+                # ייתכן שהמסמך כבר נוצר (תשובה שלא הגיעה, או טיפול שקרס באמצע) - בודקים לפני שליחה חוזרת
+                found = self.icount.find_receipt(idempotency_key)
+                if not found['status']:
+                    logger.warning(f"לא ניתן לבדוק את קבלה {receipt_id} ב-iCount: {found.get('message')}")
+                    self.db.update_receipt(receipt_id, status='unknown')
+                    return self.receipt_pending_menu()
+                if found['found']:
+                    logger.info(f"קבלה {receipt_id} נמצאה ב-iCount ({found.get('doc_num')}) - לא נשלחת שוב")
+                    self.db.update_receipt(
+                        receipt_id,
+                        icount_doc_id=found.get('doc_id'),
+                        icount_doc_num=found.get('doc_num'),
+                        icount_response=json.dumps(found, ensure_ascii=False),
+                        status='completed'
+                    )
+                    return self.receipt_success_menu(found.get('doc_num'))
+        
+        icount_result = self.icount.create_receipt(receipt_data, reference=idempotency_key)
         
         if icount_result['status']:
             self.db.update_receipt(
@@ -721,20 +504,15 @@ class PBXHandler:
                 status='completed'
             )
             
-            return {
-                "type": "simpleMenu",
-                "name": "receiptSuccess",
-                "times": 1,
-                "timeout": 15,
-                "enabledKeys": "0",
-                "setMusic": "no",
-                "files": [
-                    {
-                        "text": f"הקבלה נוצרה בהצלחה. מספר קבלה: {icount_result.get('doc_num', 'לא זמין')}. לחץ 0 לחזרה לתפריט הראשי.",
-                        "activatedKeys": "0"
-                    }
-                ]
-            }
+            return self.receipt_success_menu(icount_result.get('doc_num'))
+        elif icount_result.get('unknown'):
+            # לא ידוע אם המסמך נוצר - הבקשה החוזרת תבדוק ב-iCount לפני שליחה
+            self.db.update_receipt(
+                receipt_id,
+                icount_response=json.dumps(icount_result, ensure_ascii=False),
+                status='unknown'
+            )
+            return self.receipt_pending_menu()
         else:
             self.db.update_receipt(
                 receipt_id,
@@ -757,8 +535,97 @@ class PBXHandler:
                 ]
             }
     
+    def receipt_success_menu(self, doc_num: Optional[str]) -> Dict:
+        """הודעת הצלחה ביצירת קבלה"""
+        return {
+            "type": "simpleMenu",
+            "name": "receiptSuccess",
+            "times": 1,
+            "timeout": 15,
+            "enabledKeys": "0",
+            "setMusic": "no",
+            "files": [
+                {
+                    "text": f"הקבלה נוצרה בהצלחה. מספר קבלה: {doc_num or 'לא זמין'}. לחץ 0 לחזרה לתפריט הראשי.",
+                    "activatedKeys": "0"
+                }
+            ]
+        }
+    
+    def uses_batched_receipts(self, customer: Dict) -> bool:
+        """האם הקבלות של הלקוח נשלחות ל-iCount באצווה"""
+        mode = customer.get('receipt_mode') or self.config.RECEIPT_SUBMISSION_MODE
+        return mode == 'batched'
+    
+    def receipt_queued_menu(self) -> Dict:
+        """הודעה על קבלה שנרשמה ותופק באצווה"""
+        return {
+            "type": "simpleMenu",
+            "name": "receiptQueued",
+            "times": 1,
+            "timeout": 15,
+            "enabledKeys": "0",
+            "setMusic": "no",
+            "files": [
+                {
+                    "text": "הקבלה נרשמה ותופק עד סוף היום. לחץ 0 לחזרה לתפריט הראשי.",
+                    "activatedKeys": "0"
+                }
+            ]
+        }
+    
+    def receipt_pending_menu(self) -> Dict:
+        """הודעה על קבלה שעדיין בטיפול"""
+        return {
+            "type": "simpleMenu",
+            "name": "receiptPending",
+            "times": 1,
+            "timeout": 15,
+            "enabledKeys": "0",
+            "setMusic": "no",
+            "files": [
+                {
+                    "text": "הקבלה שלך עדיין בטיפול. כדי לקבל את מספר הקבלה הזן שוב את אותו סכום ותיאור בשיחה זו. לחץ 0 לחזרה לתפריט הראשי.",
+                    "activatedKeys": "0"
+                }
+            ]
+        }
+    
     def process_cancel_receipt(self, call_id: str, receipt_num: str) -> Dict:
-        """טיפול בביטול קבלה"""
+        """טיפול בביטול קבלה - רישום בקשה לביצוע ברקע"""
+        call_data = self.current_calls.get(call_id, {})
+        customer = self.get_customer_by_phone(call_data.get('PBXphone'))
+        if not customer:
+            return self.show_error_and_return_to_main()
+        
+        receipt = self.db.get_receipt_by_doc_num(customer['id'], receipt_num)
+        
+        if not receipt:
+            self.db.create_cancellation_request(customer['id'], call_id, receipt_num, status='not_found')
+            return {
+                "type": "simpleMenu",
+                "name": "cancelNotFound",
+                "times": 1,
+                "timeout": 15,
+                "enabledKeys": "1,0",
+                "setMusic": "no",
+                "files": [
+                    {
+                        "text": f"לא נמצאה קבלה מספר {receipt_num}. לחץ 1 לנסות שוב או 0 לחזרה לתפריט הראשי.",
+                        "activatedKeys": "1,0"
+                    }
+                ]
+            }
+        
+        if receipt['status'] == 'cancelled':
+            text = f"קבלה מספר {receipt_num} כבר בוטלה. לחץ 0 לחזרה לתפריט הראשי."
+        else:
+            self.db.create_cancellation_request(customer['id'], call_id, receipt_num, receipt_id=receipt['id'])
+            worker = get_cancellation_worker()
+            if worker:
+                worker.notify()
+            text = f"בקשת ביטול קבלה מספר {receipt_num} התקבלה ותבוצע בדקות הקרובות. לחץ 0 לחזרה לתפריט הראשי."
+        
         return {
             "type": "simpleMenu",
             "name": "cancelResult",
@@ -768,12 +635,19 @@ class PBXHandler:
             "setMusic": "no",
             "files": [
                 {
-                    "text": f"בקשת ביטול קבלה מספר {receipt_num} התקבלה. הביטול יטופל תוך 24 שעות. לחץ 0 לחזרה לתפריט הראשי.",
+                    "text": text,
                     "activatedKeys": "0"
                 }
             ]
         }
     
+    def process_cancel_not_found_choice(self, call_id: str, choice: str) -> Dict:
+        """טיפול בבחירה לאחר מספר קבלה שלא נמצא"""
+        if choice == '1':
+            return handle_cancel_receipt()
+        else:
+            return show_main_menu()
+    
     def process_children_count(self, call_id: str, num_children: str) -> Dict:
         """טיפול במספר הילדים"""
         try:
@@ -891,7 +765,7 @@ class PBXHandler:
                     self.db.update_customer_details(
                         customer['id'],
                         num_children=call_data.get('children_count', 0),
-                        children_birth_years=json.dumps(call_data.get('children_birth_years', [])),
+                        children_birth_years=call_data.get('children_birth_years', []),
                         spouse1_workplaces=call_data.get('spouse1_workplaces', 0),
                         spouse2_workplaces=call_data.get('spouse2_workplaces', 0)
                     )
@@ -920,12 +794,17 @@ class PBXHandler:
         customer = self.get_customer_by_phone(phone_number)
         
         if customer and message_result:
+            # הקובץ נקלט ברקע (recording_ingest) והאורך נקרא מכותרותיו
             self.db.save_message(
                 customer['id'],
                 call_id,
                 message_file=message_result,
-                duration=None
+                duration=None,
+                recording_source=recording_source(message_result, getattr(self.config, 'RECORDINGS_BASE_URL', ''))
             )
+            worker = get_recording_worker()
+            if worker:
+                worker.notify()
         
         return {
             "type": "simpleMenu",
@@ -961,7 +840,7 @@ class PBXHandler:
                 "setMusic": "no",
                 "files": [
                     {
-                        "text": "בקשת הדיווח התקבלה. הדיווח יישלח אליך בהודעת SMS תוך 24 שעות. לחץ 0 לחזרה לתפריט הראשי.",
+                        "text": "בקשת הדיווח התקבלה. הדיווח יופק תוך 24 שעות. לחץ 0 לחזרה לתפריט הראשי.",
                         "activatedKeys": "0"
                     }
                 ]
@@ -977,10 +856,8 @@ class PBXHandler:
         if phone_number:
             customer = self.get_customer_by_phone(phone_number)
             if customer:
-                details = self.db.get_customer_details(customer['id'])
-                if details:
-                    benefits = BenefitsCalculator.calculate_total_benefits(details)
-                    
+                benefits = self.get_customer_benefits(customer['id'])
+                if benefits:
                     return {
                         "type": "simpleMenu",
                         "name": "benefitsDisplay",
@@ -1011,6 +888,24 @@ class PBXHandler:
             ]
         }
     
+    def get_customer_benefits(self, customer_id: int) -> Optional[Dict]:
+        """הזכויות השמורות של הלקוח; חישוב ושמירה רק אם חסרות, משנה קודמת או מגרסת כללים אחרת"""
+        year = datetime.now().year
+        rules_version = BenefitsCalculator.rules_version()
+        stored = self.db.get_customer_benefits(customer_id)
+        if stored and stored['benefit_year'] == year and stored['rules_version'] == rules_version:
+            return stored
+        
+        details = self.db.get_customer_details(customer_id)
+        if not details:
+            return None
+        details['children_birth_years'] = self.db.get_customer_children(customer_id)
+        benefits = BenefitsCalculator.calculate_total_benefits(details)
+        # נשמר רק אם הפרטים לא עודכנו מאז שנקראו
+        self.db.save_customer_benefits([(customer_id, benefits['work_benefit'], benefits['birth_benefit'],
+                                         benefits['total_benefit'], year, rules_version, details['updated_at'])])
+        return benefits
+    
     def show_error_and_return_to_main(self) -> Dict:
         """הצגת שגיאה וחזרה לתפריט הראשי"""
         return {
@@ -1029,126 +924,514 @@ class PBXHandler:
         }
 
 
-# יצירת מופע של PBXHandler
-pbx_handler = PBXHandler()
+# מצב משותף שבטוח לשתף בין תהליכים אחרי fork: הגדרות ותפריטים קבועים.
+# נבנה פעם אחת ב-create_app (בתהליך הראשי כש-gunicorn רץ עם preload)
+_shared_state = {
+    'config': Config,
+    'prompts': {},
+    'initialized': False
+}
 
+# משאבים של כל worker: חיבורים למאגר, HTTP ל-iCount, threads ברקע.
+# נוצרים בעצלתיים בתהליך שמשתמש בהם ונבנים מחדש אם התהליך השתנה (fork)
+_worker_state = {
+    'pid': None,
+    'pbx_handler': None,
+    'pending_operations': None,
+    'cancellation_worker': None,
+    'recording_worker': None,
+    'dump_sampler': None,
+    'active_calls': None,
+    'admission': None,
+    'health': None
+}
+_worker_lock = threading.Lock()
 
-@app.route('/pbx', methods=['GET', 'POST'])
-def handle_pbx_request():
-    """נקודת הכניסה הראשית לפניות מהמרכזיה"""
-    try:
-        # הדפסת כל הפרמטרים שהתקבלו לצורכי debug
-        logger.info("=== בקשה חדשה מהמרכזיה ===")
-        logger.info(f"Method: {request.method}")
-        logger.info(f"URL: {request.url}")
-        logger.info(f"Args: {dict(request.args)}")
-        if request.method == 'POST':
-            logger.info(f"Form data: {dict(request.form)}")
-            logger.info(f"JSON data: {request.get_json()}")
-        
-        # קבלת פרמטרים מהמרכזיה (מ-GET או POST)
-        if request.method == 'POST':
-            # אם זה POST, ננסה לקבל מה-form data או JSON
-            if request.form:
-                params_source = request.form
-            elif request.get_json():
-                params_source = request.get_json()
-            else:
-                params_source = request.args
-        else:
-            params_source = request.args
-        
-        call_params = {
-            'PBXphone': params_source.get('PBXphone'),
-            'PBXnum': params_source.get('PBXnum'),
-            'PBXdid': params_source.get('PBXdid'),
-            'PBXcallId': params_source.get('PBXcallId'),
-            'PBXcallType': params_source.get('PBXcallType'),
-            'PBXcallStatus': params_source.get('PBXcallStatus'),
-            'PBXextensionId': params_source.get('PBXextensionId'),
-            'PBXextensionPath': params_source.get('PBXextensionPath')
-        }
-        
-        # הוספת כל הפרמטרים הנוספים שנאספו
-        for key, value in params_source.items():
-            if not key.startswith('PBX'):
-                call_params[key] = value
-        
-        logger.info(f"קיבלנו פנייה: {call_params}")
-        
-        # הדפסת debug מפורטת של כל הפרמטרים
-        logger.info(f"כל הפרמטרים שהתקבלו:")
-        for key, value in call_params.items():
-            if value:  # רק פרמטרים שאינם ריקים
-                logger.info(f"  {key} = {value}")
-        
-        call_id = call_params.get('PBXcallId')
-        phone_number = call_params.get('PBXphone')
+
+def get_config():
+    """ההגדרות הפעילות של האפליקציה"""
+    return _shared_state['config']
+
+
+def init_worker() -> Dict:
+    """יצירת משאבי ה-worker הנוכחי (פעם אחת לכל תהליך)"""
+    pid = os.getpid()
+    if _worker_state['pid'] == pid:
+        return _worker_state
+    
+    with _worker_lock:
+        if _worker_state['pid'] == pid:
+            return _worker_state
         
-        if not call_id or not phone_number:
-            logger.error(f"חסרים פרמטרים נדרשים: call_id={call_id}, phone_number={phone_number}")
-            return jsonify({"error": "חסרים פרמטרים נדרשים"}), 400
+        # שימוש ישיר במודול (סקריפטים, בדיקות) בלי create_app / init_shared
+        if not _shared_state['initialized']:
+            init_shared(get_config())
         
-        # שמירת נתוני השיחה
-        pbx_handler.current_calls[call_id] = call_params
-        pbx_handler.db.log_call(call_params)
+        config = get_config()
+        db = DatabaseHandler(config.DATABASE_PATH, initialize=False)
+        handler = PBXHandler(config, db)
         
-        # בדיקה מיוחדת - אולי הפרמטר מגיע בשם אחר
-        possible_input_keys = [
-            'newCustomerID', 'newcustomerid', 'newCustomerId', 
-            'input', 'dtmf', 'value', 'userInput', 'response',
-            'data', 'result', 'answer'
-        ]
+        # פעולות שחרגו מתקציב הזמן של המרכזיה וממשיכות ברקע
+        operations = PendingOperations(
+            max_workers=config.PBX_OPERATION_THREADS,
+            result_ttl=config.PENDING_RESULT_TTL_SECONDS
+        )
         
-        logger.info("בודק שמות פרמטרים אפשריים:")
-        for possible_key in possible_input_keys:
-            if possible_key in call_params and call_params[possible_key]:
-                logger.info(f"נמצא פרמטר אפשרי: {possible_key} = {call_params[possible_key]}")
+        # עובד רקע לביצוע בקשות ביטול קבלות
+        worker = None
+        if getattr(config, 'CANCELLATION_WORKER_ENABLED', False):
+            worker = CancellationWorker(handler.db, handler.icount)
+            worker.start()
         
-        # בדיקה אם יש קלט מהמשתמש
-        user_inputs = {}
-        for key, value in call_params.items():
-            if not key.startswith('PBX') and value and str(value).strip():
-                user_inputs[key] = value
-                logger.info(f"נמצא קלט משתמש: {key} = {value}")
+        # עובד רקע להורדת הקלטות ההודעות
+        recording_worker = None
+        if getattr(config, 'RECORDING_INGEST_ENABLED', False):
+            recording_worker = RecordingIngestWorker(handler.db, config)
+            recording_worker.start()
         
-        if user_inputs:
-            # יש קלט מהמשתמש - צריך לטפל בו
-            input_name = list(user_inputs.keys())[0]
-            input_value = user_inputs[input_name]
-            logger.info(f"מעבד קלט: {input_name} = {input_value}")
-            result = pbx_handler.handle_user_input(call_id, input_name, input_value)
-            logger.info(f"תגובה לקלט: {result}")
+        _worker_state.update({
+            'pbx_handler': handler,
+            'pending_operations': operations,
+            'cancellation_worker': worker,
+            'recording_worker': recording_worker,
+            'dump_sampler': DumpSampler(getattr(config, 'LOG_DUMP_SAMPLE_RATE', 0),
+                                        getattr(config, 'LOG_DUMP_MAX_PER_SECOND', 0)),
+            'active_calls': metrics.ActivityTracker(getattr(config, 'PBX_SESSION_IDLE_SECONDS', 120)),
+            'admission': AdmissionController(
+                max_in_flight=getattr(config, 'ADMISSION_MAX_IN_FLIGHT', 32),
+                entry_share=getattr(config, 'ADMISSION_ENTRY_SHARE', 0.75),
+                caller_max_entries=getattr(config, 'ADMISSION_CALLER_MAX_ENTRIES', 5),
+                caller_window_seconds=getattr(config, 'ADMISSION_CALLER_WINDOW_SECONDS', 60)
+            ),
+            # ה-thread של הבדיקות מופעל בבקשה הראשונה ל-/readyz
+            'health': HealthMonitor(config.DATABASE_PATH, SCHEMA_VERSION, lambda: icount_breaker_state(handler),
+                                    interval=getattr(config, 'HEALTH_PROBE_SECONDS', 5)),
+            'pid': pid
+        })
+        logger.info(f"משאבי worker אותחלו (pid {pid})")
+    return _worker_state
+
+
+def get_pbx_handler() -> PBXHandler:
+    return init_worker()['pbx_handler']
+
+
+def get_pending_operations() -> PendingOperations:
+    return init_worker()['pending_operations']
+
+
+def get_cancellation_worker():
+    return init_worker()['cancellation_worker']
+
+
+def get_recording_worker():
+    return init_worker()['recording_worker']
+
+
+def get_dump_sampler() -> DumpSampler:
+    return init_worker()['dump_sampler']
+
+
+def get_admission() -> AdmissionController:
+    return init_worker()['admission']
+
+
+def get_health() -> HealthMonitor:
+    return init_worker()['health']
+
+
+def icount_breaker_state(handler: PBXHandler) -> str:
+    breaker = getattr(handler.icount, 'breaker', None)
+    return breaker.state if breaker else 'closed'
+
+
+def build_prompt_cache():
+    """בניית התפריטים הקבועים מראש - משותפים לכל ה-workers"""
+    _shared_state['prompts'] = {}
+    for builder in (handle_new_customer, handle_subscription_renewal, show_main_menu, hold_menu,
+                    system_busy_menu, invalid_choice_menu, handle_create_receipt, handle_cancel_receipt,
+                    handle_update_personal_details, handle_annual_report):
+        cached_prompt(builder)
+
+
+def cached_prompt(builder) -> Dict:
+    """תפריט קבוע מהמטמון (נבנה בפעם הראשונה). אין לשנות את המילון המוחזר"""
+    prompts = _shared_state['prompts']
+    prompt = prompts.get(builder.__name__)
+    if prompt is None:
+        prompt = prompts[builder.__name__] = builder.build()
+    return prompt
+
+
+def prompt(func):
+    """קישוט לפונקציית תפריט קבוע - מחזירה את התפריט מהמטמון המשותף"""
+    def cached():
+        return cached_prompt(cached)
+    cached.__name__ = func.__name__
+    cached.__doc__ = func.__doc__
+    cached.build = func
+    return cached
+
+
+def init_shared(config=None):
+    """הכנת המצב שבטוח לשתף אחרי fork (הגדרות, מבנה המאגר, תפריטים קבועים)
+    
+    חיבורים למאגר, HTTP ו-threads נוצרים בכל worker בפנייה הראשונה או ב-init_worker.
+    """
+    if isinstance(config, str):
+        config = config_by_name.get(config, Config)
+    config = config or Config
+    
+    _shared_state['config'] = config
+    configure_logging(config)
+    
+    # יצירת מבנה המאגר פעם אחת - החיבור נסגר לפני ה-fork
+    DatabaseHandler(config.DATABASE_PATH)
+    build_prompt_cache()
+    tracing.configure(config)
+    _shared_state['initialized'] = True
+    return config
+
+
+def create_app(config=None) -> 'Flask':
+    """יצירת אפליקציית השרת (Flask נטען רק כאן)"""
+    from flask import Flask
+    
+    init_shared(config)
+    
+    app = Flask(__name__)
+    app.add_url_rule('/pbx', 'handle_pbx_request', handle_pbx_request, methods=['GET', 'POST'])
+    app.add_url_rule('/pbx/menu/<menu_name>', 'handle_menu_choice', handle_menu_choice, methods=['GET', 'POST'])
+    app.add_url_rule('/recordings/<int:message_id>', 'upload_recording', upload_recording, methods=['POST'])
+    app.add_url_rule('/inbox/messages', 'inbox_messages', inbox_messages, methods=['GET'])
+    app.add_url_rule('/inbox/messages/transition', 'inbox_transition', inbox_transition, methods=['POST'])
+    app.add_url_rule('/inbox/unread', 'inbox_unread', inbox_unread, methods=['GET'])
+    app.add_url_rule('/stats/budget', 'budget_stats', budget_stats, methods=['GET'])
+    app.add_url_rule('/stats/transcription', 'transcription_stats', transcription_stats, methods=['GET'])
+    app.add_url_rule('/metrics', 'metrics_endpoint', metrics_endpoint, methods=['GET'])
+    app.add_url_rule('/healthz', 'healthz', healthz, methods=['GET'])
+    app.add_url_rule('/readyz', 'readyz', readyz, methods=['GET'])
+    app.add_url_rule('/test', 'test_route', test_route, methods=['GET'])
+    return app
+
+
+def extract_call_params(params_source) -> Dict:
+    """בניית פרמטרי השיחה מתוך הפרמטרים שהתקבלו מהמרכזיה"""
+    call_params = {
+        'PBXphone': params_source.get('PBXphone'),
+        'PBXnum': params_source.get('PBXnum'),
+        'PBXdid': params_source.get('PBXdid'),
+        'PBXcallId': params_source.get('PBXcallId'),
+        'PBXcallType': params_source.get('PBXcallType'),
+        'PBXcallStatus': params_source.get('PBXcallStatus'),
+        'PBXextensionId': params_source.get('PBXextensionId'),
+        'PBXextensionPath': params_source.get('PBXextensionPath')
+    }
+    
+    # הוספת כל הפרמטרים הנוספים שנאספו
+    for key, value in params_source.items():
+        if not key.startswith('PBX') and key != request_profiler.QUERY_PARAM:
+            call_params[key] = value
+    
+    return call_params
+
+
+def plan_pbx_request(call_params: Dict, menu_name: str = None) -> Dict:
+    """ניתוב בקשה מהמרכזיה ללא גישה למאגר - מחזיר מה צריך לבצע
+    
+    אחד מהבאים:
+        {'response': ..., 'status': ...} - תגובה מיידית
+        {'poll': True, 'call_id': ...} - איסוף תוצאה של פעולה שרצה ברקע
+        {'call_id': ..., 'node': ..., 'operation': ...} - פעולה להרצה בתקציב הזמן
+    """
+    call_id = call_params.get('PBXcallId')
+    phone_number = call_params.get('PBXphone')
+    
+    if not call_id or not phone_number:
+        logger.error(f"חסרים פרמטרים נדרשים: call_id={call_id}, phone_number={phone_number}")
+        return {'response': {"error": "חסרים פרמטרים נדרשים"}, 'status': 400}
+    
+    # כל הפניות של השיחה נקשרות ל-trace אחד לפי PBXcallId
+    tracing.set_call(tracing.current_span(), call_id)
+    
+    # בדיקה אם יש קלט מהמשתמש
+    user_inputs = {}
+    for key, value in call_params.items():
+        if not key.startswith('PBX') and value and str(value).strip():
+            user_inputs[key] = value
+    
+    if menu_name:
+        # פנייה לנתיב של תפריט מסוים - הקלט הוא הערך בשם התפריט
+        if not user_inputs.get(menu_name):
+            return {'response': invalid_choice_menu(), 'status': 200}
+        node = menu_name
+    else:
+        node = list(user_inputs.keys())[0] if user_inputs else 'entry'
+    
+    # חזרה מתפריט המתנה - איסוף תוצאה של פעולה שרצה ברקע
+    if node == 'pleaseWait' or (node == 'entry' and get_pending_operations().has_pending(call_id)):
+        return {'poll': True, 'call_id': call_id}
+    
+    if node != 'entry':
+        # יש קלט מהמשתמש - צריך לטפל בו
+        input_value = user_inputs[node]
+        operation = lambda: get_pbx_handler().process_call_input(call_id, call_params, node, input_value)
+    else:
+        operation = lambda: get_pbx_handler().process_call_entry(call_id, call_params)
+    
+    return {'call_id': call_id, 'node': node, 'operation': operation}
+
+
+def request_params_source():
+    """קבלת פרמטרים מהמרכזיה (מ-GET או POST)"""
+    from flask import request
+    
+    if request.method == 'POST':
+        # אם זה POST, ננסה לקבל מה-form data או JSON
+        if request.form:
+            return request.form
+        elif request.get_json(silent=True):
+            return request.get_json(silent=True)
+    return request.args
+
+
+def metric_node(node: str) -> str:
+    """שם הצומת במדדים (child_birth_year_1, _2... מאוחדים)"""
+    if node and node.startswith('child_birth_year_'):
+        return 'child_birth_year'
+    return node
+
+
+def record_pbx_request(method: str, params, plan: Dict, outcome: str, status: int,
+                       elapsed: float, response=None):
+    """מדדים ושורת לוג אחת לבקשה, ורישום מלא (פרמטרים ותגובה) לבקשות שנדגמו"""
+    call_id = plan.get('call_id') or params.get('PBXcallId')
+    node = plan.get('node') or ('pleaseWait' if plan.get('poll') else None)
+    
+    PBX_REQUEST_SECONDS.labels(metric_node(node)).observe(elapsed)
+    PBX_RESPONSES.labels(str(status), outcome).inc()
+    init_worker()['active_calls'].touch(call_id)
+    span = tracing.current_span()
+    if span:
+        span.tag(node=node, outcome=outcome, status=status)
+    
+    logger.info(structured('pbx_request', call_id=call_id, node=node, method=method,
+                           outcome=outcome, status=status, ms=round(elapsed * 1000, 1)))
+    if get_dump_sampler().allow():
+        logger.info(structured('pbx_request_dump', call_id=call_id, params=dict(params), response=response))
+
+
+def serve_pbx_request(menu_name: str = None):
+    """טיפול בבקשה מהמרכזיה בתוך תקציב הזמן"""
+    from flask import request, jsonify
+    
+    with tracing.request_span('pbx_request', menu=menu_name), \
+            request_profiler.profile_request(get_config(), request.headers.get(request_profiler.HEADER),
+                                             request.args.get(request_profiler.QUERY_PARAM),
+                                             request.remote_addr) as profile:
+        budget = RequestBudget(get_config().PBX_REQUEST_BUDGET_SECONDS)
+        params, plan = {}, {}
+        admitted = False
+        try:
+            params = request_params_source()
+            plan = plan_pbx_request(extract_call_params(params), menu_name)
+            
+            if 'response' in plan:
+                record_pbx_request(request.method, params, plan, 'rejected', plan['status'], budget.elapsed(),
+                                   plan['response'])
+                return jsonify(plan['response']), plan['status']
+            
+            if not admit_pbx_request(params, plan):
+                record_pbx_request(request.method, params, plan, 'shed', 200, budget.elapsed())
+                return jsonify(system_busy_menu())
+            admitted = True
+            
+            if plan.get('poll'):
+                result = poll_pending_operation(plan['call_id'], budget)
+                record_pbx_request(request.method, params, plan, 'poll', 200, budget.elapsed(), result)
+                return jsonify(result)
+            
+            done, result = get_pending_operations().run(plan['call_id'], plan['node'],
+                                                        profiled_operation(profile, plan), budget.remaining())
+            if not done:
+                record_pbx_request(request.method, params, plan, 'hold', 200, budget.elapsed())
+                return jsonify(hold_menu())
+            
+            record_pbx_request(request.method, params, plan, 'done', 200, budget.elapsed(), result)
             return jsonify(result)
         
-        logger.info("אין קלט משתמש - זו פנייה ראשונית")
-        
-        # אין קלט - זו פנייה ראשונית
-        customer = pbx_handler.get_customer_by_phone(phone_number)
-        
-        if not customer:
-            # לקוח לא קיים - העברה לשלוחת הרשמה
-            logger.info("לקוח לא קיים - מציג תפריט לקוח חדש")
-            return handle_new_customer()
-        
-        # בדיקת תוקף מנוי
-        if not pbx_handler.is_subscription_active(customer):
-            # מנוי לא בתוקף - העברה לשלוחת הצטרפות
-            logger.info("מנוי לא בתוקף - מציג תפריט חידוש מנוי")
-            return handle_subscription_renewal()
-        
-        # לקוח עם מנוי בתוקף - הצגת תפריט ראשי
-        logger.info("לקוח עם מנוי בתוקף - מציג תפריט ראשי")
+        except OperationInProgress as e:
+            # הקלט לא בוצע; בפנייה הבאה נאספת התוצאה של הפעולה שרצה
+            logger.warning(str(e))
+            record_pbx_request(request.method, params, plan, 'busy', 200, budget.elapsed())
+            return jsonify(hold_menu())
+        except Exception as e:
+            logger.error(f"שגיאה בטיפול בפנייה: {str(e)}", exc_info=True)
+            record_pbx_request(request.method, params, plan, 'error', 500, budget.elapsed())
+            return jsonify({"error": "שגיאה בטיפול בבקשה"}), 500
+        finally:
+            if admitted:
+                get_admission().release()
+
+
+def admit_pbx_request(params, plan: Dict) -> bool:
+    """בקרת כניסה: שיחה חדשה (entry) נדחית לפני שיחה שכבר באמצע תהליך"""
+    is_entry = plan.get('node') == 'entry'
+    reason = get_admission().admit(is_entry, params.get('PBXphone'))
+    if reason:
+        logger.warning(structured('pbx_request_shed', call_id=plan.get('call_id'),
+                                  node=plan.get('node'), reason=reason))
+        return False
+    return True
+
+
+def profiled_operation(profile, plan: Dict):
+    """הפעולה של הבקשה, תחת פרופיילר אם הבקשה נבחרה לפרופיילינג"""
+    if profile is None:
+        return plan['operation']
+    profile.bind(plan['call_id'], plan['node'])
+    return profile.wrap(plan['operation'])
+
+
+def handle_pbx_request():
+    """נקודת הכניסה הראשית לפניות מהמרכזיה"""
+    return serve_pbx_request()
+
+
+def handle_menu_choice(menu_name):
+    """פנייה מהמרכזיה עם בחירה בתפריט מסוים"""
+    return serve_pbx_request(menu_name)
+
+
+def poll_pending_operation(call_id: str, budget: RequestBudget) -> Dict:
+    """איסוף תוצאה של פעולה שרצה ברקע, או תפריט המתנה נוסף"""
+    found, done, result = get_pending_operations().poll(call_id, budget.remaining())
+    return pending_poll_response(call_id, found, done, result)
+
+
+def pending_poll_response(call_id: str, found: bool, done: bool, result) -> Dict:
+    """התגובה למתקשר לפי מצב הפעולה שרצה ברקע"""
+    if not found:
+        # התוצאה כבר נאספה או שהפעולה רצה בתהליך אחר
+        logger.warning(f"שיחה {call_id}: לא נמצאה פעולה ממתינה")
         return show_main_menu()
+    if not done:
+        return hold_menu()
+    return result
+
+
+def budget_stats():
+    """מספר החריגות מתקציב הזמן לפי שלב בשיחה"""
+    from flask import jsonify
+    
+    operations = get_pending_operations()
+    return jsonify({
+        "budget_seconds": get_config().PBX_REQUEST_BUDGET_SECONDS,
+        "overruns": operations.overrun_counts(),
+        "pending": operations.pending_count()
+    })
+
+
+def transcription_stats():
+    """מצב תור התמלול ותפוקה לדקת שמע (hours - טווח התפוקה, ברירת מחדל 24)"""
+    from flask import request, jsonify
+    
+    hours = request.args.get('hours', 24, type=float)
+    return jsonify(get_pbx_handler().db.get_transcription_stats(hours))
+
+
+def inbox_route(func):
+    """נתיב של תיבת ההודעות: בדיקת ה-token והחזרת (status, body) של staff_inbox כ-JSON"""
+    def route():
+        from flask import request, jsonify
         
-    except Exception as e:
-        logger.error(f"שגיאה בטיפול בפנייה: {str(e)}", exc_info=True)
-        return jsonify({"error": "שגיאה בטיפול בבקשה"}), 500
+        if not staff_inbox.inbox_authorized(get_config(), request.headers.get(staff_inbox.TOKEN_HEADER)):
+            return jsonify({"error": "אין הרשאה"}), 403
+        status, body = func(request)
+        return jsonify(body), status
+    route.__name__ = func.__name__
+    route.__doc__ = func.__doc__
+    return route
+
+
+@inbox_route
+def inbox_messages(request):
+    """עמוד הודעות לצוות (keyset)"""
+    return staff_inbox.list_inbox(get_pbx_handler().db, request.args, get_config())
+
+
+@inbox_route
+def inbox_transition(request):
+    """מעבר מנת הודעות לסטטוס הבא"""
+    return staff_inbox.transition(get_pbx_handler().db, request.get_json(silent=True), get_config())
+
+
+@inbox_route
+def inbox_unread(request):
+    """מספר ההודעות החדשות, מהמונים"""
+    return staff_inbox.unread(get_pbx_handler().db)
+
+
+def upload_recording(message_id: int):
+    """העלאת קובץ ההקלטה של הודעה מהמרכזיה (נקרא ונכתב בחלקים)"""
+    from flask import request, jsonify
+    
+    config = get_config()
+    if not upload_authorized(config, request.headers.get(UPLOAD_TOKEN_HEADER)):
+        return jsonify({"error": "אין הרשאה"}), 403
+    
+    upload = RecordingUpload(get_pbx_handler().db, message_id, request.content_length, config)
+    chunk_bytes = config.RECORDING_CHUNK_BYTES
+    status, body = upload.receive(iter(lambda: request.stream.read(chunk_bytes), b''))
+    return jsonify(body), status
+
+
+def metrics_endpoint():
+    """מדדים בפורמט הטקסט של Prometheus"""
+    from flask import Response
+    
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+def worker_metrics() -> None:
+    """מדדים שנקראים מהמצב של ה-worker בזמן הבקשה ל-/metrics"""
+    metrics.gauge_callback('pbx_active_calls', 'שיחות עם פנייה בזמן PBX_SESSION_IDLE_SECONDS האחרון', [],
+                           lambda: {(): init_worker()['active_calls'].count()})
+    metrics.gauge_callback('pbx_pending_operations', 'פעולות שחרגו מתקציב הזמן ועדיין ממתינות לאיסוף', [],
+                           lambda: {(): get_pending_operations().pending_count()})
+    metrics.counter_callback('pbx_budget_overruns_total', 'חריגות מתקציב הזמן לפי צומת IVR', ['node'],
+                             lambda: {(metric_node(node),): count
+                                      for node, count in get_pending_operations().overrun_counts().items()})
+    metrics.gauge_callback('pbx_in_flight_requests', 'בקשות מהמרכזיה שבטיפול (בקרת כניסה)', [],
+                           lambda: {(): get_admission().in_flight_count()})
+    metrics.counter_callback('pbx_admission_rejections_total', 'בקשות שנדחו בבקרת הכניסה לפי סיבה', ['reason'],
+                             lambda: {(reason,): count for reason, count in get_admission().rejection_counts().items()})
+    metrics.gauge_callback('pbx_icount_breaker_open', 'המפסק של iCount פתוח (1) או סגור / בניסיון (0)', [],
+                           lambda: {(): int(icount_breaker_state(get_pbx_handler()) == 'open')})
+
+
+worker_metrics()
+
+
+def healthz():
+    """בדיקת חיות - בלי מאגר ובלי רשת"""
+    from flask import jsonify
+    
+    return jsonify(liveness())
+
+
+def readyz():
+    """בדיקת מוכנות מהתוצאה האחרונה של בדיקות הרקע (503 כשלא מוכן)"""
+    from flask import jsonify
+    
+    ready, details = get_health().readiness()
+    return jsonify(details), 200 if ready else 503
 
 
-@app.route('/test', methods=['GET'])
 def test_route():
     """route לבדיקה"""
+    from flask import request, jsonify
+    
     return jsonify({
         "status": "OK",
         "message": "השרת פעיל",
@@ -1156,9 +1439,10 @@ def test_route():
     })
 
 
+@prompt
 def handle_new_customer():
     """טיפול בלקוח חדש"""
-    return jsonify({
+    return {
         "type": "simpleMenu",
         "name": "newCustomer",
         "times": 1,
@@ -1172,12 +1456,13 @@ def handle_new_customer():
                 "activatedKeys": "1,2"
             }
         ]
-    })
+    }
 
 
+@prompt
 def handle_subscription_renewal():
     """טיפול בחידוש מנוי"""
-    return jsonify({
+    return {
         "type": "simpleMenu", 
         "name": "renewSubscription",
         "times": 1,
@@ -1191,12 +1476,72 @@ def handle_subscription_renewal():
                 "activatedKeys": "1,2"
             }
         ]
-    })
+    }
+
+
+@prompt
+def invalid_choice_menu():
+    """לא התקבלה בחירה תקינה"""
+    return {
+        "type": "simpleMenu",
+        "name": "invalidChoice",
+        "times": 1,
+        "timeout": 5,
+        "enabledKeys": "0",
+        "setMusic": "no",
+        "files": [
+            {
+                "text": "לא התקבלה בחירה. לחץ 0 לחזרה לתפריט הראשי.",
+                "activatedKeys": "0"
+            }
+        ]
+    }
+
+
+@prompt
+def hold_menu():
+    """תפריט המתנה בזמן שפעולה ארוכה רצה ברקע - חוזר למערכת עם אותו מזהה שיחה"""
+    return {
+        "type": "simpleMenu",
+        "name": "pleaseWait",
+        "times": 1,
+        "timeout": get_config().HOLD_POLL_SECONDS,
+        "enabledKeys": "1",
+        "setMusic": "yes",
+        "extensionChange": "",
+        "files": [
+            {
+                "text": "הבקשה שלך בטיפול, אנא המתן.",
+                "activatedKeys": "1"
+            }
+        ]
+    }
+
+
+@prompt
+def system_busy_menu():
+    """תגובה בזמן עומס - בלי מאגר ובלי iCount. בסיום הפנייה חוזרת כשיחה חדשה"""
+    return {
+        "type": "simpleMenu",
+        "name": "systemBusy",
+        "times": 1,
+        "timeout": 5,
+        "enabledKeys": "",
+        "setMusic": "no",
+        "extensionChange": "",
+        "files": [
+            {
+                "text": "המערכת עמוסה כרגע. אנא התקשר שוב בעוד מספר דקות.",
+                "activatedKeys": ""
+            }
+        ]
+    }
 
 
+@prompt
 def show_main_menu():
     """תפריט ראשי ללקוחות עם מנוי בתוקף"""
-    return jsonify({
+    return {
         "type": "simpleMenu",
         "name": "mainMenu", 
         "times": 3,
@@ -1210,9 +1555,10 @@ def show_main_menu():
                 "activatedKeys": "1,2,3,4,5,6,0"
             }
         ]
-    })
+    }
 
 
+@prompt
 def handle_create_receipt():
     """התחלת תהליך הנפקת קבלה"""
     return {
@@ -1234,6 +1580,7 @@ def handle_create_receipt():
     }
 
 
+@prompt
 def handle_cancel_receipt():
     """ביטול קבלה"""
     return {
@@ -1253,6 +1600,7 @@ def handle_cancel_receipt():
     }
 
 
+@prompt
 def handle_update_personal_details():
     """עדכון פרטים אישיים"""
     return {
@@ -1277,7 +1625,7 @@ def handle_leave_message():
     return {
         "type": "record",
         "name": "customerMessage",
-        "max": 180,  # 3 דקות
+        "max": get_config().MAX_RECORDING_MINUTES * 60,
         "min": 3,
         "confirm": "confirmOnly",
         "fileName": f"message_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
@@ -1290,6 +1638,7 @@ def handle_leave_message():
     }
 
 
+@prompt
 def handle_annual_report():
     """בקשת דיווח שנתי"""
     return {
@@ -1301,7 +1650,7 @@ def handle_annual_report():
         "setMusic": "no",
         "files": [
             {
-                "text": "הדיווח השנתי שלך יישלח אליך בהודעת SMS תוך 24 שעות. לחץ 1 לאישור או 0 לביטול.",
+                "text": "הדיווח השנתי שלך יופק תוך 24 שעות. לחץ 1 לאישור או 0 לביטול.",
                 "activatedKeys": "1,0"
             }
         ]
@@ -1310,7 +1659,7 @@ def handle_annual_report():
 
 def init_sample_data():
     """הוספת נתוני דוגמה למאגר"""
-    conn = sqlite3.connect(pbx_handler.db.db_path)
+    conn = sqlite3.connect(get_config().DATABASE_PATH)
     cursor = conn.cursor()
     
     try:
@@ -1350,7 +1699,19 @@ def init_sample_data():
         conn.close()
 
 
+def __getattr__(name):
+    # אפליקציה ברירת מחדל - עבור gunicorn cloud_pbx_server:app.
+    # נוצרת בגישה הראשונה ולא בייבוא המודול (למשל מ-asgi_pbx_server, שלא צריך את Flask)
+    if name == 'app':
+        app = create_app()
+        globals()['app'] = app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == '__main__':
+    app = create_app()
+    
     # יצירת נתוני דוגמה
     init_sample_data()
     
@@ -23,18 +23,89 @@ class Config:
     ICOUNT_CID = os.getenv('ICOUNT_CID', '')
     ICOUNT_USER = os.getenv('ICOUNT_USER', '')
     ICOUNT_PASS = os.getenv('ICOUNT_PASS', '')
+    ICOUNT_TIMEOUT_SECONDS = float(os.getenv('ICOUNT_TIMEOUT_SECONDS', 30))
     
     # הגדרות SMS (אם נדרש)
     SMS_API_KEY = os.getenv('SMS_API_KEY', '')
     SMS_SENDER = os.getenv('SMS_SENDER', 'MySystem')
     
-    # הגדרות זכויות (לחישובים)
-    WORK_BENEFIT_BASE = 2000  # מענק עבודה בסיסי
-    BIRTH_BENEFIT_PER_CHILD = 1500  # דמי לידה לילד
+    # תקציב זמן לבקשה מהמרכזיה (קצר מה-timeout של המרכזיה)
+    PBX_REQUEST_BUDGET_SECONDS = float(os.getenv('PBX_REQUEST_BUDGET_SECONDS', 4))
+    PBX_OPERATION_THREADS = int(os.getenv('PBX_OPERATION_THREADS', 16))
+    HOLD_POLL_SECONDS = int(os.getenv('HOLD_POLL_SECONDS', 5))  # משך תפריט ההמתנה לפני פנייה חוזרת
+    PENDING_RESULT_TTL_SECONDS = 300  # כמה זמן לשמור תוצאה שלא נאספה
+    # שיחה נספרת כפעילה במדדים אם הייתה ממנה פנייה בזמן הזה
+    PBX_SESSION_IDLE_SECONDS = int(os.getenv('PBX_SESSION_IDLE_SECONDS', 120))
     
-    # הגדרות הקלטות
+    # בקרת כניסה בעומס (לכל worker, ראו admission.py)
+    ADMISSION_MAX_IN_FLIGHT = int(os.getenv('ADMISSION_MAX_IN_FLIGHT', 32))
+    ADMISSION_ENTRY_SHARE = float(os.getenv('ADMISSION_ENTRY_SHARE', 0.75))  # חלק המקומות לשיחות חדשות
+    ADMISSION_CALLER_MAX_ENTRIES = int(os.getenv('ADMISSION_CALLER_MAX_ENTRIES', 5))  # שיחות חדשות ממספר אחד
+    ADMISSION_CALLER_WINDOW_SECONDS = int(os.getenv('ADMISSION_CALLER_WINDOW_SECONDS', 60))
+    
+    # בדיקת מוכנות (/readyz) - תדירות בדיקות הרקע
+    HEALTH_PROBE_SECONDS = float(os.getenv('HEALTH_PROBE_SECONDS', 5))
+    # מפסק ל-iCount: כישלונות רצופים עד לפתיחה, וזמן עד לניסיון חוזר
+    ICOUNT_BREAKER_FAILURES = int(os.getenv('ICOUNT_BREAKER_FAILURES', 5))
+    ICOUNT_BREAKER_RESET_SECONDS = float(os.getenv('ICOUNT_BREAKER_RESET_SECONDS', 30))
+    
+    # הפקת קבלות: immediate - מול iCount בזמן השיחה, batched - באצווה בסוף היום
+    RECEIPT_SUBMISSION_MODE = os.getenv('RECEIPT_SUBMISSION_MODE', 'immediate')
+    # קבלה שנשארה pending זמן כזה (הטיפול קרס באמצע) נבדקת ב-iCount ומטופלת מחדש בבקשה החוזרת
+    RECEIPT_PENDING_STALE_MINUTES = int(os.getenv('RECEIPT_PENDING_STALE_MINUTES', 5))
+    RECEIPT_BATCH_HOUR = int(os.getenv('RECEIPT_BATCH_HOUR', 23))
+    RECEIPT_BATCH_SIZE = int(os.getenv('RECEIPT_BATCH_SIZE', 500))
+    RECEIPT_BATCH_PARALLELISM = int(os.getenv('RECEIPT_BATCH_PARALLELISM', 4))
+    RECEIPT_BATCH_RATE_PER_SECOND = float(os.getenv('RECEIPT_BATCH_RATE_PER_SECOND', 5))
+    
+    # הגדרות ביטול קבלות ברקע
+    CANCELLATION_WORKER_ENABLED = os.getenv('CANCELLATION_WORKER_ENABLED', 'True').lower() == 'true'
+    CANCELLATION_POLL_SECONDS = float(os.getenv('CANCELLATION_POLL_SECONDS', 30))
+    CANCELLATION_BATCH_SIZE = int(os.getenv('CANCELLATION_BATCH_SIZE', 20))
+    CANCELLATION_MAX_ATTEMPTS = int(os.getenv('CANCELLATION_MAX_ATTEMPTS', 5))
+    
+    # הפקת דיווחים שנתיים (annual_report_worker.py)
+    ANNUAL_REPORT_DIR = os.getenv('ANNUAL_REPORT_DIR', './reports')
+    ANNUAL_REPORT_BATCH_SIZE = int(os.getenv('ANNUAL_REPORT_BATCH_SIZE', 500))
+    ANNUAL_REPORT_PROCESSES = int(os.getenv('ANNUAL_REPORT_PROCESSES', 0))  # 0 - לפי מספר המעבדים
+    ANNUAL_REPORT_POLL_SECONDS = float(os.getenv('ANNUAL_REPORT_POLL_SECONDS', 60))
+    ANNUAL_REPORT_MAX_ATTEMPTS = int(os.getenv('ANNUAL_REPORT_MAX_ATTEMPTS', 3))
+    
+    # כללי הזכויות לפי שנת מס (סכומים, מדרגות מקומות עבודה וגילאים) - ראו benefit_rules.py
+    BENEFIT_RULES_FILE = os.getenv('BENEFIT_RULES_FILE', '')  # ריק - benefit_rules.json שליד הקוד
+    
+    # הגדרות הקלטות (קליטה ברקע - recording_ingest.py)
     RECORDINGS_PATH = os.getenv('RECORDINGS_PATH', './recordings')
-    MAX_RECORDING_MINUTES = 3
+    MAX_RECORDING_MINUTES = int(os.getenv('MAX_RECORDING_MINUTES', 3))
+    # כתובת להורדת קובץ לפי השם שהמרכזיה מחזירה; ריק - המרכזיה מעלה ל-POST /recordings/<message_id>
+    RECORDINGS_BASE_URL = os.getenv('RECORDINGS_BASE_URL', '')
+    RECORDINGS_UPLOAD_TOKEN = os.getenv('RECORDINGS_UPLOAD_TOKEN', '')  # ריק - העלאה חסומה
+    RECORDING_MAX_BYTES = int(os.getenv('RECORDING_MAX_BYTES', 32 * 1024 * 1024))
+    RECORDING_CHUNK_BYTES = int(os.getenv('RECORDING_CHUNK_BYTES', 64 * 1024))
+    RECORDING_FETCH_TIMEOUT = float(os.getenv('RECORDING_FETCH_TIMEOUT', 30))
+    RECORDING_INGEST_ENABLED = os.getenv('RECORDING_INGEST_ENABLED', 'True').lower() == 'true'
+    RECORDING_POLL_SECONDS = float(os.getenv('RECORDING_POLL_SECONDS', 30))
+    RECORDING_BATCH_SIZE = int(os.getenv('RECORDING_BATCH_SIZE', 10))
+    RECORDING_MAX_ATTEMPTS = int(os.getenv('RECORDING_MAX_ATTEMPTS', 5))
+    
+    # תמלול הודעות (transcription_worker.py). ENGINE - 'stub' או 'module:Class' (ראו transcription_engines.py)
+    TRANSCRIPTION_ENGINE = os.getenv('TRANSCRIPTION_ENGINE', 'stub')
+    TRANSCRIPTION_LANGUAGE = os.getenv('TRANSCRIPTION_LANGUAGE', 'he')
+    TRANSCRIPTION_PROCESSES = int(os.getenv('TRANSCRIPTION_PROCESSES', 0))  # 0 - לפי מספר המעבדים
+    # תמלולים בטיפול לכל תהליך - לא נתפסות מהתור יותר הודעות ממה שהתהליכים יכולים לקבל
+    TRANSCRIPTION_QUEUE_PER_PROCESS = int(os.getenv('TRANSCRIPTION_QUEUE_PER_PROCESS', 2))
+    TRANSCRIPTION_BATCH_SIZE = int(os.getenv('TRANSCRIPTION_BATCH_SIZE', 50))  # תוצאות לעדכון במאגר בבת אחת
+    TRANSCRIPTION_FLUSH_SECONDS = float(os.getenv('TRANSCRIPTION_FLUSH_SECONDS', 2))
+    TRANSCRIPTION_POLL_SECONDS = float(os.getenv('TRANSCRIPTION_POLL_SECONDS', 30))
+    TRANSCRIPTION_MAX_ATTEMPTS = int(os.getenv('TRANSCRIPTION_MAX_ATTEMPTS', 3))
+    # מנוע הבדיקה: שניות עיבוד מדומות לכל שניית שמע
+    TRANSCRIPTION_STUB_REALTIME_FACTOR = float(os.getenv('TRANSCRIPTION_STUB_REALTIME_FACTOR', 0))
+    
+    # תיבת ההודעות של הצוות (staff_inbox.py). TOKEN ריק - ה-API חסום
+    INBOX_API_TOKEN = os.getenv('INBOX_API_TOKEN', '')
+    INBOX_PAGE_SIZE = int(os.getenv('INBOX_PAGE_SIZE', 50))
+    INBOX_MAX_PAGE_SIZE = int(os.getenv('INBOX_MAX_PAGE_SIZE', 200))
+    INBOX_MAX_TRANSITION = int(os.getenv('INBOX_MAX_TRANSITION', 1000))  # הודעות בבקשת מעבר סטטוס אחת
     
     # הגדרות תוקף מנוי  
     DEFAULT_SUBSCRIPTION_MONTHS = 12
@@ -42,6 +113,24 @@ class Config:
     # הגדרות לוגים
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
     LOG_FILE = os.getenv('LOG_FILE', 'pbx_system.log')
+    # כתיבת הלוג מ-thread נפרד (התור לא חוסם את הבקשה)
+    LOG_QUEUE_ENABLED = os.getenv('LOG_QUEUE_ENABLED', 'True').lower() == 'true'
+    # חלק הבקשות שנרשמות במלואן (פרמטרים ותגובה), ותקרה לשנייה
+    LOG_DUMP_SAMPLE_RATE = float(os.getenv('LOG_DUMP_SAMPLE_RATE', 0.01))
+    LOG_DUMP_MAX_PER_SECOND = float(os.getenv('LOG_DUMP_MAX_PER_SECOND', 2))
+    
+    # מעקב שיחות (spans בפורמט Zipkin v2 לקובץ מקומי, ראו trace_query.py)
+    TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'True').lower() == 'true'
+    TRACE_FILE = os.getenv('TRACE_FILE', 'pbx_traces.jsonl')
+    TRACE_BATCH_SIZE = int(os.getenv('TRACE_BATCH_SIZE', 100))
+    TRACE_FLUSH_SECONDS = float(os.getenv('TRACE_FLUSH_SECONDS', 2))
+    
+    # פרופיילינג של בקשה בודדת (cProfile, ראו request_profiler.py)
+    PROFILE_HEADER_TOKEN = os.getenv('PROFILE_HEADER_TOKEN', '')
+    PROFILE_ADMIN_IPS = tuple(ip.strip() for ip in os.getenv('PROFILE_ADMIN_IPS', '127.0.0.1').split(',') if ip.strip())
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_MAX_PER_MINUTE = int(os.getenv('PROFILE_MAX_PER_MINUTE', 10))
+    PROFILE_DIR = os.getenv('PROFILE_DIR', './profiles')
 
 class DevelopmentConfig(Config):
     """הגדרות לסביבת פיתוח"""
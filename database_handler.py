@@ -3,19 +3,81 @@
 
 import sqlite3
 import json
+import hashlib
+import uuid
 import logging
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Sequence, Tuple
 from config import Config
+import metrics
+import tracing
 
 logger = logging.getLogger(__name__)
 
+# זמן ריצה לכל מתודה של DatabaseHandler (הסדרות נרשמות בקישוט המחלקה)
+DB_OPERATION_SECONDS = metrics.histogram('pbx_db_operation_seconds', 'זמן פעולת מאגר לפי מתודה', ['method'])
+
+# גרסת מבנה המאגר (PRAGMA user_version) - להעלות בכל שינוי ב-init_database
+SCHEMA_VERSION = 12
+
+# תרומת קבלה אחת (NEW או OLD בטריגר) לסיכום השנתי של הלקוח. הסכומים באגורות -
+# הוספה והפחתה חוזרות נשארות מדויקות
+_YEAR_TOTALS_ADD = '''
+    INSERT INTO customer_year_totals
+        (customer_id, year, completed_count, completed_cents, cancelled_count, cancelled_cents, updated_at)
+    SELECT NEW.customer_id, CAST(strftime('%Y', NEW.created_at) AS INTEGER),
+           NEW.status = 'completed',
+           CASE WHEN NEW.status = 'completed' THEN CAST(ROUND(COALESCE(NEW.amount, 0) * 100) AS INTEGER) ELSE 0 END,
+           NEW.status = 'cancelled',
+           CASE WHEN NEW.status = 'cancelled' THEN CAST(ROUND(COALESCE(NEW.amount, 0) * 100) AS INTEGER) ELSE 0 END,
+           CURRENT_TIMESTAMP
+    WHERE NEW.status IN ('completed', 'cancelled')
+    ON CONFLICT (customer_id, year) DO UPDATE SET
+        completed_count = completed_count + excluded.completed_count,
+        completed_cents = completed_cents + excluded.completed_cents,
+        cancelled_count = cancelled_count + excluded.cancelled_count,
+        cancelled_cents = cancelled_cents + excluded.cancelled_cents,
+        updated_at = excluded.updated_at;
+'''
+_YEAR_TOTALS_SUBTRACT = '''
+    UPDATE customer_year_totals SET
+        completed_count = completed_count - (OLD.status = 'completed'),
+        completed_cents = completed_cents -
+            CASE WHEN OLD.status = 'completed' THEN CAST(ROUND(COALESCE(OLD.amount, 0) * 100) AS INTEGER) ELSE 0 END,
+        cancelled_count = cancelled_count - (OLD.status = 'cancelled'),
+        cancelled_cents = cancelled_cents -
+            CASE WHEN OLD.status = 'cancelled' THEN CAST(ROUND(COALESCE(OLD.amount, 0) * 100) AS INTEGER) ELSE 0 END,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE OLD.status IN ('completed', 'cancelled')
+      AND customer_id = OLD.customer_id AND year = CAST(strftime('%Y', OLD.created_at) AS INTEGER);
+'''
+# אותו סיכום מחושב מחדש מכל הקבלות (לבנייה מחדש ולבדיקה)
+_YEAR_TOTALS_FROM_RECEIPTS = '''
+    SELECT customer_id, CAST(strftime('%Y', created_at) AS INTEGER) AS year,
+           SUM(status = 'completed') AS completed_count,
+           SUM(CASE WHEN status = 'completed' THEN CAST(ROUND(COALESCE(amount, 0) * 100) AS INTEGER) ELSE 0 END)
+               AS completed_cents,
+           SUM(status = 'cancelled') AS cancelled_count,
+           SUM(CASE WHEN status = 'cancelled' THEN CAST(ROUND(COALESCE(amount, 0) * 100) AS INTEGER) ELSE 0 END)
+               AS cancelled_cents
+    FROM receipts
+    WHERE status IN ('completed', 'cancelled')
+    GROUP BY customer_id, year
+'''
+
+# סדר העדיפויות בתיבת ההודעות (דחוף קודם), ומעברי הסטטוס המותרים: סטטוס יעד -> סטטוס מקור
+MESSAGE_PRIORITIES = ('urgent', 'high', 'normal', 'low')
+MESSAGE_TRANSITIONS = {'processed': 'new', 'archived': 'processed'}
+
+@metrics.instrument_methods(DB_OPERATION_SECONDS)
+@tracing.trace_methods('db', exclude=('get_connection',))
 class DatabaseHandler:
     """מחלקה לטיפול במאגר הנתונים"""
     
-    def __init__(self, db_path: str = None):
+    def __init__(self, db_path: str = None, initialize: bool = True):
         self.db_path = db_path or Config.DATABASE_PATH
-        self.init_database()
+        if initialize:
+            self.init_database()
     
     def get_connection(self):
         """יצירת חיבור למאגר נתונים"""
@@ -38,6 +100,7 @@ class DatabaseHandler:
                 subscription_start_date DATE,
                 subscription_end_date DATE,
                 is_active BOOLEAN DEFAULT 1,
+                receipt_mode TEXT, -- immediate / batched (ריק = ברירת המחדל בהגדרות)
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                 updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
             )
@@ -92,7 +155,10 @@ class DatabaseHandler:
                 icount_response TEXT, -- תגובה מלאה מ-iCount
                 amount DECIMAL(10,2),
                 description TEXT,
-                status TEXT DEFAULT 'pending', -- pending, completed, cancelled, failed
+                status TEXT DEFAULT 'pending', -- pending, queued, submitting, completed, cancelled, failed, unknown
+                idempotency_key TEXT, -- מפתח למניעת כפילויות בשליחה חוזרת מהמרכזיה
+                batch_id INTEGER, -- מנת השליחה ל-iCount במצב אצווה
+                notified_at DATETIME, -- מתי נשלחה ללקוח הודעה על הקבלה
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                 updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (customer_id) REFERENCES customers (id),
@@ -118,6 +184,44 @@ class DatabaseHandler:
             )
         ''')
         
+        # קליטת קובץ ההקלטה של כל הודעה (recording_ingest.py) - הורדה או העלאה ברקע
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS recordings (
+                message_id INTEGER PRIMARY KEY,
+                source TEXT, -- כתובת להורדה; NULL - המרכזיה מעלה את הקובץ
+                status TEXT DEFAULT 'pending', -- pending, awaiting_upload, fetching, stored, rejected, failed
+                file_path TEXT,
+                format TEXT, -- wav / mp3
+                size_bytes INTEGER,
+                duration_seconds REAL,
+                attempts INTEGER DEFAULT 0,
+                last_error TEXT,
+                claim_token TEXT,
+                claimed_at DATETIME,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                stored_at DATETIME,
+                FOREIGN KEY (message_id) REFERENCES messages (id) ON DELETE CASCADE
+            )
+        ''')
+        
+        # תור התמלול (transcription_worker.py) - נוסף כשההקלטה נשמרה
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS transcription_jobs (
+                message_id INTEGER PRIMARY KEY,
+                status TEXT DEFAULT 'queued', -- queued, processing, done, failed
+                audio_seconds REAL,
+                engine TEXT,
+                engine_seconds REAL, -- זמן העיבוד של המנוע
+                attempts INTEGER DEFAULT 0,
+                last_error TEXT,
+                claim_token TEXT,
+                claimed_at DATETIME,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                finished_at DATETIME,
+                FOREIGN KEY (message_id) REFERENCES messages (id) ON DELETE CASCADE
+            )
+        ''')
+        
         # טבלת דיווחים שנתיים
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS annual_reports (
@@ -126,7 +230,11 @@ class DatabaseHandler:
                 report_year INTEGER NOT NULL,
                 report_data TEXT, -- JSON של נתוני הדיווח
                 report_file TEXT, -- נתיב לקובץ הדיווח
-                status TEXT DEFAULT 'requested', -- requested, generated, sent, failed
+                status TEXT DEFAULT 'requested', -- requested, generating, generated, sent, failed
+                claim_token TEXT,
+                claimed_at DATETIME,
+                attempts INTEGER DEFAULT 0,
+                last_error TEXT,
                 requested_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                 generated_at DATETIME,
                 sent_at DATETIME,
@@ -135,18 +243,221 @@ class DatabaseHandler:
             )
         ''')
         
+        # טבלת בקשות ביטול קבלות
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS receipt_cancellations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                customer_id INTEGER NOT NULL,
+                call_id TEXT,
+                receipt_id INTEGER,
+                receipt_num TEXT NOT NULL, -- מספר הקבלה כפי שהוקש
+                status TEXT DEFAULT 'requested', -- requested, processing, completed, failed, not_found
+                attempts INTEGER DEFAULT 0,
+                last_error TEXT,
+                claim_token TEXT,
+                claimed_at DATETIME,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                processed_at DATETIME,
+                FOREIGN KEY (customer_id) REFERENCES customers (id),
+                FOREIGN KEY (receipt_id) REFERENCES receipts (id)
+            )
+        ''')
+        
+        # טבלת מנות שליחת קבלות ל-iCount
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS receipt_batches (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                status TEXT DEFAULT 'running', -- running, completed
+                total INTEGER DEFAULT 0,
+                succeeded INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0,
+                duration_seconds REAL,
+                started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                finished_at DATETIME
+            )
+        ''')
+        
+        # זכויות מחושבות לכל לקוח (חישוב אצווה, ראו benefits_batch.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS customer_benefits (
+                customer_id INTEGER PRIMARY KEY,
+                work_benefit REAL NOT NULL,
+                birth_benefit REAL NOT NULL,
+                total_benefit REAL NOT NULL,
+                benefit_year INTEGER NOT NULL, -- השנה שלפיה חושבו גילאי הילדים
+                rules_version TEXT, -- BenefitsCalculator.rules_version() בזמן החישוב
+                details_updated_at DATETIME, -- customer_details.updated_at של הפרטים שמהם חושבו
+                computed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (customer_id) REFERENCES customers (id) ON DELETE CASCADE
+            )
+        ''')
+        
+        # ילדי הלקוח, שורה לכל ילד (children_birth_years ב-customer_details נשאר כעותק JSON)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS customer_children (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                customer_id INTEGER NOT NULL,
+                child_index INTEGER NOT NULL, -- סדר הילד כפי שהוקש (1, 2, ...)
+                birth_year INTEGER NOT NULL,
+                FOREIGN KEY (customer_id) REFERENCES customers (id) ON DELETE CASCADE
+            )
+        ''')
+        
+        # סיכום שנתי של קבלות לכל לקוח (לפי created_at), מתעדכן בטריגרים על receipts
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS customer_year_totals (
+                customer_id INTEGER NOT NULL,
+                year INTEGER NOT NULL,
+                completed_count INTEGER NOT NULL DEFAULT 0,
+                completed_cents INTEGER NOT NULL DEFAULT 0, -- סכום הקבלות שהופקו, באגורות
+                cancelled_count INTEGER NOT NULL DEFAULT 0,
+                cancelled_cents INTEGER NOT NULL DEFAULT 0,
+                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (customer_id, year)
+            )
+        ''')
+        
+        # מספר ההודעות לפי סטטוס ועדיפות (ספירת הלא-נקראו בלי COUNT על messages), מתעדכן בטריגרים
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS message_counts (
+                status TEXT NOT NULL,
+                priority TEXT NOT NULL,
+                messages INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (status, priority)
+            )
+        ''')
+        
+        # העברות נתונים חד-פעמיות שהושלמו (למשל מילוי customer_children מה-JSON)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS data_migrations (
+                name TEXT PRIMARY KEY,
+                completed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # עמודות שנוספו אחרי יצירת הטבלאות (מאגרים קיימים)
+        self._add_column_if_missing(cursor, 'receipts', 'idempotency_key', 'TEXT')
+        self._add_column_if_missing(cursor, 'receipts', 'batch_id', 'INTEGER')
+        self._add_column_if_missing(cursor, 'receipts', 'notified_at', 'DATETIME')
+        self._add_column_if_missing(cursor, 'customers', 'receipt_mode', 'TEXT')
+        self._add_column_if_missing(cursor, 'customer_benefits', 'rules_version', 'TEXT')
+        self._add_column_if_missing(cursor, 'customer_benefits', 'details_updated_at', 'DATETIME')
+        self._add_column_if_missing(cursor, 'annual_reports', 'claim_token', 'TEXT')
+        self._add_column_if_missing(cursor, 'annual_reports', 'claimed_at', 'DATETIME')
+        self._add_column_if_missing(cursor, 'annual_reports', 'last_error', 'TEXT')
+        self._add_column_if_missing(cursor, 'annual_reports', 'attempts', 'INTEGER DEFAULT 0')
+        
         # אינדקסים לביצועים טובים יותר
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_customers_phone ON customers (phone_number)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_calls_call_id ON calls (call_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_calls_phone ON calls (phone_number)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_receipts_customer ON receipts (customer_id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_customer ON messages (customer_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_messages_inbox ON messages (status, priority, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_recordings_status ON recordings (status, created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_transcriptions_status ON transcription_jobs (status, created_at)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_reports_customer ON annual_reports (customer_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_reports_status ON annual_reports (status, requested_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_reports_claim ON annual_reports (claim_token)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_children_customer ON customer_children (customer_id, birth_year)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_children_birth_year ON customer_children (birth_year, customer_id)')
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_receipts_idempotency ON receipts (idempotency_key)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_receipts_customer_docnum ON receipts (customer_id, icount_doc_num)')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_receipts_queued ON receipts (id) WHERE status = 'queued'")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_receipts_submitting ON receipts (id) WHERE status = 'submitting'")
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_receipts_batch ON receipts (batch_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_cancellations_status ON receipt_cancellations (status, created_at)')
+        # בקשת ביטול פתוחה אחת לכל קבלה
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_cancellations_open_receipt
+            ON receipt_cancellations (receipt_id) WHERE status IN ('requested', 'processing')
+        ''')
+        
+        # הסיכום השנתי מתעדכן באותה טרנזקציה שבה קבלה נוספת, משנה סטטוס/סכום או נמחקת
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_receipts_year_totals_insert
+            AFTER INSERT ON receipts
+            WHEN NEW.status IN ('completed', 'cancelled')
+            BEGIN {_YEAR_TOTALS_ADD} END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_receipts_year_totals_update
+            AFTER UPDATE OF status, amount, customer_id, created_at ON receipts
+            WHEN (OLD.status IN ('completed', 'cancelled') OR NEW.status IN ('completed', 'cancelled'))
+             AND (OLD.status IS NOT NEW.status OR OLD.amount IS NOT NEW.amount
+                  OR OLD.customer_id IS NOT NEW.customer_id OR OLD.created_at IS NOT NEW.created_at)
+            BEGIN {_YEAR_TOTALS_SUBTRACT} {_YEAR_TOTALS_ADD} END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_receipts_year_totals_delete
+            AFTER DELETE ON receipts
+            WHEN OLD.status IN ('completed', 'cancelled')
+            BEGIN {_YEAR_TOTALS_SUBTRACT} END
+        ''')
+        
+        # מוני ההודעות מתעדכנים באותה טרנזקציה שבה הודעה נוספת, משנה סטטוס/עדיפות או נמחקת
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_messages_counts_insert
+            AFTER INSERT ON messages
+            BEGIN
+                INSERT INTO message_counts (status, priority, messages)
+                VALUES (COALESCE(NEW.status, ''), COALESCE(NEW.priority, ''), 1)
+                ON CONFLICT (status, priority) DO UPDATE SET messages = messages + 1;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_messages_counts_update
+            AFTER UPDATE OF status, priority ON messages
+            WHEN OLD.status IS NOT NEW.status OR OLD.priority IS NOT NEW.priority
+            BEGIN
+                UPDATE message_counts SET messages = messages - 1
+                WHERE status = COALESCE(OLD.status, '') AND priority = COALESCE(OLD.priority, '');
+                INSERT INTO message_counts (status, priority, messages)
+                VALUES (COALESCE(NEW.status, ''), COALESCE(NEW.priority, ''), 1)
+                ON CONFLICT (status, priority) DO UPDATE SET messages = messages + 1;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_messages_counts_delete
+            AFTER DELETE ON messages
+            BEGIN
+                UPDATE message_counts SET messages = messages - 1
+                WHERE status = COALESCE(OLD.status, '') AND priority = COALESCE(OLD.priority, '');
+            END
+        ''')
         
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        cursor.execute('SELECT name FROM data_migrations')
+        migrated = {row[0] for row in cursor.fetchall()}
         conn.commit()
         conn.close()
+        
+        if 'customer_children' not in migrated:
+            self.backfill_customer_children()
+        if 'customer_year_totals' not in migrated:
+            self.rebuild_customer_year_totals()
+        if 'message_counts' not in migrated:
+            self.rebuild_message_counts()
         logger.info("מאגר הנתונים אותחל בהצלחה")
     
+    def _mark_migrated(self, name: str, conn=None):
+        """רישום העברת נתונים שהושלמה (בחיבור הנתון - באותה טרנזקציה)"""
+        own = conn is None
+        conn = conn or self.get_connection()
+        conn.execute('INSERT OR REPLACE INTO data_migrations (name, completed_at) VALUES (?, ?)',
+                     (name, datetime.now()))
+        if own:
+            conn.commit()
+            conn.close()
+    
+    @staticmethod
+    def _add_column_if_missing(cursor, table: str, column: str, definition: str):
+        """הוספת עמודה לטבלה קיימת אם היא חסרה"""
+        cursor.execute(f'PRAGMA table_info({table})')
+        columns = [row[1] for row in cursor.fetchall()]
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    
     # פונקציות לקוחות
     def get_customer_by_phone(self, phone_number: str) -> Optional[Dict]:
         """קבלת פרטי לקוח לפי מספר טלפון"""
@@ -210,7 +521,8 @@ class DatabaseHandler:
         values = []
         
         for key, value in kwargs.items():
-            if key in ['name', 'email', 'subscription_start_date', 'subscription_end_date', 'is_active']:
+            if key in ['name', 'email', 'subscription_start_date', 'subscription_end_date', 'is_active',
+                       'receipt_mode']:
                 set_clauses.append(f"{key} = ?")
                 values.append(value)
         
@@ -252,7 +564,12 @@ class DatabaseHandler:
         return dict(details) if details else None
     
     def update_customer_details(self, customer_id: int, **kwargs) -> bool:
-        """עדכון פרטים אישיים"""
+        """עדכון פרטים אישיים (children_birth_years - רשימת שנים או JSON; נשמר גם ב-customer_children)"""
+        birth_years = None
+        if 'children_birth_years' in kwargs:
+            birth_years = self.parse_birth_years(kwargs['children_birth_years'])
+            kwargs['children_birth_years'] = json.dumps(birth_years)
+        
         conn = self.get_connection()
         cursor = conn.cursor()
         
@@ -294,11 +611,209 @@ class DatabaseHandler:
             cursor.execute(query, values)
         
         success = cursor.rowcount > 0
+        if success:
+            if birth_years is not None:
+                self._replace_customer_children(cursor, customer_id, birth_years)
+            # הזכויות השמורות כבר לא תואמות - יחושבו מחדש בפעם הבאה שיתבקשו
+            cursor.execute('DELETE FROM customer_benefits WHERE customer_id = ?', (customer_id,))
         conn.commit()
         conn.close()
         
         return success
     
+    @staticmethod
+    def parse_birth_years(value) -> List[int]:
+        """שנות לידה מרשימה או מ-JSON; ערך לא תקין מדולג"""
+        if not value:
+            return []
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                return []
+        if not isinstance(value, list):
+            return []
+        years = []
+        for year in value:
+            try:
+                years.append(int(year))
+            except (ValueError, TypeError):
+                continue
+        return years
+    
+    @staticmethod
+    def _replace_customer_children(cursor, customer_id: int, birth_years: List[int]):
+        cursor.execute('DELETE FROM customer_children WHERE customer_id = ?', (customer_id,))
+        cursor.executemany('INSERT INTO customer_children (customer_id, child_index, birth_year) VALUES (?, ?, ?)',
+                           [(customer_id, index, year) for index, year in enumerate(birth_years, 1)])
+    
+    def get_customer_children(self, customer_id: int) -> List[int]:
+        """שנות הלידה של ילדי הלקוח, לפי סדר ההקשה"""
+        conn = self.get_connection()
+        rows = conn.execute('SELECT birth_year FROM customer_children WHERE customer_id = ? ORDER BY child_index',
+                            (customer_id,)).fetchall()
+        conn.close()
+        return [row[0] for row in rows]
+    
+    def backfill_customer_children(self, chunk_size: int = 20000) -> Dict[str, Any]:
+        """מילוי customer_children מ-children_birth_years, מנה של לקוחות בכל טרנזקציה.
+        אפשר להריץ שוב - הילדים של כל מנה נכתבים מחדש"""
+        last_id = 0
+        customers = children = 0
+        while True:
+            conn = self.get_connection()
+            # נעילת כתיבה לפני הקריאה, כדי שעדכון פרטים במקביל לא יידרס בערך ישן
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute('''
+                SELECT customer_id, children_birth_years FROM customer_details
+                WHERE customer_id > ?
+                ORDER BY customer_id
+                LIMIT ?
+            ''', (last_id, chunk_size)).fetchall()
+            if not rows:
+                conn.rollback()
+                conn.close()
+                break
+            first_id, last_id = rows[0][0], rows[-1][0]
+            children_rows = [(row[0], index, year) for row in rows
+                             for index, year in enumerate(self.parse_birth_years(row[1]), 1)]
+            conn.execute('DELETE FROM customer_children WHERE customer_id BETWEEN ? AND ?', (first_id, last_id))
+            conn.executemany('INSERT INTO customer_children (customer_id, child_index, birth_year) VALUES (?, ?, ?)',
+                             children_rows)
+            conn.commit()
+            conn.close()
+            customers += len(rows)
+            children += len(children_rows)
+        
+        self._mark_migrated('customer_children')
+        logger.info(f"customer_children מולאה: {children} ילדים של {customers} לקוחות")
+        return {'customers': customers, 'children': children}
+    
+    def iter_benefit_columns(self, first_birth_year: int, birth_amounts: Sequence[float], chunk_size: int = 50000):
+        """נתוני הזכויות של כל הלקוחות במנות, כעמודות:
+        (customer_ids, spouse1_workplaces, spouse2_workplaces, birth_benefit, details_updated_at).
+        דמי הלידה נסכמים במאגר: birth_amounts[i] הוא הסכום לילד שנולד ב-first_birth_year + i
+        (שנה מחוץ לטווח מקבלת את הסכום שבקצה הקרוב)"""
+        last_birth_year = first_birth_year + len(birth_amounts) - 1
+        last_id = 0
+        while True:
+            conn = self.get_connection()
+            # טבלת הסכומים עם מפתח לפי שנה - חיפוש לפי אינדקס לכל ילד
+            conn.execute('CREATE TEMP TABLE birth_amounts (birth_year INTEGER PRIMARY KEY, amount REAL NOT NULL)')
+            conn.executemany('INSERT INTO temp.birth_amounts (birth_year, amount) VALUES (?, ?)',
+                             [(first_birth_year + i, amount) for i, amount in enumerate(birth_amounts)])
+            rows = conn.execute('''
+                SELECT d.customer_id, COALESCE(d.spouse1_workplaces, 0), COALESCE(d.spouse2_workplaces, 0),
+                       COALESCE(SUM(a.amount), 0), d.updated_at
+                FROM customer_details d
+                LEFT JOIN customer_children c ON c.customer_id = d.customer_id
+                LEFT JOIN temp.birth_amounts a ON a.birth_year = MIN(MAX(c.birth_year, ?), ?)
+                WHERE d.customer_id > ?
+                GROUP BY d.customer_id
+                ORDER BY d.customer_id
+                LIMIT ?
+            ''', (first_birth_year, last_birth_year, last_id, chunk_size)).fetchall()
+            conn.close()
+            if not rows:
+                return
+            columns = tuple(zip(*rows))
+            last_id = columns[0][-1]
+            yield columns
+    
+    def children_by_birth_year(self, from_year: int = None, to_year: int = None) -> List[Dict]:
+        """מספר הילדים ומספר הלקוחות עם ילד לכל שנת לידה (מהאינדקס על birth_year, בלי JSON)"""
+        conditions = []
+        values = []
+        if from_year is not None:
+            conditions.append('birth_year >= ?')
+            values.append(from_year)
+        if to_year is not None:
+            conditions.append('birth_year <= ?')
+            values.append(to_year)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        
+        conn = self.get_connection()
+        rows = conn.execute(f'''
+            SELECT birth_year, COUNT(*) AS children, COUNT(DISTINCT customer_id) AS customers
+            FROM customer_children
+            {where}
+            GROUP BY birth_year
+            ORDER BY birth_year
+        ''', values).fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+    
+    def iter_customer_details_columns(self, chunk_size: int = 50000):
+        """פרטי הזכויות של כל הלקוחות במנות, כעמודות:
+        (customer_ids, spouse1_workplaces, spouse2_workplaces, children_birth_years, details_updated_at)"""
+        last_id = 0
+        while True:
+            conn = self.get_connection()
+            rows = conn.execute('''
+                SELECT customer_id, COALESCE(spouse1_workplaces, 0), COALESCE(spouse2_workplaces, 0),
+                       children_birth_years, updated_at
+                FROM customer_details
+                WHERE customer_id > ?
+                ORDER BY customer_id
+                LIMIT ?
+            ''', (last_id, chunk_size)).fetchall()
+            conn.close()
+            if not rows:
+                return
+            columns = tuple(zip(*rows))
+            last_id = columns[0][-1]
+            yield columns
+    
+    def save_customer_benefits(self, rows: List[Tuple]) -> int:
+        """שמירת זכויות מחושבות בטרנזקציה אחת. מחזיר את מספר השורות שנשמרו.
+        כל שורה: (customer_id, work_benefit, birth_benefit, total_benefit, benefit_year, rules_version,
+        details_updated_at). שורה נשמרת רק אם customer_details.updated_at עדיין זהה - פרטים שעודכנו
+        בין הקריאה לשמירה מחקו את הזכויות השמורות, וחישוב מהפרטים הישנים לא מחזיר אותן"""
+        conn = self.get_connection()
+        now = datetime.now()
+        before = conn.total_changes
+        conn.executemany('''
+            INSERT INTO customer_benefits
+                (customer_id, work_benefit, birth_benefit, total_benefit, benefit_year, rules_version,
+                 details_updated_at, computed_at)
+            SELECT ?, ?, ?, ?, ?, ?, d.updated_at, ?
+            FROM customer_details d
+            WHERE d.customer_id = ? AND d.updated_at IS ?
+            ON CONFLICT (customer_id) DO UPDATE SET
+                work_benefit = excluded.work_benefit,
+                birth_benefit = excluded.birth_benefit,
+                total_benefit = excluded.total_benefit,
+                benefit_year = excluded.benefit_year,
+                rules_version = excluded.rules_version,
+                details_updated_at = excluded.details_updated_at,
+                computed_at = excluded.computed_at
+        ''', [row[:6] + (now, row[0], row[6]) for row in rows])
+        saved = conn.total_changes - before
+        conn.commit()
+        conn.close()
+        return saved
+    
+    def get_customer_benefits(self, customer_id: int) -> Optional[Dict]:
+        """הזכויות המחושבות של לקוח (מחישוב האצווה האחרון)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT * FROM customer_benefits WHERE customer_id = ?', (customer_id,))
+        benefits = cursor.fetchone()
+        conn.close()
+        return dict(benefits) if benefits else None
+    
+    def count_stale_benefits(self, benefit_year: int, rules_version: str) -> int:
+        """זכויות שמורות שחושבו לשנה אחרת או בגרסת כללים אחרת"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT COUNT(*) FROM customer_benefits
+            WHERE benefit_year != ? OR rules_version IS NOT ?
+        ''', (benefit_year, rules_version))
+        count = cursor.fetchone()[0]
+        conn.close()
+        return count
+    
     # פונקציות שיחות
     def log_call(self, call_params: Dict) -> int:
         """רישום שיחה במאגר נתונים"""
@@ -367,21 +882,34 @@ class DatabaseHandler:
 
     
     # פונקציות קבלות
-    def create_receipt(self, customer_id: int, call_id: str, receipt_data: Dict) -> int:
+    @staticmethod
+    def make_receipt_idempotency_key(call_id: str, customer_id: int, receipt_data: Dict) -> str:
+        """מפתח ייחודי לקבלה לפי מזהה השיחה ונתוני הקבלה"""
+        key_source = json.dumps([
+            call_id,
+            customer_id,
+            receipt_data.get('amount', 0),
+            receipt_data.get('description', '')
+        ], ensure_ascii=False)
+        return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+    
+    def create_receipt(self, customer_id: int, call_id: str, receipt_data: Dict,
+                       idempotency_key: str = None) -> int:
         """יצירת רשומת קבלה"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
         cursor.execute('''
             INSERT INTO receipts 
-            (customer_id, call_id, receipt_data, amount, description)
-            VALUES (?, ?, ?, ?, ?)
+            (customer_id, call_id, receipt_data, amount, description, idempotency_key)
+            VALUES (?, ?, ?, ?, ?, ?)
         ''', (
             customer_id,
             call_id,
             json.dumps(receipt_data, ensure_ascii=False),
             receipt_data.get('amount', 0),
-            receipt_data.get('description', '')
+            receipt_data.get('description', ''),
+            idempotency_key
         ))
         
         receipt_id = cursor.lastrowid
@@ -390,6 +918,54 @@ class DatabaseHandler:
         
         return receipt_id
     
+    def get_or_create_receipt(self, customer_id: int, call_id: str, receipt_data: Dict,
+                              idempotency_key: str, status: str = 'pending') -> Tuple[Dict, bool]:
+        """יצירת קבלה פעם אחת בלבד לכל מפתח - מחזיר (קבלה, האם נוצרה עכשיו)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            INSERT OR IGNORE INTO receipts 
+            (customer_id, call_id, receipt_data, amount, description, idempotency_key, status, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            customer_id,
+            call_id,
+            json.dumps(receipt_data, ensure_ascii=False),
+            receipt_data.get('amount', 0),
+            receipt_data.get('description', ''),
+            idempotency_key,
+            status,
+            datetime.now()  # שעון מקומי, כמו ב-claim_receipt_retry (CURRENT_TIMESTAMP הוא UTC)
+        ))
+        created = cursor.rowcount > 0
+        conn.commit()
+        
+        cursor.execute('SELECT * FROM receipts WHERE idempotency_key = ?', (idempotency_key,))
+        receipt = cursor.fetchone()
+        conn.close()
+        
+        return dict(receipt), created
+    
+    def claim_receipt_retry(self, receipt_id: int, status: str, stale_minutes: int = None) -> bool:
+        """החזרת קבלה למצב pending לצורך טיפול חוזר (רק תהליך אחד יצליח). status הוא הסטטוס
+        שנקרא: failed / unknown, או pending שלא עודכן stale_minutes (הטיפול הקודם קרס באמצע)"""
+        stale_minutes = stale_minutes if stale_minutes is not None else Config.RECEIPT_PENDING_STALE_MINUTES
+        now = datetime.now()
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            UPDATE receipts SET status = 'pending', updated_at = ?
+            WHERE id = ? AND status = ?
+              AND (status IN ('failed', 'unknown') OR (status = 'pending' AND updated_at < ?))
+        ''', (now, receipt_id, status, now - timedelta(minutes=stale_minutes)))
+        claimed = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+        
+        return claimed
+    
     def update_receipt(self, receipt_id: int, **kwargs) -> bool:
         """עדכון פרטי קבלה"""
         if not kwargs:
@@ -424,10 +1000,246 @@ class DatabaseHandler:
         
         return success
     
+    # סיכומי קבלות שנתיים (customer_year_totals, מתעדכן בטריגרים)
+    def get_customer_year_totals(self, customer_id: int, year: int = None) -> Dict[str, Any]:
+        """סה"כ הקבלות של הלקוח בשנה (ברירת מחדל: השנה הנוכחית) - שורה אחת לפי מפתח"""
+        year = year or datetime.now().year
+        conn = self.get_connection()
+        row = conn.execute('''
+            SELECT completed_count, completed_cents, cancelled_count, cancelled_cents
+            FROM customer_year_totals WHERE customer_id = ? AND year = ?
+        ''', (customer_id, year)).fetchone()
+        conn.close()
+        completed_count, completed_cents, cancelled_count, cancelled_cents = row or (0, 0, 0, 0)
+        return {
+            'customer_id': customer_id,
+            'year': year,
+            'receipts': completed_count,
+            'total_amount': completed_cents / 100,
+            'cancelled_receipts': cancelled_count,
+            'cancelled_amount': cancelled_cents / 100
+        }
+    
+    def rebuild_customer_year_totals(self) -> Dict[str, int]:
+        """בנייה מחדש של customer_year_totals מכל הקבלות, בטרנזקציה אחת עם נעילת כתיבה"""
+        conn = self.get_connection()
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('DELETE FROM customer_year_totals')
+        cursor = conn.execute(f'''
+            INSERT INTO customer_year_totals
+                (customer_id, year, completed_count, completed_cents, cancelled_count, cancelled_cents)
+            {_YEAR_TOTALS_FROM_RECEIPTS}
+        ''')
+        rows = cursor.rowcount
+        self._mark_migrated('customer_year_totals', conn)
+        conn.commit()
+        conn.close()
+        logger.info(f"customer_year_totals נבנתה מחדש: {rows} שורות")
+        return {'rows': rows}
+    
+    def verify_customer_year_totals(self, limit: int = 20) -> Dict[str, Any]:
+        """השוואת customer_year_totals לחישוב מחדש מהקבלות. מחזיר מספר אי-התאמות ודוגמאות"""
+        conn = self.get_connection()
+        # שורות שירדו לאפס שקולות לשורה חסרה
+        rows = conn.execute(f'''
+            WITH expected AS ({_YEAR_TOTALS_FROM_RECEIPTS}),
+            stored AS (
+                SELECT customer_id, year, completed_count, completed_cents, cancelled_count, cancelled_cents
+                FROM customer_year_totals
+                WHERE completed_count != 0 OR completed_cents != 0 OR cancelled_count != 0 OR cancelled_cents != 0
+            ),
+            diff AS (
+                SELECT 'expected' AS side, * FROM (SELECT * FROM expected EXCEPT SELECT * FROM stored)
+                UNION ALL
+                SELECT 'stored' AS side, * FROM (SELECT * FROM stored EXCEPT SELECT * FROM expected)
+            )
+            SELECT * FROM diff ORDER BY customer_id, year, side
+        ''').fetchall()
+        checked = conn.execute('SELECT COUNT(*) FROM customer_year_totals').fetchone()[0]
+        conn.close()
+        mismatched = {(row['customer_id'], row['year']) for row in rows}
+        return {'rows': checked, 'mismatches': len(mismatched), 'examples': [dict(row) for row in rows[:limit]]}
+    
+    # פונקציות שליחת קבלות באצווה
+    def start_receipt_batch(self) -> int:
+        """פתיחת מנת שליחה חדשה"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('INSERT INTO receipt_batches (started_at) VALUES (?)', (datetime.now(),))
+        batch_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        
+        return batch_id
+    
+    def claim_queued_receipts(self, batch_id: int, limit: int, stale_minutes: int = 30) -> List[Dict]:
+        """שיוך קבלות ממתינות למנת שליחה. קבלות שנתקעו ב-submitting (מנה שקרסה)
+        נתפסות מחדש. מחזיר את הקבלות שנתפסו"""
+        now = datetime.now()
+        stale_before = now - timedelta(minutes=stale_minutes)
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            UPDATE receipts SET status = 'submitting', batch_id = ?, updated_at = ?
+            WHERE id IN (
+                SELECT id FROM receipts WHERE status = 'queued'
+                UNION ALL
+                SELECT id FROM receipts WHERE status = 'submitting' AND updated_at < ?
+                ORDER BY id
+                LIMIT ?
+            )
+        ''', (batch_id, now, stale_before, limit))
+        conn.commit()
+        
+        cursor.execute('''
+            SELECT r.*, c.phone_number
+            FROM receipts r JOIN customers c ON c.id = r.customer_id
+            WHERE r.batch_id = ? AND r.status = 'submitting'
+            ORDER BY r.id
+        ''', (batch_id,))
+        receipts = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        
+        return receipts
+    
+    def finish_receipt_batch(self, batch_id: int, total: int, succeeded: int, failed: int,
+                             duration_seconds: float) -> bool:
+        """סגירת מנת שליחה ורישום התוצאות"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            UPDATE receipt_batches
+            SET status = 'completed', total = ?, succeeded = ?, failed = ?,
+                duration_seconds = ?, finished_at = ?
+            WHERE id = ?
+        ''', (total, succeeded, failed, duration_seconds, datetime.now(), batch_id))
+        
+        success = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+        
+        return success
+    
+    def get_receipt_batches(self, limit: int = 10) -> List[Dict]:
+        """מנות השליחה האחרונות"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT * FROM receipt_batches ORDER BY id DESC LIMIT ?', (limit,))
+        batches = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        
+        return batches
+    
+    def mark_receipt_notified(self, receipt_id: int) -> bool:
+        """סימון שהלקוח קיבל הודעה על הקבלה"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('UPDATE receipts SET notified_at = ? WHERE id = ?', (datetime.now(), receipt_id))
+        
+        success = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+        
+        return success
+    
+    def get_receipt_by_doc_num(self, customer_id: int, doc_num: str) -> Optional[Dict]:
+        """איתור קבלה של לקוח לפי מספר המסמך ב-iCount"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute(
+            'SELECT * FROM receipts WHERE customer_id = ? AND icount_doc_num = ? ORDER BY id DESC LIMIT 1',
+            (customer_id, doc_num)
+        )
+        receipt = cursor.fetchone()
+        conn.close()
+        
+        return dict(receipt) if receipt else None
+    
+    # פונקציות ביטול קבלות
+    def create_cancellation_request(self, customer_id: int, call_id: str, receipt_num: str,
+                                    receipt_id: int = None, status: str = 'requested') -> Optional[int]:
+        """רישום בקשת ביטול. מחזיר None אם כבר קיימת בקשה פתוחה לאותה קבלה"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            INSERT OR IGNORE INTO receipt_cancellations 
+            (customer_id, call_id, receipt_id, receipt_num, status)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (customer_id, call_id, receipt_id, receipt_num, status))
+        
+        request_id = cursor.lastrowid if cursor.rowcount > 0 else None
+        conn.commit()
+        conn.close()
+        
+        if request_id:
+            logger.info(f"נרשמה בקשת ביטול {request_id}: לקוח {customer_id}, קבלה {receipt_num}")
+        return request_id
+    
+    def claim_cancellation_requests(self, limit: int = 20, stale_minutes: int = 10) -> List[Dict]:
+        """תפיסת בקשות ביטול לטיפול. בקשות שנתקעו ב-processing נתפסות מחדש"""
+        claim_token = uuid.uuid4().hex
+        now = datetime.now()
+        stale_before = now - timedelta(minutes=stale_minutes)
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            UPDATE receipt_cancellations
+            SET status = 'processing', claim_token = ?, claimed_at = ?, attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM receipt_cancellations
+                WHERE status = 'requested' OR (status = 'processing' AND claimed_at < ?)
+                ORDER BY created_at
+                LIMIT ?
+            )
+        ''', (claim_token, now, stale_before, limit))
+        conn.commit()
+        
+        cursor.execute('''
+            SELECT c.*, r.icount_doc_id, r.status AS receipt_status
+            FROM receipt_cancellations c
+            LEFT JOIN receipts r ON r.id = c.receipt_id
+            WHERE c.claim_token = ?
+            ORDER BY c.created_at
+        ''', (claim_token,))
+        claimed = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        
+        return claimed
+    
+    def finish_cancellation_request(self, request_id: int, claim_token: str, status: str, error: str = None) -> bool:
+        """עדכון תוצאת בקשת ביטול - רק אם היא עדיין תפוסה על ידי claim_token
+        (בקשה שנתפסה מחדש אחרי stale_minutes שייכת לעובד האחר)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        processed_at = datetime.now() if status in ('completed', 'failed') else None
+        cursor.execute('''
+            UPDATE receipt_cancellations
+            SET status = ?, last_error = ?, processed_at = ?, claim_token = NULL
+            WHERE id = ? AND claim_token = ?
+        ''', (status, error, processed_at, request_id, claim_token))
+        
+        success = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+        
+        return success
+    
     # פונקציות הודעות
     def save_message(self, customer_id: int, call_id: str, message_file: str = None, 
-                    message_text: str = None, duration: int = None) -> int:
-        """שמירת הודעה"""
+                    message_text: str = None, duration: int = None, recording_source: str = None) -> int:
+        """שמירת הודעה. כשיש קובץ בלי אורך ידוע נרשמת גם קליטת ההקלטה ברקע:
+        הורדה מ-recording_source, או המתנה להעלאה מהמרכזיה כשאין כתובת"""
         conn = self.get_connection()
         cursor = conn.cursor()
         
@@ -438,12 +1250,312 @@ class DatabaseHandler:
         ''', (customer_id, call_id, message_file, message_text, duration))
         
         message_id = cursor.lastrowid
+        if message_file and duration is None:
+            cursor.execute(
+                'INSERT INTO recordings (message_id, source, status) VALUES (?, ?, ?)',
+                (message_id, recording_source, 'pending' if recording_source else 'awaiting_upload')
+            )
         conn.commit()
         conn.close()
         
         logger.info(f"נשמרה הודעה חדשה: ID {message_id}")
         return message_id
     
+    def get_recording(self, message_id: int) -> Optional[Dict]:
+        """מצב קליטת ההקלטה של הודעה"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT * FROM recordings WHERE message_id = ?', (message_id,))
+        recording = cursor.fetchone()
+        conn.close()
+        
+        return dict(recording) if recording else None
+    
+    def claim_pending_recordings(self, limit: int = 10, stale_minutes: int = 10,
+                                 max_attempts: int = None) -> List[Dict]:
+        """תפיסת הקלטות להורדה. הורדות שנתקעו ב-fetching נתפסות מחדש עד max_attempts
+        ניסיונות, ואחר כך נכשלות"""
+        max_attempts = max_attempts or Config.RECORDING_MAX_ATTEMPTS
+        claim_token = uuid.uuid4().hex
+        now = datetime.now()
+        stale_before = now - timedelta(minutes=stale_minutes)
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        # הורדה שתקעה את העובד בכל ניסיון לא נתפסת שוב
+        cursor.execute('''
+            UPDATE recordings
+            SET status = 'failed', last_error = 'ההורדה לא הסתיימה אחרי כל הניסיונות', claim_token = NULL
+            WHERE status = 'fetching' AND source IS NOT NULL AND claimed_at < ? AND attempts >= ?
+        ''', (stale_before, max_attempts))
+        
+        cursor.execute('''
+            UPDATE recordings
+            SET status = 'fetching', claim_token = ?, claimed_at = ?, attempts = attempts + 1
+            WHERE message_id IN (
+                SELECT message_id FROM recordings
+                WHERE status = 'pending'
+                   OR (status = 'fetching' AND source IS NOT NULL AND claimed_at < ? AND attempts < ?)
+                ORDER BY created_at
+                LIMIT ?
+            )
+        ''', (claim_token, now, stale_before, max_attempts, limit))
+        conn.commit()
+        
+        cursor.execute('''
+            SELECT r.*, m.message_file
+            FROM recordings r
+            JOIN messages m ON m.id = r.message_id
+            WHERE r.claim_token = ?
+            ORDER BY r.created_at
+        ''', (claim_token,))
+        claimed = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        
+        return claimed
+    
+    def claim_recording_upload(self, message_id: int, stale_minutes: int = 10) -> Optional[str]:
+        """תפיסת הקלטה לקבלת העלאה מהמרכזיה. מחזיר claim_token, או None אם
+        ההקלטה לא קיימת, כבר נשמרה או בקליטה פעילה אחרת"""
+        claim_token = uuid.uuid4().hex
+        now = datetime.now()
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            UPDATE recordings
+            SET status = 'fetching', claim_token = ?, claimed_at = ?, attempts = attempts + 1
+            WHERE message_id = ?
+              AND (status IN ('pending', 'awaiting_upload', 'failed')
+                   OR (status = 'fetching' AND claimed_at < ?))
+        ''', (claim_token, now, message_id, now - timedelta(minutes=stale_minutes)))
+        
+        claimed = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+        
+        return claim_token if claimed else None
+    
+    def finish_recording(self, message_id: int, claim_token: str, status: str, file_path: str = None,
+                         file_format: str = None, size_bytes: int = None, duration: float = None,
+                         error: str = None) -> bool:
+        """עדכון תוצאת הקליטה. הקלטה שנשמרה מעדכנת את message_duration של ההודעה
+        ונכנסת לתור התמלול באותה טרנזקציה"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            UPDATE recordings
+            SET status = ?, file_path = ?, format = ?, size_bytes = ?, duration_seconds = ?,
+                last_error = ?, stored_at = ?, claim_token = NULL
+            WHERE message_id = ? AND claim_token = ?
+        ''', (status, file_path, file_format, size_bytes, duration, error,
+              datetime.now() if status == 'stored' else None, message_id, claim_token))
+        
+        success = cursor.rowcount > 0
+        if success and status == 'stored' and duration is not None:
+            cursor.execute('UPDATE messages SET message_duration = ? WHERE id = ?',
+                           (int(round(duration)), message_id))
+            cursor.execute('INSERT OR IGNORE INTO transcription_jobs (message_id, audio_seconds) VALUES (?, ?)',
+                           (message_id, duration))
+        conn.commit()
+        conn.close()
+        
+        return success
+    
+    # תיבת ההודעות של הצוות
+    def list_messages(self, status: str = 'new', limit: int = 50,
+                      after: Tuple[str, str, int] = None) -> List[Dict]:
+        """עמוד הודעות בסטטוס הנתון: דחוף קודם, ובכל עדיפות הוותיקה קודם.
+        after - (priority, created_at, id) של ההודעה האחרונה בעמוד הקודם.
+        כל עדיפות נקראת בטווח של idx_messages_inbox, בלי מיון ובלי OFFSET"""
+        first = MESSAGE_PRIORITIES.index(after[0]) if after else 0
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        page = []
+        for priority in MESSAGE_PRIORITIES[first:]:
+            if len(page) >= limit:
+                break
+            position = after[1:] if after and priority == after[0] else ('', 0)
+            cursor.execute('''
+                SELECT m.id, m.customer_id, c.name AS customer_name, c.phone_number, m.call_id,
+                       m.message_text, m.message_duration, m.status, m.priority, m.created_at, m.processed_at,
+                       r.status AS recording_status
+                FROM messages m
+                LEFT JOIN customers c ON c.id = m.customer_id
+                LEFT JOIN recordings r ON r.message_id = m.id
+                WHERE m.status = ? AND m.priority = ? AND (m.created_at, m.id) > (?, ?)
+                ORDER BY m.created_at, m.id
+                LIMIT ?
+            ''', (status, priority, *position, limit - len(page)))
+            page.extend(dict(row) for row in cursor.fetchall())
+        conn.close()
+        
+        return page
+    
+    def transition_messages(self, message_ids: Sequence[int], status: str) -> int:
+        """מעבר מנת הודעות לסטטוס הבא (new -> processed -> archived) בטרנזקציה אחת.
+        הודעות שאינן בסטטוס המקור לא משתנות. processed_at נקבע במעבר הראשון. מחזיר כמה עודכנו"""
+        if status not in MESSAGE_TRANSITIONS:
+            raise ValueError(f'סטטוס יעד לא מוכר: {status}')
+        now = datetime.now()
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.executemany('''
+            UPDATE messages
+            SET status = ?, processed_at = COALESCE(processed_at, ?)
+            WHERE id = ? AND status = ?
+        ''', [(status, now, message_id, MESSAGE_TRANSITIONS[status]) for message_id in set(message_ids)])
+        
+        updated = cursor.rowcount
+        conn.commit()
+        conn.close()
+        
+        logger.info(f"{updated} הודעות עברו ל-{status} (מתוך {len(set(message_ids))})")
+        return updated
+    
+    def get_message_counts(self, status: str = 'new') -> Dict[str, int]:
+        """מספר ההודעות בסטטוס לפי עדיפות, מהמונים (message_counts)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT priority, messages FROM message_counts WHERE status = ?', (status,))
+        counts = {priority: 0 for priority in MESSAGE_PRIORITIES}
+        counts.update({row['priority']: row['messages'] for row in cursor.fetchall() if row['messages']})
+        conn.close()
+        
+        return counts
+    
+    def rebuild_message_counts(self) -> Dict[str, int]:
+        """בנייה מחדש של message_counts מכל ההודעות, בטרנזקציה אחת עם נעילת כתיבה"""
+        conn = self.get_connection()
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('DELETE FROM message_counts')
+        cursor = conn.execute('''
+            INSERT INTO message_counts (status, priority, messages)
+            SELECT COALESCE(status, ''), COALESCE(priority, ''), COUNT(*)
+            FROM messages
+            GROUP BY 1, 2
+        ''')
+        rows = cursor.rowcount
+        self._mark_migrated('message_counts', conn)
+        conn.commit()
+        conn.close()
+        logger.info(f"message_counts נבנתה מחדש: {rows} שורות")
+        return {'rows': rows}
+    
+    # פונקציות תמלול
+    def claim_transcription_jobs(self, limit: int, stale_minutes: int = 30, max_attempts: int = None) -> List[Dict]:
+        """תפיסת הודעות לתמלול לפי messages.priority (דחוף קודם) ואז לפי סדר ההגעה.
+        תמלולים שנתקעו ב-processing נתפסים מחדש עד max_attempts ניסיונות, ואחר כך נכשלים"""
+        max_attempts = max_attempts or Config.TRANSCRIPTION_MAX_ATTEMPTS
+        claim_token = uuid.uuid4().hex
+        now = datetime.now()
+        stale_before = now - timedelta(minutes=stale_minutes)
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        # תמלול שתקע את התהליך בכל ניסיון לא נתפס שוב
+        cursor.execute('''
+            UPDATE transcription_jobs
+            SET status = 'failed', last_error = 'התמלול לא הסתיים אחרי כל הניסיונות', finished_at = ?,
+                claim_token = NULL
+            WHERE status = 'processing' AND claimed_at < ? AND attempts >= ?
+        ''', (now, stale_before, max_attempts))
+        
+        cursor.execute('''
+            UPDATE transcription_jobs
+            SET status = 'processing', claim_token = ?, claimed_at = ?, attempts = attempts + 1
+            WHERE message_id IN (
+                SELECT j.message_id
+                FROM transcription_jobs j
+                JOIN messages m ON m.id = j.message_id
+                WHERE j.status = 'queued' OR (j.status = 'processing' AND j.claimed_at < ? AND j.attempts < ?)
+                ORDER BY CASE m.priority WHEN 'urgent' THEN 0 WHEN 'high' THEN 1 WHEN 'normal' THEN 2 ELSE 3 END,
+                         j.created_at
+                LIMIT ?
+            )
+        ''', (claim_token, now, stale_before, max_attempts, limit))
+        conn.commit()
+        
+        cursor.execute('''
+            SELECT j.*, r.file_path, m.priority
+            FROM transcription_jobs j
+            JOIN messages m ON m.id = j.message_id
+            LEFT JOIN recordings r ON r.message_id = j.message_id
+            WHERE j.claim_token = ?
+            ORDER BY CASE m.priority WHEN 'urgent' THEN 0 WHEN 'high' THEN 1 WHEN 'normal' THEN 2 ELSE 3 END,
+                     j.created_at
+        ''', (claim_token,))
+        claimed = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        
+        return claimed
+    
+    def finish_transcription_jobs(self, results: List[Tuple]) -> int:
+        """עדכון מנת תוצאות בטרנזקציה אחת: סטטוס התמלול, ו-message_text להודעות שתומללו -
+        רק לשורות שעדיין תפוסות ב-claim_token שלהן.
+        כל שורה: (message_id, claim_token, status, text, engine, engine_seconds, last_error)"""
+        now = datetime.now()
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        updated = 0
+        for message_id, claim_token, status, text, engine, engine_seconds, last_error in results:
+            cursor.execute('''
+                UPDATE transcription_jobs
+                SET status = ?, engine = ?, engine_seconds = ?, last_error = ?, finished_at = ?, claim_token = NULL
+                WHERE message_id = ? AND claim_token = ?
+            ''', (status, engine, engine_seconds, last_error, now if status in ('done', 'failed') else None,
+                  message_id, claim_token))
+            if cursor.rowcount != 1:
+                # התמלול נתפס מחדש על ידי עובד אחר - הטקסט שלו קובע
+                continue
+            updated += 1
+            if status == 'done':
+                cursor.execute('UPDATE messages SET message_text = ? WHERE id = ?', (text, message_id))
+        conn.commit()
+        conn.close()
+        
+        return updated
+    
+    def get_transcription_stats(self, since_hours: float = 24) -> Dict[str, Any]:
+        """מצב התור, ותפוקת התמלולים שהסתיימו ב-since_hours האחרונות ביחס לדקות שמע"""
+        since = datetime.now() - timedelta(hours=since_hours)
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT status, COUNT(*) AS jobs FROM transcription_jobs GROUP BY status')
+        stats = {'queued': 0, 'processing': 0, 'done': 0, 'failed': 0}
+        stats.update({row['status']: row['jobs'] for row in cursor.fetchall()})
+        
+        cursor.execute('''
+            SELECT COUNT(*) AS jobs, COALESCE(SUM(audio_seconds), 0) AS audio_seconds,
+                   COALESCE(SUM(engine_seconds), 0) AS engine_seconds
+            FROM transcription_jobs
+            WHERE status = 'done' AND finished_at >= ?
+        ''', (since,))
+        recent = cursor.fetchone()
+        conn.close()
+        
+        audio_minutes = recent['audio_seconds'] / 60
+        stats['recent'] = {
+            'hours': since_hours,
+            'jobs': recent['jobs'],
+            'audio_minutes': round(audio_minutes, 2),
+            'engine_seconds': round(recent['engine_seconds'], 3),
+            'engine_seconds_per_audio_minute': round(recent['engine_seconds'] / audio_minutes, 3) if audio_minutes else None
+        }
+        return stats
+    
     # פונקציות דיווחים
     def request_annual_report(self, customer_id: int, report_year: int = None) -> int:
         """בקשת דיווח שנתי"""
@@ -466,6 +1578,94 @@ class DatabaseHandler:
         logger.info(f"נתבקש דיווח שנתי: לקוח {customer_id}, שנה {report_year}")
         return report_id
     
+    def claim_annual_reports(self, limit: int, stale_minutes: int = 30,
+                             max_attempts: int = None) -> Tuple[str, List[Dict]]:
+        """תפיסת מנת דיווחים להפקה. דיווחים שנתקעו ב-generating או שנכשלו נתפסים מחדש
+        אחרי stale_minutes, עד max_attempts ניסיונות - ודיווח שנתקע בכל הניסיונות נכשל.
+        מחזיר (claim_token, הדיווחים עם שם וטלפון הלקוח וסיכום השנה מ-customer_year_totals)"""
+        max_attempts = max_attempts or Config.ANNUAL_REPORT_MAX_ATTEMPTS
+        claim_token = uuid.uuid4().hex
+        now = datetime.now()
+        stale_before = now - timedelta(minutes=stale_minutes)
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        # דיווח שתקע את העובד בכל ניסיון לא נתפס שוב
+        cursor.execute('''
+            UPDATE annual_reports
+            SET status = 'failed', last_error = 'ההפקה לא הסתיימה אחרי כל הניסיונות', claim_token = NULL
+            WHERE status = 'generating' AND claimed_at < ? AND attempts >= ?
+        ''', (stale_before, max_attempts))
+        
+        cursor.execute('''
+            UPDATE annual_reports
+            SET status = 'generating', claim_token = ?, claimed_at = ?, attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM annual_reports
+                WHERE status = 'requested'
+                   OR (status IN ('generating', 'failed') AND claimed_at < ? AND attempts < ?)
+                ORDER BY requested_at
+                LIMIT ?
+            )
+        ''', (claim_token, now, stale_before, max_attempts, limit))
+        conn.commit()
+        
+        cursor.execute('''
+            SELECT ar.id, ar.customer_id, ar.report_year, c.name, c.phone_number,
+                   COALESCE(t.completed_count, 0) AS completed_count,
+                   COALESCE(t.completed_cents, 0) AS completed_cents,
+                   COALESCE(t.cancelled_count, 0) AS cancelled_count,
+                   COALESCE(t.cancelled_cents, 0) AS cancelled_cents
+            FROM annual_reports ar
+            JOIN customers c ON c.id = ar.customer_id
+            LEFT JOIN customer_year_totals t ON t.customer_id = ar.customer_id AND t.year = ar.report_year
+            WHERE ar.claim_token = ?
+            ORDER BY ar.id
+        ''', (claim_token,))
+        claimed = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        
+        return claim_token, claimed
+    
+    def get_claimed_report_receipt_totals(self, claim_token: str) -> List[Dict]:
+        """פירוט הקבלות של כל הדיווחים שנתפסו, בשאילתה אחת:
+        שורה לכל דיווח, סטטוס קבלה וחודש (report_id, status, month, receipts, amount)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT ar.id AS report_id, r.status,
+                   CAST(strftime('%m', r.created_at) AS INTEGER) AS month,
+                   COUNT(*) AS receipts, COALESCE(SUM(r.amount), 0) AS amount
+            FROM annual_reports ar
+            JOIN receipts r ON r.customer_id = ar.customer_id
+                AND r.created_at >= printf('%04d-01-01', ar.report_year)
+                AND r.created_at < printf('%04d-01-01', ar.report_year + 1)
+            WHERE ar.claim_token = ?
+            GROUP BY ar.id, r.status, month
+        ''', (claim_token,))
+        totals = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return totals
+    
+    def finish_annual_reports(self, claim_token: str, results: List[Tuple]) -> int:
+        """עדכון תוצאות המנה בטרנזקציה אחת.
+        כל שורה: (report_id, status, report_data, report_file, last_error)"""
+        now = datetime.now()
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.executemany('''
+            UPDATE annual_reports
+            SET status = ?, report_data = ?, report_file = ?, last_error = ?, generated_at = ?
+            WHERE id = ? AND claim_token = ?
+        ''', [(status, report_data, report_file, last_error, now if status == 'generated' else None,
+               report_id, claim_token)
+              for report_id, status, report_data, report_file, last_error in results])
+        updated = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return updated
+    
     def close(self):
         """סגירת חיבור (אם נדרש)"""
         pass
@@ -11,6 +11,74 @@ ICOUNT_API_URL=https://api.icount.co.il
 ICOUNT_CID=your_company_id_here
 ICOUNT_USER=your_username_here
 ICOUNT_PASS=your_password_here
+ICOUNT_TIMEOUT_SECONDS=30
+
+# תקציב זמן לבקשות מהמרכזיה
+PBX_REQUEST_BUDGET_SECONDS=4
+PBX_OPERATION_THREADS=16
+HOLD_POLL_SECONDS=5
+PBX_SESSION_IDLE_SECONDS=120
+
+# בקרת כניסה בעומס (לכל worker)
+ADMISSION_MAX_IN_FLIGHT=32
+ADMISSION_ENTRY_SHARE=0.75
+ADMISSION_CALLER_MAX_ENTRIES=5
+ADMISSION_CALLER_WINDOW_SECONDS=60
+
+# בדיקת מוכנות ומפסק iCount
+HEALTH_PROBE_SECONDS=5
+ICOUNT_BREAKER_FAILURES=5
+ICOUNT_BREAKER_RESET_SECONDS=30
+
+# הפקת קבלות (immediate/batched)
+RECEIPT_SUBMISSION_MODE=immediate
+RECEIPT_PENDING_STALE_MINUTES=5
+RECEIPT_BATCH_HOUR=23
+RECEIPT_BATCH_SIZE=500
+RECEIPT_BATCH_PARALLELISM=4
+RECEIPT_BATCH_RATE_PER_SECOND=5
+
+# ביטול קבלות ברקע
+CANCELLATION_WORKER_ENABLED=True
+CANCELLATION_POLL_SECONDS=30
+CANCELLATION_BATCH_SIZE=20
+CANCELLATION_MAX_ATTEMPTS=5
+
+# הפקת דיווחים שנתיים (PROCESSES=0 - לפי מספר המעבדים)
+ANNUAL_REPORT_DIR=./reports
+ANNUAL_REPORT_BATCH_SIZE=500
+ANNUAL_REPORT_PROCESSES=0
+ANNUAL_REPORT_POLL_SECONDS=60
+ANNUAL_REPORT_MAX_ATTEMPTS=3
+
+# קליטת הקלטות הודעות (BASE_URL ריק - המרכזיה מעלה את הקובץ; UPLOAD_TOKEN ריק - העלאה חסומה)
+MAX_RECORDING_MINUTES=3
+RECORDINGS_BASE_URL=
+RECORDINGS_UPLOAD_TOKEN=
+RECORDING_MAX_BYTES=33554432
+RECORDING_CHUNK_BYTES=65536
+RECORDING_FETCH_TIMEOUT=30
+RECORDING_INGEST_ENABLED=True
+RECORDING_POLL_SECONDS=30
+RECORDING_BATCH_SIZE=10
+RECORDING_MAX_ATTEMPTS=5
+
+# תמלול הודעות (ENGINE - stub או module:Class; PROCESSES=0 - לפי מספר המעבדים)
+TRANSCRIPTION_ENGINE=stub
+TRANSCRIPTION_LANGUAGE=he
+TRANSCRIPTION_PROCESSES=0
+TRANSCRIPTION_QUEUE_PER_PROCESS=2
+TRANSCRIPTION_BATCH_SIZE=50
+TRANSCRIPTION_FLUSH_SECONDS=2
+TRANSCRIPTION_POLL_SECONDS=30
+TRANSCRIPTION_MAX_ATTEMPTS=3
+TRANSCRIPTION_STUB_REALTIME_FACTOR=0
+
+# תיבת ההודעות של הצוות (TOKEN ריק - ה-API חסום)
+INBOX_API_TOKEN=
+INBOX_PAGE_SIZE=50
+INBOX_MAX_PAGE_SIZE=200
+INBOX_MAX_TRANSITION=1000
 
 # הגדרות SMS (אופציונלי)
 SMS_API_KEY=your_sms_api_key_here
@@ -18,10 +86,28 @@ SMS_SENDER=MySystem
 
 # נתיבים
 RECORDINGS_PATH=./recordings
+# כללי הזכויות לפי שנת מס (ריק - benefit_rules.json שליד הקוד)
+BENEFIT_RULES_FILE=
 
 # לוגים
 LOG_LEVEL=INFO
 LOG_FILE=pbx_system.log
+LOG_QUEUE_ENABLED=True
+LOG_DUMP_SAMPLE_RATE=0.01
+LOG_DUMP_MAX_PER_SECOND=2
+
+# מעקב שיחות
+TRACING_ENABLED=True
+TRACE_FILE=pbx_traces.jsonl
+TRACE_BATCH_SIZE=100
+TRACE_FLUSH_SECONDS=2
+
+# פרופיילינג לפי דרישה (כותרת X-PBX-Profile או _profile=1 מכתובת מנהל)
+PROFILE_HEADER_TOKEN=
+PROFILE_ADMIN_IPS=127.0.0.1
+PROFILE_SAMPLE_RATE=0
+PROFILE_MAX_PER_MINUTE=10
+PROFILE_DIR=./profiles
 
 # סביבה (development/production)
 FLASK_ENV=development
\ No newline at end of file
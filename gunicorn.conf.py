@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+"""
+הגדרות gunicorn לשרת המרכזיה
+
+    gunicorn -c gunicorn.conf.py cloud_pbx_server:app
+
+preload_app טוען את האפליקציה פעם אחת בתהליך הראשי (הגדרות, מבנה המאגר,
+תפריטים קבועים) וה-workers יורשים אותה ב-fork. חיבורים למאגר, HTTP ל-iCount
+ו-threads רקע נוצרים בכל worker ב-post_worker_init, כך שלא עוברים fork.
+"""
+
+import os
+import time
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5000')}"
+
+# הפניות מהמרכזיה ממתינות בעיקר למאגר ול-iCount - תהליך אחד עם threads.
+# פעולות שחרגו מהתקציב (PendingOperations) ו-current_calls נשמרים בזיכרון התהליך:
+# פניית pleaseWait שמגיעה ל-worker אחר לא מוצאת את הפעולה וחוזרת לתפריט הראשי.
+# WEB_CONCURRENCY > 1 רק מאחורי ניתוב דביק לפי PBXcallId
+workers = int(os.getenv('WEB_CONCURRENCY', 1))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 32))
+
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+# הריגת worker תקוע בלבד: הרבה מעל תקציב הזמן לבקשה (PBX_REQUEST_BUDGET_SECONDS, 4 שניות) -
+# פעולות ארוכות ממשיכות ב-threads ברקע והבקשה עצמה חוזרת בתוך התקציב
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 20
+keepalive = 5
+
+# מחזור workers מדי פעם נגד דליפות זיכרון, לא כולם בבת אחת
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = 500
+
+_spawn_started = {}
+
+
+def pre_fork(server, worker):
+    _spawn_started[worker.age] = time.perf_counter()
+
+
+def post_worker_init(worker):
+    import cloud_pbx_server
+    cloud_pbx_server.init_worker()
+
+    started = _spawn_started.get(worker.age)
+    if started is not None:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        worker.log.info("worker spawn: pid=%s preload=%s ms=%.1f", worker.pid, preload_app, elapsed_ms)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+בדיקות חיות ומוכנות ל-load balancer
+
+    /healthz - התהליך חי ועונה (בלי מאגר ובלי רשת)
+    /readyz  - ה-worker מוכן לקבל שיחות: המאגר ניתן לכתיבה, גרסת המבנה
+               תואמת, טבלת השיחות זמינה, והמפסק של iCount לא פתוח
+
+הבדיקות מול המאגר רצות ב-thread רקע כל HEALTH_PROBE_SECONDS, ו-/readyz
+מחזיר את התוצאה האחרונה מהזיכרון - בדיקה תכופה לא מוסיפה עומס על המאגר.
+תוצאה ישנה מדי (ה-thread תקוע, למשל על נעילה) נחשבת לא מוכנה.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def liveness() -> Dict[str, Any]:
+    return {'status': 'ok', 'pid': os.getpid()}
+
+
+def probe_database(db_path: str, timeout: float = 1.0) -> Dict[str, Any]:
+    """גרסת המבנה, טבלת השיחות, ואפשרות כתיבה (נעילה בלי לכתוב) בחיבור נפרד"""
+    result = {'schema_version': None, 'sessions': False, 'writable': False, 'error': None}
+    try:
+        conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+        try:
+            result['schema_version'] = conn.execute('PRAGMA user_version').fetchone()[0]
+            conn.execute('SELECT 1 FROM calls LIMIT 1').fetchall()
+            result['sessions'] = True
+            # נכשל אם הקובץ נעול לכתיבה (מעבר ל-timeout) או לקריאה בלבד
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('ROLLBACK')
+            result['writable'] = True
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        result['error'] = str(e)
+    return result
+
+
+class HealthMonitor:
+    """בדיקות התלויות של worker אחד ברקע, עם התוצאה האחרונה במטמון"""
+
+    def __init__(self, db_path: str, schema_version: Optional[int], breaker_state: Callable[[], str],
+                 interval: float = 5, probe_timeout: float = 1.0):
+        self.db_path = db_path
+        self.schema_version = schema_version
+        self.breaker_state = breaker_state
+        self.interval = interval
+        self.probe_timeout = probe_timeout
+        self.lock = threading.Lock()
+        self.result = None
+        self.checked_at = None
+        self.thread = None
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, name='health-probe', daemon=True)
+        # תוצאה ראשונה לפני שה-thread מתחיל, כדי ש-/readyz הראשון לא יענה "לא ידוע"
+        self.probe()
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.probe()
+            except Exception as e:
+                logger.error(f"שגיאה בבדיקת מוכנות: {str(e)}")
+
+    def probe(self):
+        db = probe_database(self.db_path, self.probe_timeout)
+        # בלי גרסה צפויה (תחליפי המודולים) - הגרסה מדווחת ולא נבדקת
+        schema_ok = db['schema_version'] is not None and self.schema_version in (None, db['schema_version'])
+        result = {
+            'database': {'ok': db['writable'], 'error': db['error']},
+            'schema': {'ok': schema_ok, 'version': db['schema_version'], 'expected': self.schema_version},
+            'sessions': {'ok': db['sessions']}
+        }
+        with self.lock:
+            self.result = result
+            self.checked_at = time.monotonic()
+
+    def readiness(self) -> Tuple[bool, Dict[str, Any]]:
+        """(מוכן, פירוט) מהמטמון - בלי גישה למאגר"""
+        if self.thread is None:
+            self.start()
+        with self.lock:
+            checks = dict(self.result or {})
+            age = time.monotonic() - self.checked_at if self.checked_at is not None else None
+
+        stale = age is None or age > self.interval * 3
+        checks['probe'] = {'ok': not stale, 'age_seconds': round(age, 1) if age is not None else None}
+        breaker = self.breaker_state()
+        checks['icount'] = {'ok': breaker != 'open', 'breaker': breaker}
+
+        ready = all(check['ok'] for check in checks.values())
+        return ready, {'status': 'ready' if ready else 'not_ready', 'pid': os.getpid(), 'checks': checks}
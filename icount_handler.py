@@ -1,15 +1,85 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import requests
 import json
 import logging
+import threading
+import time
 from datetime import datetime
 from typing import Dict, Any, Optional
 from config import Config
+import metrics
+import tracing
+from benefit_rules import rules_for_year
 
 logger = logging.getLogger(__name__)
 
+ICOUNT_ENDPOINTS = ['login', 'doc/create', 'doc/cancel', 'doc/get', 'logout']
+ICOUNT_REQUEST_SECONDS = metrics.histogram('pbx_icount_request_seconds', 'זמן פנייה ל-iCount לפי נקודת קצה',
+                                           ['endpoint'], [(e,) for e in ICOUNT_ENDPOINTS])
+ICOUNT_ERRORS = metrics.counter('pbx_icount_errors_total', 'פניות ל-iCount שנכשלו (חריגה או קוד HTTP שאינו 200)',
+                                ['endpoint'], [(e,) for e in ICOUNT_ENDPOINTS])
+
+
+class CircuitOpenError(Exception):
+    """iCount לא זמין - הפנייה לא נשלחה כי המפסק פתוח"""
+
+
+class CircuitBreaker:
+    """מפסק לפניות ל-iCount
+    
+    אחרי failure_threshold כישלונות רצופים המפסק נפתח ופניות נדחות מיד, בלי
+    להמתין ל-timeout. אחרי reset_seconds עוברת פנייה אחת לניסיון (half_open):
+    הצלחה סוגרת את המפסק, כישלון פותח אותו שוב.
+    """
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+    
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.trial_running or time.monotonic() - self.opened_at < self.reset_seconds:
+                return False
+            self.trial_running = True
+            return True
+    
+    def record_success(self):
+        with self.lock:
+            if self.opened_at is not None:
+                logger.info("המפסק של iCount נסגר")
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+    
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or (self.opened_at is None and self.failures >= self.failure_threshold):
+                logger.warning(f"המפסק של iCount נפתח אחרי {self.failures} כישלונות רצופים")
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+    
+    @property
+    def state(self) -> str:
+        with self.lock:
+            if self.opened_at is None:
+                return self.CLOSED
+            if self.trial_running or time.monotonic() - self.opened_at >= self.reset_seconds:
+                return self.HALF_OPEN
+            return self.OPEN
+
+
 class ICountHandler:
     """מחלקה לטיפול ב-API של iCount"""
     
@@ -19,18 +89,85 @@ class ICountHandler:
         self.user = Config.ICOUNT_USER  
         self.password = Config.ICOUNT_PASS
         self.session_id = None
+        self._session_lock = threading.Lock()
+        self._http = None
+        self.breaker = CircuitBreaker(getattr(Config, 'ICOUNT_BREAKER_FAILURES', 5),
+                                      getattr(Config, 'ICOUNT_BREAKER_RESET_SECONDS', 30))
+    
+    @property
+    def http(self):
+        """חיבורי HTTP חוזרים ל-iCount (מאגר חיבורים לכל מופע)
+        
+        requests נטען ונוצר רק בפנייה הראשונה ל-iCount ולא בייבוא המודול.
+        """
+        if self._http is None:
+            import requests
+            self._http = requests.Session()
+        return self._http
+    
+    def _post(self, endpoint: str, **kwargs):
+        """POST לנקודת קצה של iCount, עם מדידת זמן ושגיאות ודרך המפסק"""
+        if not self.breaker.allow():
+            raise CircuitOpenError("iCount לא זמין כרגע")
+        started = time.perf_counter()
+        with tracing.span(f'icount {endpoint}', kind='CLIENT') as span:
+            try:
+                response = self.http.post(f"{self.api_url}/api/{endpoint}",
+                                          timeout=getattr(Config, 'ICOUNT_TIMEOUT_SECONDS', 30), **kwargs)
+            except Exception:
+                ICOUNT_ERRORS.labels(endpoint).inc()
+                self.breaker.record_failure()
+                raise
+            finally:
+                ICOUNT_REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+            if span:
+                span.tag(http_status=response.status_code)
+        if response.status_code != 200:
+            ICOUNT_ERRORS.labels(endpoint).inc()
+        # שגיאת שרת נספרת ככישלון; תשובה עסקית (למשל קבלה לא נמצאה) - לא
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+        
+    @staticmethod
+    def _session_expired(response) -> bool:
+        if response.status_code != 200:
+            return False
+        try:
+            return response.json().get('reason') == 'bad_sid'
+        except ValueError:
+            return False
+    
+    def _session_post(self, endpoint: str, payload: Dict[str, Any], body: str = 'data'):
+        """POST עם מזהה החיבור. חיבור שפג (bad_sid) - התחברות מחדש וניסיון חוזר אחד
         
+        iCount דוחה את הבקשה לפני ביצוע הפעולה, ולכן הניסיון החוזר לא יוצר מסמך כפול.
+        כמה threads שקיבלו bad_sid על אותו חיבור (למשל receipt_batcher) מתחברים מחדש פעם אחת.
+        """
+        session_id = self.session_id
+        response = self._post(endpoint, **{body: dict(payload, sid=session_id)})
+        if self._session_expired(response):
+            with self._session_lock:
+                if self.session_id == session_id:
+                    logger.warning(f"החיבור ל-iCount פג ({endpoint}), מתחבר מחדש")
+                    if not self.authenticate():
+                        self.session_id = None
+            if self.session_id:
+                response = self._post(endpoint, **{body: dict(payload, sid=self.session_id)})
+        return response
+    
     def authenticate(self) -> bool:
         """התחברות למערכת iCount"""
         try:
-            auth_url = f"{self.api_url}/api/login"
             auth_data = {
                 'cid': self.cid,
                 'user': self.user,
                 'pass': self.password
             }
             
-            response = requests.post(auth_url, data=auth_data)
+            response = self._post('login', data=auth_data)
             
             if response.status_code == 200:
                 result = response.json()
@@ -49,18 +186,20 @@ class ICountHandler:
             logger.error(f"שגיאה בהתחברות ל-iCount: {str(e)}")
             return False
     
-    def create_receipt(self, receipt_data: Dict[str, Any]) -> Dict[str, Any]:
-        """יצירת קבלה חדשה במערכת iCount"""
+    def create_receipt(self, receipt_data: Dict[str, Any], reference: str = None) -> Dict[str, Any]:
+        """יצירת קבלה חדשה במערכת iCount
+        
+        reference נשלח עם המסמך (ext_ref) כדי שאפשר יהיה לאתר אותו ב-find_receipt.
+        כשלא ידוע אם המסמך נוצר (timeout, ניתוק או שגיאת 5xx אחרי שליחת הבקשה)
+        מוחזר גם unknown=True - אין לשלוח שוב לפני בדיקה ב-find_receipt.
+        """
         
         if not self.session_id and not self.authenticate():
             return {"status": False, "message": "כישלון בהתחברות למערכת"}
         
         try:
-            receipt_url = f"{self.api_url}/api/doc/create"
-            
             # הכנת נתוני הקבלה לפורמט iCount
             icount_data = {
-                'sid': self.session_id,
                 'doctype': 'receipt',  # סוג מסמך - קבלה
                 'lang': 'he',
                 'currency': 'ILS',
@@ -74,8 +213,10 @@ class ICountHandler:
                     'email': receipt_data.get('client_email', '')
                 }
             }
+            if reference:
+                icount_data['ext_ref'] = reference
             
-            response = requests.post(receipt_url, json=icount_data)
+            response = self._session_post('doc/create', icount_data, body='json')
             
             if response.status_code == 200:
                 result = response.json()
@@ -97,16 +238,45 @@ class ICountHandler:
                 logger.error(f"שגיאת HTTP ביצירת קבלה: {response.status_code}")
                 return {
                     "status": False,
+                    # שגיאת שרת יכולה לחזור גם אחרי שהמסמך נשמר
+                    "unknown": response.status_code >= 500,
                     "message": f"שגיאת שרת: {response.status_code}"
                 }
-                
+        
+        except CircuitOpenError as e:
+            # הבקשה לא נשלחה
+            return {"status": False, "message": str(e)}
         except Exception as e:
             logger.error(f"שגיאה ביצירת קבלה: {str(e)}")
             return {
                 "status": False,
+                "unknown": True,
                 "message": f"שגיאה טכנית: {str(e)}"
             }
     
+    def find_receipt(self, reference: str) -> Dict[str, Any]:
+        """איתור קבלה לפי ה-reference שנשלח ב-create_receipt.
+        מחזיר status=True עם found (ו-doc_id/doc_num), או status=False אם הבדיקה עצמה נכשלה"""
+        
+        if not self.session_id and not self.authenticate():
+            return {"status": False, "message": "כישלון בהתחברות למערכת"}
+        
+        try:
+            response = self._session_post('doc/search', {'ext_ref': reference})
+            if response.status_code != 200:
+                return {"status": False, "message": f"שגיאת שרת: {response.status_code}"}
+            result = response.json()
+            if not result.get('status'):
+                return {"status": False, "message": result.get('message', 'שגיאה לא ידועה')}
+            docs = [doc for doc in result.get('results', []) if doc.get('doctype', 'receipt') == 'receipt']
+            if not docs:
+                return {"status": True, "found": False}
+            return {"status": True, "found": True, "doc_id": docs[0].get('doc_id'), "doc_num": docs[0].get('doc_num')}
+        
+        except Exception as e:
+            logger.error(f"שגיאה באיתור קבלה: {str(e)}")
+            return {"status": False, "message": f"שגיאה טכנית: {str(e)}"}
+    
     def cancel_receipt(self, doc_id: str) -> Dict[str, Any]:
         """ביטול קבלה במערכת iCount"""
         
@@ -114,13 +284,11 @@ class ICountHandler:
             return {"status": False, "message": "כישלון בהתחברות למערכת"}
         
         try:
-            cancel_url = f"{self.api_url}/api/doc/cancel"
             cancel_data = {
-                'sid': self.session_id,
                 'doc_id': doc_id
             }
             
-            response = requests.post(cancel_url, data=cancel_data)
+            response = self._session_post('doc/cancel', cancel_data)
             
             if response.status_code == 200:
                 result = response.json()
@@ -157,13 +325,11 @@ class ICountHandler:
             return {"status": False, "message": "כישלון בהתחברות למערכת"}
         
         try:
-            details_url = f"{self.api_url}/api/doc/get"
             details_data = {
-                'sid': self.session_id,
                 'doc_id': doc_id
             }
             
-            response = requests.post(details_url, data=details_data)
+            response = self._session_post('doc/get', details_data)
             
             if response.status_code == 200:
                 result = response.json()
@@ -194,70 +360,53 @@ class ICountHandler:
         """התנתקות מהמערכת"""
         if self.session_id:
             try:
-                logout_url = f"{self.api_url}/api/logout"
                 logout_data = {'sid': self.session_id}
-                requests.post(logout_url, data=logout_data)
+                self._post('logout', data=logout_data)
                 self.session_id = None
                 logger.info("התנתקות מ-iCount הושלמה")
             except Exception as e:
                 logger.error(f"שגיאה בהתנתקות: {str(e)}")
 
 class BenefitsCalculator:
-    """מחלקה לחישוב זכויות"""
+    """מחלקה לחישוב זכויות לפי טבלאות הכללים של שנת המס (ראו benefit_rules.py)"""
     
     @staticmethod
-    def calculate_work_benefit(workplaces_spouse1: int, workplaces_spouse2: int) -> float:
+    def rules_version(tax_year: int = None) -> str:
+        """גרסת הכללים של שנת המס - זכויות שנשמרו בגרסה אחרת אינן תקפות"""
+        return rules_for_year(tax_year).rules_version
+    
+    @staticmethod
+    def calculate_work_benefit(workplaces_spouse1: int, workplaces_spouse2: int, tax_year: int = None) -> float:
         """חישוב מענק עבודה לפי מקומות עבודה"""
-        total_workplaces = workplaces_spouse1 + workplaces_spouse2
-        base_amount = Config.WORK_BENEFIT_BASE
-        
-        # חישוב לפי מספר מקומות עבודה
-        if total_workplaces >= 2:
-            return base_amount * 1.5  # בונוס ל-2+ מקומות עבודה
-        elif total_workplaces == 1:
-            return base_amount
-        else:
-            return 0
+        return rules_for_year(tax_year).work_benefit(workplaces_spouse1 + workplaces_spouse2)
     
     @staticmethod
-    def calculate_birth_benefits(children_birth_years: list) -> float:
-        """חישוב דמי לידה לפי גילאי ילדים"""
+    def calculate_birth_benefits(children_birth_years: list, tax_year: int = None) -> float:
+        """חישוב דמי לידה לפי שנות הלידה של הילדים"""
         if not children_birth_years:
             return 0
         
-        current_year = datetime.now().year
-        total_benefit = 0
-        
-        for birth_year in children_birth_years:
-            try:
-                child_age = current_year - int(birth_year)
-                # דמי לידה מגיעים עד גיל 18
-                if child_age <= 18:
-                    total_benefit += Config.BIRTH_BENEFIT_PER_CHILD
-            except (ValueError, TypeError):
-                continue
-        
-        return total_benefit
+        return rules_for_year(tax_year).birth_benefit(children_birth_years)
     
     @staticmethod
-    def calculate_total_benefits(customer_details: Dict) -> Dict[str, float]:
+    def calculate_total_benefits(customer_details: Dict, tax_year: int = None) -> Dict[str, float]:
         """חישוב כל הזכויות"""
-        work_benefit = BenefitsCalculator.calculate_work_benefit(
-            customer_details.get('spouse1_workplaces', 0),
-            customer_details.get('spouse2_workplaces', 0)
-        )
+        rules = rules_for_year(tax_year)
+        work_benefit = rules.work_benefit(customer_details.get('spouse1_workplaces', 0) +
+                                          customer_details.get('spouse2_workplaces', 0))
         
-        children_years = []
-        if customer_details.get('children_birth_years'):
+        # רשימת שנים (מ-customer_children) או JSON (עמודת children_birth_years)
+        children_years = customer_details.get('children_birth_years') or []
+        if isinstance(children_years, str):
             try:
-                children_years = json.loads(customer_details['children_birth_years'])
+                children_years = json.loads(children_years)
             except:
                 children_years = []
         
-        birth_benefit = BenefitsCalculator.calculate_birth_benefits(children_years)
+        birth_benefit = rules.birth_benefit(children_years) if children_years else 0
         
         return {
             'work_benefit': work_benefit,
             'birth_benefit': birth_benefit,
             'total_benefit': work_benefit + birth_benefit
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+שרת iCount מקומי לבדיקות עומס
+
+מממש את נקודות הקצה ש-ICountHandler משתמש בהן:
+/api/login, /api/doc/create, /api/doc/cancel, /api/doc/get, /api/doc/search, /api/logout
+עם השהיות, שגיאות, תפוגת session והגבלת קצב הניתנים להגדרה.
+
+הפעלה:
+    python icount_mock_server.py --port 5050 --latency-dist lognormal --latency-ms 120 --error-rate 0.01
+ואז:
+    ICOUNT_API_URL=http://127.0.0.1:5050
+"""
+
+import argparse
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from flask import Flask, request, jsonify
+
+logger = logging.getLogger(__name__)
+
+LATENCY_DISTRIBUTIONS = ('none', 'fixed', 'uniform', 'normal', 'lognormal', 'exponential')
+
+
+class MockSettings:
+    """הגדרות התנהגות השרת המדומה
+
+    latency_ms - ערך מרכזי להשהיה (ממוצע, או חציון ב-lognormal)
+    latency_jitter - פיזור: uniform/normal באלפיות שנייה, lognormal כ-sigma
+    error_rate - שיעור תגובות HTTP 500
+    failure_rate - שיעור תגובות 200 עם status=false (כישלון לוגי)
+    hang_rate / hang_seconds - שיעור בקשות שנתקעות זמן רב (לבדיקת timeouts)
+    session_ttl - תוקף session בשניות (0 = ללא תפוגה)
+    rate_limit - מספר בקשות מותר לשנייה (0 = ללא הגבלה), מעבר לכך HTTP 429
+    """
+
+    def __init__(self, latency_dist: str = 'none', latency_ms: float = 0.0,
+                 latency_jitter: float = 0.0, error_rate: float = 0.0,
+                 failure_rate: float = 0.0, hang_rate: float = 0.0,
+                 hang_seconds: float = 30.0, session_ttl: float = 0.0,
+                 rate_limit: float = 0.0, rate_burst: Optional[float] = None,
+                 seed: Optional[int] = None, cid: str = None, user: str = None,
+                 password: str = None):
+        if latency_dist not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"התפלגות השהיה לא מוכרת: {latency_dist}")
+        self.latency_dist = latency_dist
+        self.latency_ms = latency_ms
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.failure_rate = failure_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.session_ttl = session_ttl
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst if rate_burst is not None else max(rate_limit, 1.0)
+        self.seed = seed
+        # אם לא הוגדרו פרטי התחברות - כל פרטים מתקבלים
+        self.cid = cid
+        self.user = user
+        self.password = password
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = dict(self.__dict__)
+        data.pop('password', None)
+        return data
+
+
+class MockICountState:
+    """מצב השרת: sessions, מסמכים, מונים והגבלת קצב"""
+
+    def __init__(self, settings: MockSettings):
+        self.settings = settings
+        self.lock = threading.Lock()
+        self.random = random.Random(settings.seed)
+        self.sessions: Dict[str, float] = {}
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self.next_doc_num = 1000
+        self.stats: Dict[str, int] = {}
+        self.tokens = self.settings.rate_burst
+        self.tokens_updated = time.monotonic()
+
+    def count(self, key: str):
+        with self.lock:
+            self.stats[key] = self.stats.get(key, 0) + 1
+
+    def draw(self) -> float:
+        with self.lock:
+            return self.random.random()
+
+    def sample_latency(self) -> float:
+        """דגימת השהיה בשניות לפי ההתפלגות שהוגדרה"""
+        s = self.settings
+        with self.lock:
+            rnd = self.random
+            if s.latency_dist == 'none':
+                value_ms = 0.0
+            elif s.latency_dist == 'fixed':
+                value_ms = s.latency_ms
+            elif s.latency_dist == 'uniform':
+                value_ms = rnd.uniform(s.latency_ms - s.latency_jitter, s.latency_ms + s.latency_jitter)
+            elif s.latency_dist == 'normal':
+                value_ms = rnd.gauss(s.latency_ms, s.latency_jitter)
+            elif s.latency_dist == 'lognormal':
+                value_ms = rnd.lognormvariate(math.log(max(s.latency_ms, 0.001)), s.latency_jitter)
+            else:  # exponential
+                value_ms = rnd.expovariate(1.0 / s.latency_ms) if s.latency_ms > 0 else 0.0
+        return max(value_ms, 0.0) / 1000.0
+
+    def take_token(self) -> bool:
+        """דלי אסימונים גלובלי להגבלת קצב"""
+        if self.settings.rate_limit <= 0:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            elapsed = now - self.tokens_updated
+            self.tokens = min(self.settings.rate_burst, self.tokens + elapsed * self.settings.rate_limit)
+            self.tokens_updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+    def create_session(self) -> str:
+        sid = uuid.uuid4().hex
+        with self.lock:
+            self.sessions[sid] = time.monotonic()
+        return sid
+
+    def session_valid(self, sid: Optional[str]) -> bool:
+        with self.lock:
+            created = self.sessions.get(sid) if sid else None
+            if created is None:
+                return False
+            if self.settings.session_ttl and time.monotonic() - created > self.settings.session_ttl:
+                del self.sessions[sid]
+                return False
+            return True
+
+    def end_session(self, sid: Optional[str]) -> bool:
+        with self.lock:
+            return self.sessions.pop(sid, None) is not None
+
+    def create_document(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        with self.lock:
+            self.next_doc_num += 1
+            doc = {
+                'doc_id': uuid.uuid4().hex[:16],
+                'doc_num': str(self.next_doc_num),
+                'doctype': payload.get('doctype', 'receipt'),
+                'sum': payload.get('sum', 0),
+                'description': payload.get('description', ''),
+                'client': payload.get('client', {}),
+                'ext_ref': payload.get('ext_ref'),
+                'status': 'open',
+                'created_at': datetime.now().isoformat()
+            }
+            self.documents[doc['doc_id']] = doc
+            return doc
+
+
+def create_mock_app(settings: MockSettings = None) -> Flask:
+    """יצירת אפליקציית Flask של השרת המדומה"""
+    state = MockICountState(settings or MockSettings())
+    app = Flask(__name__)
+    app.config['MOCK_STATE'] = state
+
+    def params() -> Dict[str, Any]:
+        if request.is_json:
+            return request.get_json(silent=True) or {}
+        return request.form.to_dict() or request.args.to_dict()
+
+    def inject(endpoint: str):
+        """הזרקת השהיה ותקלות לפני הטיפול בבקשה. מחזיר תגובה אם יש לקצר"""
+        state.count(f'{endpoint}.requests')
+
+        if not state.take_token():
+            state.count(f'{endpoint}.rate_limited')
+            return jsonify({"status": False, "reason": "rate_limit", "message": "Too many requests"}), 429
+
+        delay = state.sample_latency()
+        if state.settings.hang_rate and state.draw() < state.settings.hang_rate:
+            state.count(f'{endpoint}.hung')
+            delay = state.settings.hang_seconds
+        if delay:
+            time.sleep(delay)
+
+        if state.settings.error_rate and state.draw() < state.settings.error_rate:
+            state.count(f'{endpoint}.http_errors')
+            return jsonify({"status": False, "message": "Internal server error"}), 500
+
+        if state.settings.failure_rate and state.draw() < state.settings.failure_rate:
+            state.count(f'{endpoint}.failures')
+            return jsonify({"status": False, "reason": "mock_failure", "message": "כישלון מדומה"})
+
+        return None
+
+    def require_session(endpoint: str, data: Dict[str, Any]):
+        if not state.session_valid(data.get('sid')):
+            state.count(f'{endpoint}.bad_session')
+            return jsonify({"status": False, "reason": "bad_sid", "message": "Session expired or invalid"})
+        return None
+
+    @app.route('/api/login', methods=['POST'])
+    def login():
+        short = inject('login')
+        if short:
+            return short
+        data = params()
+        s = state.settings
+        if ((s.cid is not None and data.get('cid') != s.cid) or
+                (s.user is not None and data.get('user') != s.user) or
+                (s.password is not None and data.get('pass') != s.password)):
+            state.count('login.denied')
+            return jsonify({"status": False, "message": "Invalid credentials"})
+        sid = state.create_session()
+        return jsonify({"status": True, "sid": sid, "session_id": sid})
+
+    @app.route('/api/doc/create', methods=['POST'])
+    def doc_create():
+        short = inject('doc_create')
+        if short:
+            return short
+        data = params()
+        bad = require_session('doc_create', data)
+        if bad:
+            return bad
+        doc = state.create_document(data)
+        return jsonify({"status": True, "doc_id": doc['doc_id'], "doc_num": doc['doc_num']})
+
+    @app.route('/api/doc/cancel', methods=['POST'])
+    def doc_cancel():
+        short = inject('doc_cancel')
+        if short:
+            return short
+        data = params()
+        bad = require_session('doc_cancel', data)
+        if bad:
+            return bad
+        with state.lock:
+            doc = state.documents.get(data.get('doc_id'))
+            if not doc:
+                return jsonify({"status": False, "message": "Document not found"})
+            if doc['status'] == 'cancelled':
+                return jsonify({"status": False, "message": "Document already cancelled"})
+            doc['status'] = 'cancelled'
+        return jsonify({"status": True})
+
+    @app.route('/api/doc/get', methods=['POST'])
+    def doc_get():
+        short = inject('doc_get')
+        if short:
+            return short
+        data = params()
+        bad = require_session('doc_get', data)
+        if bad:
+            return bad
+        with state.lock:
+            doc = state.documents.get(data.get('doc_id'))
+            doc = dict(doc) if doc else None
+        if not doc:
+            return jsonify({"status": False, "message": "Document not found"})
+        return jsonify({"status": True, "data": doc})
+
+    @app.route('/api/doc/search', methods=['POST'])
+    def doc_search():
+        short = inject('doc_search')
+        if short:
+            return short
+        data = params()
+        bad = require_session('doc_search', data)
+        if bad:
+            return bad
+        ext_ref = data.get('ext_ref')
+        with state.lock:
+            results = [dict(doc) for doc in state.documents.values() if ext_ref and doc.get('ext_ref') == ext_ref]
+        return jsonify({"status": True, "results": results})
+
+    @app.route('/api/logout', methods=['POST'])
+    def logout():
+        short = inject('logout')
+        if short:
+            return short
+        state.end_session(params().get('sid'))
+        return jsonify({"status": True})
+
+    @app.route('/_mock/stats', methods=['GET'])
+    def mock_stats():
+        with state.lock:
+            return jsonify({
+                "settings": state.settings.to_dict(),
+                "stats": dict(state.stats),
+                "sessions": len(state.sessions),
+                "documents": len(state.documents)
+            })
+
+    @app.route('/_mock/reset', methods=['POST'])
+    def mock_reset():
+        with state.lock:
+            state.stats.clear()
+            state.sessions.clear()
+            state.documents.clear()
+            state.random = random.Random(state.settings.seed)
+        return jsonify({"status": True})
+
+    return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='שרת iCount מדומה לבדיקות עומס')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--latency-dist', choices=LATENCY_DISTRIBUTIONS, default='none')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--latency-jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    parser.add_argument('--hang-rate', type=float, default=0.0)
+    parser.add_argument('--hang-seconds', type=float, default=30.0)
+    parser.add_argument('--session-ttl', type=float, default=0.0)
+    parser.add_argument('--rate-limit', type=float, default=0.0)
+    parser.add_argument('--rate-burst', type=float, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--cid', default=None)
+    parser.add_argument('--user', default=None)
+    parser.add_argument('--password', default=None)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    mock_settings = MockSettings(
+        latency_dist=args.latency_dist,
+        latency_ms=args.latency_ms,
+        latency_jitter=args.latency_jitter,
+        error_rate=args.error_rate,
+        failure_rate=args.failure_rate,
+        hang_rate=args.hang_rate,
+        hang_seconds=args.hang_seconds,
+        session_ttl=args.session_ttl,
+        rate_limit=args.rate_limit,
+        rate_burst=args.rate_burst,
+        seed=args.seed,
+        cid=args.cid,
+        user=args.user,
+        password=args.password
+    )
+    create_mock_app(mock_settings).run(host=args.host, port=args.port, threaded=True)
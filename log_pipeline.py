@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+לוגים שלא חוסמים את הבקשה
+
+thread הבקשה רק מכניס את הרשומה לתור (QueueHandler); thread נפרד
+(QueueListener) כותב לקובץ ולמסך. אחרי fork (worker של gunicorn) התור
+וה-listener נוצרים מחדש בתהליך הילד.
+
+בנוסף: שורות מובנות (אירוע + key=value בשורה אחת) ודגימה של רישום מלא
+של בקשות, עם תקרה לשנייה.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_state = {
+    'configured': False,
+    'handler': None,
+    'listener': None
+}
+
+
+def configure_logging(config):
+    """הגדרת לוגים (פעם אחת לתהליך)"""
+    if _state['configured']:
+        return
+    _state['configured'] = True
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [
+        logging.FileHandler(config.LOG_FILE, encoding='utf-8'),
+        logging.StreamHandler()
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, config.LOG_LEVEL))
+
+    if not getattr(config, 'LOG_QUEUE_ENABLED', False):
+        for handler in handlers:
+            root.addHandler(handler)
+        return
+
+    queue_handler = QueueHandler(queue.SimpleQueue())
+    root.addHandler(queue_handler)
+    _state['handler'] = queue_handler
+    _start_listener(handlers)
+
+    atexit.register(stop_logging)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def _start_listener(handlers):
+    listener = QueueListener(_state['handler'].queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _state['listener'] = listener
+
+
+def _restart_after_fork():
+    # ה-thread של ה-listener לא עובר ב-fork - תור ו-listener חדשים לתהליך הילד
+    listener = _state['listener']
+    if not listener:
+        return
+    _state['handler'].queue = queue.SimpleQueue()
+    _start_listener(listener.handlers)
+
+
+def stop_logging():
+    """ריקון התור וכתיבת כל הרשומות שנותרו"""
+    listener = _state['listener']
+    if listener and listener._thread:
+        listener.stop()
+
+
+def structured(event: str, **fields) -> str:
+    """שורת לוג אחת: שם האירוע ואחריו key=value (ערכים עם רווחים במרכאות)"""
+    parts = [event]
+    for key, value in fields.items():
+        if value is None:
+            continue
+        if not isinstance(value, str):
+            value = json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str)
+        elif not value or ' ' in value or '=' in value or '"' in value:
+            value = json.dumps(value, ensure_ascii=False)
+        parts.append(f"{key}={value}")
+    return ' '.join(parts)
+
+
+class DumpSampler:
+    """דגימת בקשות לרישום מלא: שיעור דגימה קבוע ותקרת רישומים לשנייה"""
+
+    def __init__(self, sample_rate: float, max_per_second: float):
+        self.sample_rate = sample_rate
+        self.max_per_second = max_per_second
+        self.tokens = max(max_per_second, 1.0)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return False
+        if self.max_per_second <= 0:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(max(self.max_per_second, 1.0),
+                              self.tokens + (now - self.updated) * self.max_per_second)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+מדדים בפורמט הטקסט של Prometheus (נקודת הקצה /metrics)
+
+כל סדרות התוויות נרשמות מראש, כך שרישום מדידה בזמן הבקשה הוא חיפוש
+במילון והוספה תחת נעילה קצרה - בלי יצירת אובייקטים. תווית לא מוכרת
+נרשמת תחת הסדרה 'other'.
+
+המדדים נשמרים בזיכרון של כל תהליך: עם כמה workers כל worker מחזיר את
+המדדים שלו (pbx_worker_info מציין את ה-pid).
+"""
+
+import abc
+import functools
+import inspect
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+OTHER = 'other'
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class _HistogramSeries:
+    __slots__ = ('buckets', 'counts', 'sum', 'count', 'lock')
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.sum, self.count
+
+
+class _CounterSeries:
+    __slots__ = ('value', 'lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.value += amount
+
+
+class _Family(abc.ABC):
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, label_names: List[str],
+                 label_values: Iterable[Tuple[str, ...]]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = list(label_names)
+        self.series = {}
+        for values in label_values:
+            self.series[tuple(values)] = self._new_series()
+        if label_names:
+            self.series.setdefault((OTHER,) * len(label_names), self._new_series())
+        else:
+            self.series.setdefault((), self._new_series())
+
+    @abc.abstractmethod
+    def _new_series(self):
+        """סדרה חדשה ריקה של המדד"""
+
+    def labels(self, *values):
+        series = self.series.get(values)
+        if series is None:
+            series = self.series[(OTHER,) * len(self.label_names)]
+        return series
+
+
+class Histogram(_Family):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), label_values=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, label_names, label_values)
+
+    def _new_series(self):
+        return _HistogramSeries(self.buckets)
+
+    def add_series(self, *values):
+        """רישום סדרה נוספת (בזמן ההגדרה, לא בזמן הבקשה)"""
+        return self.series.setdefault(values, self._new_series())
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def render(self) -> List[str]:
+        lines = []
+        for values, series in self.series.items():
+            counts, total, count = series.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, values, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.label_names, values, 'le="+Inf"')
+            lines.append(f'{self.name}_bucket{labels} {count}')
+            labels = _format_labels(self.label_names, values)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Counter(_Family):
+    kind = 'counter'
+
+    def _new_series(self):
+        return _CounterSeries()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def render(self) -> List[str]:
+        return [f'{self.name}{_format_labels(self.label_names, values)} {_format_value(series.value)}'
+                for values, series in self.series.items()]
+
+
+class CallbackMetric:
+    """מדד שערכו נקרא בזמן הבקשה ל-/metrics (למשל גודל תור או ספירה קיימת)"""
+
+    def __init__(self, name: str, documentation: str, kind: str, label_names: List[str],
+                 callback: Callable[[], Dict[Tuple[str, ...], float]]):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.label_names = list(label_names)
+        self.callback = callback
+
+    def render(self) -> List[str]:
+        return [f'{self.name}{_format_labels(self.label_names, values)} {_format_value(value)}'
+                for values, value in self.callback().items()]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            # רישום חוזר (למשל טעינה מחדש של מודול) מחזיר את המדד הקיים
+            return self.metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            try:
+                body = metric.render()
+            except Exception:
+                # מדד שנכשל לא מפיל את כל התגובה
+                continue
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(body)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def histogram(name, documentation, label_names=(), label_values=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, label_names, label_values, buckets))
+
+
+def counter(name, documentation, label_names=(), label_values=()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, label_names, label_values))
+
+
+def gauge_callback(name, documentation, label_names, callback) -> CallbackMetric:
+    return REGISTRY.register(CallbackMetric(name, documentation, 'gauge', label_names, callback))
+
+
+def counter_callback(name, documentation, label_names, callback) -> CallbackMetric:
+    return REGISTRY.register(CallbackMetric(name, documentation, 'counter', label_names, callback))
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+def instrument_methods(family: Histogram):
+    """קישוט מחלקה: זמן ריצה של כל מתודה ציבורית נרשם בסדרה בשם המתודה"""
+    def decorate(cls):
+        for name, member in list(vars(cls).items()):
+            if name.startswith('_') or not inspect.isfunction(member):
+                continue
+            setattr(cls, name, _timed(member, family.add_series(name)))
+        return cls
+    return decorate
+
+
+def _timed(func, series: _HistogramSeries):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            series.observe(time.perf_counter() - started)
+    return wrapper
+
+
+class ActivityTracker:
+    """ספירת מפתחות (למשל שיחות) שהיו פעילים ב-idle_seconds האחרונות"""
+
+    def __init__(self, idle_seconds: float):
+        self.idle_seconds = idle_seconds
+        self.last_seen = {}
+        self.lock = threading.Lock()
+        self.last_purge = time.monotonic()
+
+    def touch(self, key):
+        if not key:
+            return
+        now = time.monotonic()
+        with self.lock:
+            self.last_seen[key] = now
+            self._purge(now)
+
+    def count(self) -> int:
+        now = time.monotonic()
+        with self.lock:
+            self._purge(now, force=True)
+            return len(self.last_seen)
+
+    def _purge(self, now: float, force: bool = False):
+        # מפתחות שלא נראו ב-idle_seconds האחרונות - פעם בחלון, גם אם /metrics לא נקרא
+        if not force and now - self.last_purge < self.idle_seconds:
+            return
+        self.last_purge = now
+        cutoff = now - self.idle_seconds
+        for key in [k for k, seen in self.last_seen.items() if seen < cutoff]:
+            del self.last_seen[key]
+
+
+gauge_callback('pbx_worker_info', 'התהליך (worker) שהחזיר את המדדים', ['pid'],
+               lambda: {(str(os.getpid()),): 1})
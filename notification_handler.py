@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import logging
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class SMSNotifier:
+    """מחלקה לשליחת הודעות SMS ללקוחות"""
+    
+    def __init__(self):
+        self.api_key = Config.SMS_API_KEY
+        self.sender = Config.SMS_SENDER
+    
+    def send(self, phone_number: str, text: str) -> bool:
+        """שליחת הודעה. מחזיר True רק אחרי שליחה מאושרת - כל עוד לא חובר ספק SMS
+        ההודעה נרשמת ביומן בלבד ומוחזר False (והקבלה לא מסומנת כ-notified)"""
+        if not phone_number:
+            return False
+        
+        if not self.api_key:
+            logger.info(f"SMS (ללא ספק מוגדר) אל {phone_number}: {text}")
+            return False
+        
+        # כאן יתחבר ספק ה-SMS בפועל לפי SMS_API_KEY / SMS_SENDER
+        logger.warning(f"SMS לא נשלח - ספק SMS עדיין לא חובר (SMS_API_KEY מוגדר). אל {phone_number}: {text}")
+        return False
+    
+    def notify_receipt_created(self, phone_number: str, doc_num: str, amount) -> bool:
+        """הודעה ללקוח על קבלה שהופקה"""
+        return self.send(phone_number, f"הקבלה שלך על סך {amount} ש\"ח הופקה. מספר קבלה: {doc_num}")
+    
+    def notify_receipt_failed(self, phone_number: str, amount) -> bool:
+        """הודעה ללקוח על קבלה שלא הופקה"""
+        return self.send(phone_number, f"לא הצלחנו להפיק את הקבלה על סך {amount} ש\"ח. נציג יחזור אליך.")
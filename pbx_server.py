@@ -5,7 +5,9 @@
 from flask import Flask, request, jsonify
 import json
 import logging
+import os
 import sqlite3
+import threading
 from datetime import datetime, timedelta
 from typing import Dict, Any, Optional
 
@@ -153,8 +155,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-
 # ----------------------
 # Handlers כלליים (מחוץ למחלקה)
 # ----------------------
@@ -287,7 +287,7 @@ def handle_annual_report() -> Dict:
         "enabledKeys": "1,0",
         "setMusic": "no",
         "files": [{
-            "text": "הדיווח השנתי שלך יישלח אליך בהודעת SMS תוך 24 שעות. לחץ 1 לאישור או 0 לביטול.",
+            "text": "הדיווח השנתי שלך יופק תוך 24 שעות. לחץ 1 לאישור או 0 לביטול.",
             "activatedKeys": "1,0"
         }]
     }
@@ -735,7 +735,7 @@ class PBXHandler:
                 "times": 1,
                 "timeout": 10,
                 "enabledKeys": "0",
-                "files": [{"text": "בקשת הדיווח התקבלה. הדיווח יישלח אליך בהודעת SMS תוך 24 שעות. לחץ 0 לחזרה לתפריט הראשי.", "activatedKeys": "0"}]
+                "files": [{"text": "בקשת הדיווח התקבלה. הדיווח יופק תוך 24 שעות. לחץ 0 לחזרה לתפריט הראשי.", "activatedKeys": "0"}]
             }
         return show_main_menu()
 
@@ -749,13 +749,33 @@ class PBXHandler:
             "files": [{"text": "אירעה שגיאה במערכת. לחץ 0 לחזרה לתפריט הראשי.", "activatedKeys": "0"}]
         }
 
-pbx_handler = PBXHandler()
+# ה-handler (חיבור למאגר, iCount, שיחות פעילות) נוצר בפנייה הראשונה בכל תהליך ולא בייבוא
+_handler_state = {'pid': None, 'handler': None}
+_handler_lock = threading.Lock()
+
+
+def get_pbx_handler() -> PBXHandler:
+    pid = os.getpid()
+    if _handler_state['pid'] == pid:
+        return _handler_state['handler']
+    
+    with _handler_lock:
+        if _handler_state['pid'] != pid:
+            _handler_state.update(handler=PBXHandler(), pid=pid)
+    return _handler_state['handler']
+
+
+def create_app() -> Flask:
+    """יצירת אפליקציית השרת"""
+    app = Flask(__name__)
+    app.add_url_rule('/pbx', 'handle_pbx_request', handle_pbx_request, methods=['GET'])
+    app.add_url_rule('/pbx/menu/<menu_name>', 'handle_menu_choice', handle_menu_choice, methods=['GET'])
+    return app
 
 # ----------------------
 # ראוטים
 # ----------------------
 
-@app.route('/pbx', methods=['GET'])
 def handle_pbx_request():
     """כניסת PBX – מזהה שיחה, בודק מנוי ומחזיר תפריט"""
     try:
@@ -774,6 +794,7 @@ def handle_pbx_request():
             if not k.startswith('PBX'):
                 call_params[k] = v
         logger.info("קיבלנו פנייה: %s", call_params)
+        pbx_handler = get_pbx_handler()
 
         # לוג שיחה + שמירה בזיכרון
         pbx_handler.log_call(call_params)
@@ -836,9 +857,9 @@ def handle_pbx_request():
         logger.exception("שגיאה בטיפול בבקשה")
         return jsonify({"error": "שגיאה בטיפול בבקשה"}), 500
 
-@app.route('/pbx/menu/<menu_name>', methods=['GET'])
 def handle_menu_choice(menu_name):
     try:
+        pbx_handler = get_pbx_handler()
         call_id = request.args.get('PBXcallId') or ""
         if call_id:
             core_keys = ['PBXphone','PBXnum','PBXdid','PBXcallType','PBXcallStatus','PBXextensionId','PBXextensionPath']
@@ -874,6 +895,16 @@ def handle_menu_choice(menu_name):
         logger.exception("שגיאה בטיפול בבחירה")
         return jsonify({"error": "שגיאה בטיפול בבחירה"}), 500
 
+
+def __getattr__(name):
+    # אפליקציה ברירת מחדל - עבור gunicorn pbx_server:app. נוצרת בגישה הראשונה ולא בייבוא המודול
+    if name == 'app':
+        app = create_app()
+        globals()['app'] = app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == '__main__':
     # # דוגמאות לנתוני לקוח – ריצה מקומית בלבד
     # try:
@@ -891,4 +922,4 @@ if __name__ == '__main__':
     # except Exception:
     #     logger.info("דילגנו על הזנת נתוני דוגמה")
 
-    app.run(host=getattr(Config, 'HOST', '0.0.0.0'), port=getattr(Config, 'PORT', 5000), debug=getattr(Config, 'DEBUG', True))
+    create_app().run(host=getattr(Config, 'HOST', '0.0.0.0'), port=getattr(Config, 'PORT', 5000), debug=getattr(Config, 'DEBUG', True))
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+שליחת קבלות ל-iCount באצווה
+
+לקוחות במצב batched מקבלים קבלה בסטטוס queued בזמן השיחה. העובד שולח את
+הקבלות ל-iCount במנות גדולות מחוץ לשעות העומס, במקביליות מוגבלת ובהגבלת קצב.
+ההודעה ללקוח עוברת דרך SMSNotifier, שעדיין לא מחובר לספק - notified_at נשאר ריק.
+
+    python receipt_batcher.py run        # מנה אחת עכשיו (למשל מ-cron)
+    python receipt_batcher.py schedule   # ריצה יומית בשעה RECEIPT_BATCH_HOUR
+    python receipt_batcher.py report     # משך ושיעור כישלונות של המנות האחרונות
+"""
+
+import argparse
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Any
+
+from config import Config
+from database_handler import DatabaseHandler
+from icount_handler import ICountHandler
+from notification_handler import SMSNotifier
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """הגבלת קצב בשיטת דלי אסימונים (חוסם עד שמתפנה אסימון)"""
+
+    def __init__(self, rate_per_second: float, burst: float = None):
+        self.rate = rate_per_second
+        self.capacity = burst if burst is not None else max(rate_per_second, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class ReceiptBatcher:
+    """שליחת קבלות ממתינות ל-iCount במנות"""
+
+    def __init__(self, db: DatabaseHandler = None, icount: ICountHandler = None,
+                 notifier: SMSNotifier = None, batch_size: int = None,
+                 parallelism: int = None, rate_per_second: float = None):
+        self.db = db or DatabaseHandler()
+        self.icount = icount or ICountHandler()
+        self.notifier = notifier or SMSNotifier()
+        self.batch_size = batch_size or Config.RECEIPT_BATCH_SIZE
+        self.parallelism = parallelism or Config.RECEIPT_BATCH_PARALLELISM
+        self.rate_limiter = RateLimiter(
+            rate_per_second if rate_per_second is not None else Config.RECEIPT_BATCH_RATE_PER_SECOND
+        )
+
+    def submit_receipt(self, receipt: Dict[str, Any]) -> bool:
+        """שליחת קבלה אחת ל-iCount ועדכון המאגר"""
+        receipt_data = json.loads(receipt['receipt_data'])
+        self.rate_limiter.acquire()
+        icount_result = self.icount.create_receipt(receipt_data, reference=receipt.get('idempotency_key'))
+
+        if icount_result.get('status'):
+            self.db.update_receipt(
+                receipt['id'],
+                icount_doc_id=icount_result.get('doc_id'),
+                icount_doc_num=icount_result.get('doc_num'),
+                icount_response=json.dumps(icount_result, ensure_ascii=False),
+                status='completed'
+            )
+            if self.notifier.notify_receipt_created(receipt['phone_number'], icount_result.get('doc_num'),
+                                                    receipt['amount']):
+                self.db.mark_receipt_notified(receipt['id'])
+            return True
+
+        self.db.update_receipt(
+            receipt['id'],
+            icount_response=json.dumps(icount_result, ensure_ascii=False),
+            status='failed'
+        )
+        if self.notifier.notify_receipt_failed(receipt['phone_number'], receipt['amount']):
+            self.db.mark_receipt_notified(receipt['id'])
+        return False
+
+    def _submit_safely(self, receipt: Dict[str, Any]) -> bool:
+        try:
+            return self.submit_receipt(receipt)
+        except Exception as e:
+            logger.error(f"שגיאה בשליחת קבלה {receipt['id']}: {str(e)}", exc_info=True)
+            self.db.update_receipt(receipt['id'], status='failed',
+                                   icount_response=json.dumps({'status': False, 'message': str(e)},
+                                                              ensure_ascii=False))
+            return False
+
+    def run_batch(self) -> Dict[str, Any]:
+        """שליחת כל הקבלות הממתינות. מחזיר סיכום המנה"""
+        batch_id = self.db.start_receipt_batch()
+        started = time.monotonic()
+        succeeded = failed = 0
+
+        # התחברות אחת לפני השליחה המקבילית
+        if not self.icount.session_id:
+            self.icount.authenticate()
+
+        with ThreadPoolExecutor(max_workers=self.parallelism) as pool:
+            while True:
+                receipts = self.db.claim_queued_receipts(batch_id, self.batch_size)
+                if not receipts:
+                    break
+                for ok in pool.map(self._submit_safely, receipts):
+                    if ok:
+                        succeeded += 1
+                    else:
+                        failed += 1
+
+        duration = time.monotonic() - started
+        total = succeeded + failed
+        self.db.finish_receipt_batch(batch_id, total, succeeded, failed, duration)
+
+        summary = {
+            'batch_id': batch_id,
+            'total': total,
+            'succeeded': succeeded,
+            'failed': failed,
+            'duration_seconds': round(duration, 3),
+            'failure_rate': round(failed / total, 4) if total else 0.0,
+            'receipts_per_second': round(total / duration, 2) if duration else 0.0
+        }
+        logger.info(f"מנת קבלות הסתיימה: {summary}")
+        return summary
+
+    def run_scheduled(self, hour: int = None):
+        """ריצה יומית בשעה קבועה (מחוץ לשעות העומס)"""
+        hour = Config.RECEIPT_BATCH_HOUR if hour is None else hour
+        while True:
+            now = datetime.now()
+            next_run = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+            if next_run <= now:
+                next_run += timedelta(days=1)
+            logger.info(f"המנה הבאה תישלח ב-{next_run}")
+            time.sleep((next_run - now).total_seconds())
+            try:
+                self.run_batch()
+            except Exception as e:
+                logger.error(f"שגיאה בשליחת מנת קבלות: {str(e)}", exc_info=True)
+
+
+def batch_report(db: DatabaseHandler, limit: int = 10) -> Dict[str, Any]:
+    """דוח משך ושיעור כישלונות של המנות האחרונות"""
+    batches = [b for b in db.get_receipt_batches(limit) if b['status'] == 'completed']
+    total = sum(b['total'] for b in batches)
+    failed = sum(b['failed'] for b in batches)
+    durations = [b['duration_seconds'] or 0 for b in batches]
+    return {
+        'batches': batches,
+        'total_receipts': total,
+        'failure_rate': round(failed / total, 4) if total else 0.0,
+        'avg_duration_seconds': round(sum(durations) / len(durations), 3) if durations else 0.0,
+        'max_duration_seconds': round(max(durations), 3) if durations else 0.0
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='שליחת קבלות ל-iCount באצווה')
+    parser.add_argument('command', choices=['run', 'schedule', 'report'])
+    parser.add_argument('--limit', type=int, default=10, help='מספר מנות בדוח')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=getattr(logging, Config.LOG_LEVEL),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    if args.command == 'run':
+        print(json.dumps(ReceiptBatcher().run_batch(), ensure_ascii=False, indent=2))
+    elif args.command == 'schedule':
+        ReceiptBatcher().run_scheduled()
+    else:
+        print(json.dumps(batch_report(DatabaseHandler(), args.limit), ensure_ascii=False, indent=2, default=str))
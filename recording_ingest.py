@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+קליטת הקלטות ההודעות ברקע
+
+בזמן השיחה נשמרת רק ההודעה ושורה ב-recordings. הקובץ נקלט ל-RECORDINGS_PATH
+מחוץ לבקשה מהמרכזיה, באחת משתי דרכים:
+    - הורדה: העובד מוריד בזרימה את הכתובת שהמרכזיה החזירה (או RECORDINGS_BASE_URL + שם הקובץ)
+    - העלאה: המרכזיה שולחת את הקובץ ל-POST /recordings/<message_id> (כותרת X-Recording-Token)
+
+הקובץ נכתב בחלקים לקובץ זמני. קובץ שגדול מ-RECORDING_MAX_BYTES נדחה לפי
+Content-Length או ברגע שעבר את התקרה, והקלטה ארוכה מ-MAX_RECORDING_MINUTES נדחית
+כבר לפי כותרת הקובץ (audio_header), בלי לחכות לסוף ההורדה. האורך נקרא מהכותרות
+ונשמר ב-message_duration של ההודעה.
+
+    python recording_ingest.py
+"""
+
+import hmac
+import io
+import logging
+import os
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import quote
+
+from audio_header import HEADER_BYTES, probe_duration
+from config import Config
+from database_handler import DatabaseHandler
+
+logger = logging.getLogger(__name__)
+
+# המרכזיה מסיימת הקלטה ב-max בקירוב - מעט מעבר לזה עדיין תקין
+DURATION_GRACE_SECONDS = 5
+
+UPLOAD_TOKEN_HEADER = 'X-Recording-Token'
+
+
+class RecordingRejected(Exception):
+    """ההקלטה נדחתה (גדולה / ארוכה מדי או לא WAV/MP3) - אין טעם לנסות שוב"""
+
+    def __init__(self, message: str, http_status: int = 413):
+        super().__init__(message)
+        self.http_status = http_status
+
+
+def recording_source(message_file: str, base_url: str = None) -> Optional[str]:
+    """כתובת ההורדה של הקלטה לפי מה שהמרכזיה החזירה. None - הקובץ יועלה מהמרכזיה"""
+    if not message_file:
+        return None
+    if message_file.startswith(('http://', 'https://')):
+        return message_file
+    if base_url:
+        return f"{base_url.rstrip('/')}/{quote(message_file.lstrip('/'))}"
+    return None
+
+
+def max_recording_seconds(config=Config) -> float:
+    return config.MAX_RECORDING_MINUTES * 60 + DURATION_GRACE_SECONDS
+
+
+def upload_authorized(config, token: Optional[str]) -> bool:
+    """העלאה מותרת רק עם RECORDINGS_UPLOAD_TOKEN מוגדר וזהה"""
+    expected = getattr(config, 'RECORDINGS_UPLOAD_TOKEN', '')
+    return bool(expected and token and hmac.compare_digest(token.encode('utf-8'), expected.encode('utf-8')))
+
+
+class RecordingWriter:
+    """כתיבת הקלטה אחת לדיסק בחלקים, עם דחייה מוקדמת לפי גודל ואורך"""
+
+    def __init__(self, directory: str, message_id: int, max_bytes: int, max_seconds: float,
+                 expected_size: int = None):
+        if expected_size is not None and expected_size > max_bytes:
+            raise RecordingRejected(f'גודל הקובץ {expected_size} חורג מ-{max_bytes} בתים')
+        self.directory = directory
+        self.message_id = message_id
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.expected_size = expected_size
+        self.size = 0
+        self._header = bytearray()
+        os.makedirs(directory, exist_ok=True)
+        self.tmp_path = os.path.join(directory, f'.{message_id}.{os.getpid()}.{threading.get_ident()}.part')
+        self._file = open(self.tmp_path, 'wb')
+
+    def feed(self, chunk: bytes):
+        if not chunk:
+            return
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise RecordingRejected(f'הקובץ חורג מ-{self.max_bytes} בתים')
+        self._file.write(chunk)
+
+        if self._header is not None:
+            self._header += chunk[:HEADER_BYTES - len(self._header)]
+            if len(self._header) >= HEADER_BYTES:
+                self._check(io.BytesIO(self._header), self.expected_size)
+                self._header = None
+
+    def _check(self, f, total_size: Optional[int]) -> Tuple[str, Optional[float]]:
+        file_format, seconds = probe_duration(f, total_size)
+        if file_format is None:
+            raise RecordingRejected('הקובץ אינו WAV או MP3', http_status=415)
+        if seconds is not None and seconds > self.max_seconds:
+            raise RecordingRejected(f'ההקלטה ארוכה מדי ({seconds:.0f} שניות)')
+        return file_format, seconds
+
+    def finish(self) -> Dict:
+        """סגירת הקובץ, קריאת האורך מהכותרות והעברה לשם הסופי"""
+        self._file.close()
+        with open(self.tmp_path, 'rb') as f:
+            file_format, seconds = self._check(f, self.size)
+        if seconds is None:
+            raise RecordingRejected('לא ניתן לקרוא את אורך ההקלטה מכותרות הקובץ', http_status=415)
+
+        path = os.path.join(self.directory, f'{self.message_id}.{file_format}')
+        os.replace(self.tmp_path, path)
+        return {'file_path': path, 'file_format': file_format, 'size_bytes': self.size, 'duration': seconds}
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+def write_recording(directory: str, message_id: int, chunks: Iterable[bytes], max_bytes: int,
+                    max_seconds: float, expected_size: int = None) -> Dict:
+    """כתיבת הקלטה מלאה מרצף חלקים. מחזיר את פרטי הקובץ, או RecordingRejected"""
+    writer = RecordingWriter(directory, message_id, max_bytes, max_seconds, expected_size)
+    try:
+        for chunk in chunks:
+            writer.feed(chunk)
+        return writer.finish()
+    except BaseException:
+        writer.abort()
+        raise
+
+
+class RecordingUpload:
+    """קבלת הקלטה שהמרכזיה מעלה (POST /recordings/<message_id>) - משותף ל-Flask ול-ASGI
+
+        error = upload.begin()      # (status, body) אם אי אפשר לקבל את הקובץ
+        upload.feed(chunk) ...      # RecordingRejected - להפסיק לקרוא
+        status, body = upload.end(error)
+    """
+
+    def __init__(self, db: DatabaseHandler, message_id: int, expected_size: int = None, config=Config):
+        self.db = db
+        self.message_id = message_id
+        self.expected_size = expected_size
+        self.config = config
+        self.claim_token = None
+        self.writer = None
+
+    def begin(self) -> Optional[Tuple[int, Dict]]:
+        self.claim_token = self.db.claim_recording_upload(self.message_id)
+        if not self.claim_token:
+            if self.db.get_recording(self.message_id) is None:
+                return 404, {'error': 'אין הקלטה ממתינה להודעה זו'}
+            return 409, {'error': 'ההקלטה כבר נשמרה או בקליטה'}
+        try:
+            self.writer = RecordingWriter(self.config.RECORDINGS_PATH, self.message_id,
+                                          self.config.RECORDING_MAX_BYTES, max_recording_seconds(self.config),
+                                          self.expected_size)
+        except Exception as e:
+            return self.end(e)
+        return None
+
+    def feed(self, chunk: bytes):
+        self.writer.feed(chunk)
+
+    def end(self, error: Exception = None) -> Tuple[int, Dict]:
+        info = None
+        if error is None:
+            try:
+                info = self.writer.finish()
+            except Exception as e:
+                error = e
+        if error is not None:
+            if self.writer:
+                self.writer.abort()
+            if isinstance(error, RecordingRejected):
+                self.db.finish_recording(self.message_id, self.claim_token, 'rejected', error=str(error))
+                logger.warning(f"הקלטה של הודעה {self.message_id} נדחתה: {error}")
+                return error.http_status, {'error': str(error)}
+            # אפשר להעלות שוב
+            self.db.finish_recording(self.message_id, self.claim_token, 'awaiting_upload', error=str(error))
+            logger.error(f"שגיאה בקליטת הקלטה של הודעה {self.message_id}: {error}")
+            return 500, {'error': 'שגיאה בשמירת ההקלטה'}
+
+        self.db.finish_recording(self.message_id, self.claim_token, 'stored', **info)
+        return 200, {'message_id': self.message_id, 'format': info['file_format'],
+                     'bytes': info['size_bytes'], 'duration': round(info['duration'], 2)}
+
+    def receive(self, chunks: Iterable[bytes]) -> Tuple[int, Dict]:
+        """קבלת כל הקובץ מרצף חלקים סינכרוני"""
+        response = self.begin()
+        if response:
+            return response
+        try:
+            for chunk in chunks:
+                self.feed(chunk)
+        except Exception as e:
+            return self.end(e)
+        return self.end()
+
+
+class RecordingIngestWorker:
+    """עובד רקע להורדת הקלטות ועדכון אורכן"""
+
+    def __init__(self, db: DatabaseHandler = None, config=Config, poll_seconds: float = None,
+                 batch_size: int = None, max_attempts: int = None):
+        self.db = db or DatabaseHandler()
+        self.config = config
+        self.poll_seconds = poll_seconds if poll_seconds is not None else config.RECORDING_POLL_SECONDS
+        self.batch_size = batch_size or config.RECORDING_BATCH_SIZE
+        self.max_attempts = max_attempts or config.RECORDING_MAX_ATTEMPTS
+        self._http = None
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+        self._thread = None
+
+    def _session(self):
+        if self._http is None:
+            import requests
+            self._http = requests.Session()
+        return self._http
+
+    def run_once(self) -> Dict[str, int]:
+        """טיפול במנה אחת של הקלטות. מחזיר ספירת תוצאות"""
+        results = {'stored': 0, 'rejected': 0, 'failed': 0, 'retry': 0}
+
+        for recording in self.db.claim_pending_recordings(self.batch_size, max_attempts=self.max_attempts):
+            outcome = self.process_recording(recording)
+            results[outcome] += 1
+
+        if any(results.values()):
+            logger.info(f"סבב קליטת הקלטות הסתיים: {results}")
+        return results
+
+    def fetch(self, recording: Dict) -> Dict:
+        """הורדת ההקלטה בזרימה ל-RECORDINGS_PATH"""
+        response = self._session().get(recording['source'], stream=True, timeout=self.config.RECORDING_FETCH_TIMEOUT)
+        with response:
+            response.raise_for_status()
+            # אחרי פענוח gzip הגודל שונה מ-Content-Length
+            length = response.headers.get('Content-Length', '')
+            expected_size = int(length) if length.isdigit() and not response.headers.get('Content-Encoding') else None
+            return write_recording(self.config.RECORDINGS_PATH, recording['message_id'],
+                                   response.iter_content(self.config.RECORDING_CHUNK_BYTES),
+                                   self.config.RECORDING_MAX_BYTES, max_recording_seconds(self.config),
+                                   expected_size)
+
+    def process_recording(self, recording: Dict) -> str:
+        """קליטת הקלטה אחת"""
+        message_id = recording['message_id']
+        claim_token = recording['claim_token']
+
+        try:
+            info = self.fetch(recording)
+        except RecordingRejected as e:
+            self.db.finish_recording(message_id, claim_token, 'rejected', error=str(e))
+            logger.warning(f"הקלטה של הודעה {message_id} נדחתה: {e}")
+            return 'rejected'
+        except Exception as e:
+            error = str(e)
+            if recording.get('attempts', 0) >= self.max_attempts:
+                self.db.finish_recording(message_id, claim_token, 'failed', error=error)
+                logger.error(f"הורדת הקלטה של הודעה {message_id} נכשלה סופית: {error}")
+                return 'failed'
+            # החזרה לתור לניסיון נוסף בסבב הבא
+            self.db.finish_recording(message_id, claim_token, 'pending', error=error)
+            logger.warning(f"הורדת הקלטה של הודעה {message_id} נכשלה, ינוסה שוב: {error}")
+            return 'retry'
+
+        self.db.finish_recording(message_id, claim_token, 'stored', **info)
+        return 'stored'
+
+    def notify(self):
+        """העירה מיידית של העובד (למשל אחרי שמירת הודעה חדשה)"""
+        self._wake_event.set()
+
+    def run_forever(self):
+        """לולאת העובד - רצה עד stop()"""
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"שגיאה בעובד קליטת ההקלטות: {str(e)}", exc_info=True)
+            self._wake_event.wait(self.poll_seconds)
+            self._wake_event.clear()
+
+    def start(self):
+        """הפעלת העובד ב-thread רקע"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run_forever, name='recording-ingest-worker', daemon=True)
+        self._thread.start()
+        logger.info("עובד קליטת ההקלטות הופעל")
+
+    def stop(self, timeout: float = 5):
+        """עצירת העובד"""
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread:
+            self._thread.join(timeout)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=getattr(logging, Config.LOG_LEVEL),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    worker = RecordingIngestWorker()
+    worker.run_forever()
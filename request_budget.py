@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+תקציב זמן לבקשות מהמרכזיה
+
+למרכזיה יש timeout משלה. פעולה שלא מסתיימת בתוך התקציב ממשיכה לרוץ ברקע,
+המתקשר מקבל תפריט המתנה, ובפנייה הבאה עם אותו PBXcallId נאספת התוצאה.
+"""
+
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class RequestBudget:
+    """תקציב זמן של בקשה בודדת"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.started = time.monotonic()
+        self.deadline = self.started + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+
+class OperationInProgress(Exception):
+    """פנייה לצומת אחר בזמן שפעולה של אותה שיחה עדיין רצה - הקלט החדש לא בוצע"""
+
+    def __init__(self, call_id: str, node: str, running_node: str):
+        super().__init__(f"שיחה {call_id}: פעולה {running_node} עדיין רצה, הקלט ל-{node} נדחה")
+        self.call_id = call_id
+        self.node = node
+        self.running_node = running_node
+
+
+class PendingOperations:
+    """הרצת פעולות בתוך תקציב זמן, עם שמירת פעולות שחרגו לפי מזהה שיחה"""
+
+    def __init__(self, max_workers: int = 16, result_ttl: float = 300):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pbx-op')
+        self.result_ttl = result_ttl
+        self.lock = threading.Lock()
+        self.pending: Dict[str, Dict[str, Any]] = {}
+        self.overruns: Dict[str, int] = {}
+
+    def start(self, call_id: str, node: str, func: Callable[[], Any]) -> Dict[str, Any]:
+        """הפעלת פעולה ברקע, או הצטרפות לפעולה של אותו צומת שעדיין רצה עבור אותה שיחה.
+        OperationInProgress אם רצה פעולה של צומת אחר"""
+        self._purge()
+
+        with self.lock:
+            entry = self.pending.get(call_id)
+            if entry and not entry['future'].done():
+                if entry['node'] != node:
+                    # התוצאה של הפעולה הרצה אינה התשובה לקלט החדש
+                    raise OperationInProgress(call_id, node, entry['node'])
+                # בקשה חוזרת בזמן שהפעולה הקודמת עדיין רצה - מחכים לאותה פעולה
+                logger.info(f"שיחה {call_id}: פעולה {entry['node']} עדיין רצה, ממתין לה")
+            else:
+                entry = {
+                    'node': node,
+                    # ההקשר (למשל ה-span הנוכחי) עובר ל-thread שמריץ את הפעולה
+                    'future': self.executor.submit(contextvars.copy_context().run, func),
+                    'created': time.monotonic()
+                }
+                self.pending[call_id] = entry
+        return entry
+
+    def run(self, call_id: str, node: str, func: Callable[[], Any],
+            timeout: float) -> Tuple[bool, Any]:
+        """הרצת פעולה. מחזיר (הסתיימה, תוצאה); אם לא הסתיימה - היא ממשיכה ברקע"""
+        entry = self.start(call_id, node, func)
+        return self._wait(call_id, entry, timeout)
+
+    async def run_async(self, call_id: str, node: str, func: Callable[[], Any],
+                        timeout: float) -> Tuple[bool, Any]:
+        """כמו run, בלי לחסום את לולאת האירועים בזמן ההמתנה"""
+        entry = self.start(call_id, node, func)
+        return await self._wait_async(call_id, entry, timeout)
+
+    def poll(self, call_id: str, timeout: float) -> Tuple[bool, bool, Any]:
+        """בדיקת פעולה ממתינה. מחזיר (נמצאה, הסתיימה, תוצאה)"""
+        with self.lock:
+            entry = self.pending.get(call_id)
+        if not entry:
+            return False, False, None
+        done, result = self._wait(call_id, entry, timeout, count_overrun=False)
+        return True, done, result
+
+    async def poll_async(self, call_id: str, timeout: float) -> Tuple[bool, bool, Any]:
+        """כמו poll, בלי לחסום את לולאת האירועים"""
+        with self.lock:
+            entry = self.pending.get(call_id)
+        if not entry:
+            return False, False, None
+        done, result = await self._wait_async(call_id, entry, timeout, count_overrun=False)
+        return True, done, result
+
+    def has_pending(self, call_id: str) -> bool:
+        with self.lock:
+            return call_id in self.pending
+
+    def _wait(self, call_id: str, entry: Dict[str, Any], timeout: float,
+              count_overrun: bool = True) -> Tuple[bool, Any]:
+        try:
+            result = entry['future'].result(timeout=timeout)
+        except FutureTimeoutError:
+            self._overrun(call_id, entry, count_overrun)
+            return False, None
+        finally:
+            self._release(call_id, entry)
+        return True, result
+
+    async def _wait_async(self, call_id: str, entry: Dict[str, Any], timeout: float,
+                          count_overrun: bool = True) -> Tuple[bool, Any]:
+        try:
+            # shield - ביטול ההמתנה לא מבטל את הפעולה עצמה
+            result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(entry['future'])), timeout)
+        except asyncio.TimeoutError:
+            self._overrun(call_id, entry, count_overrun)
+            return False, None
+        finally:
+            self._release(call_id, entry)
+        return True, result
+
+    def _overrun(self, call_id: str, entry: Dict[str, Any], count_overrun: bool):
+        if count_overrun:
+            with self.lock:
+                self.overruns[entry['node']] = self.overruns.get(entry['node'], 0) + 1
+            logger.warning(f"שיחה {call_id}: {entry['node']} חרג מתקציב הזמן, ממשיך ברקע")
+
+    def _release(self, call_id: str, entry: Dict[str, Any]):
+        # שגיאה בפעולה עוברת הלאה ומסירה את הפעולה מהרשימה
+        if entry['future'].done():
+            with self.lock:
+                if self.pending.get(call_id) is entry:
+                    del self.pending[call_id]
+
+    def _purge(self):
+        """ניקוי פעולות שהסתיימו ואיש לא אסף את תוצאתן"""
+        now = time.monotonic()
+        with self.lock:
+            for call_id in [c for c, e in self.pending.items()
+                            if e['future'].done() and now - e['created'] > self.result_ttl]:
+                del self.pending[call_id]
+
+    def overrun_counts(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.overruns)
+
+    def pending_count(self) -> int:
+        with self.lock:
+            return len(self.pending)
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+פרופיילינג של בקשה בודדת מהמרכזיה (cProfile), לפי דרישה
+
+בקשה נמדדת אם:
+    - נשלחה הכותרת X-PBX-Profile עם הערך של PROFILE_HEADER_TOKEN
+    - נשלח הפרמטר _profile=1 מכתובת שמופיעה ב-PROFILE_ADMIN_IPS
+    - היא נדגמה לפי PROFILE_SAMPLE_RATE
+ובכל מקרה לא יותר מ-PROFILE_MAX_PER_MINUTE פרופילים בדקה לכל worker.
+
+נמדדת רק הפעולה עצמה (מאגר, iCount, בניית התפריט), ב-thread של מאגר הפעולות
+שמריץ אותה. מ-Python 3.12 cProfile נשען על sys.monitoring ורק פרופיילר אחד יכול
+לפעול בתהליך - פרופיל נוסף בזמן שאחר פעיל (בקשה מקבילה) מדולג והפעולה רצה בלעדיו.
+הקובץ נשמר תחת PROFILE_DIR/<PBXcallId>/<זמן>-<צומת>.prof
+
+    python -m pstats profiles/<PBXcallId>/<קובץ>.prof
+"""
+
+import contextlib
+import cProfile
+import logging
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+from log_pipeline import structured
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'X-PBX-Profile'
+QUERY_PARAM = '_profile'
+
+_limit_lock = threading.Lock()
+_recent = []
+
+
+def _safe_name(value: str) -> str:
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', str(value or 'unknown'))[:80]
+
+
+def _within_limit(max_per_minute: int) -> bool:
+    now = time.monotonic()
+    with _limit_lock:
+        while _recent and now - _recent[0] > 60:
+            _recent.pop(0)
+        if len(_recent) >= max_per_minute:
+            return False
+        _recent.append(now)
+        return True
+
+
+def profile_requested(config, header_value: Optional[str], query_value: Optional[str],
+                      client_ip: Optional[str]) -> Optional[str]:
+    """האם למדוד את הבקשה. מחזיר את הסיבה (header / admin / sample) או None"""
+    reason = None
+    token = getattr(config, 'PROFILE_HEADER_TOKEN', '')
+    admin_ips = getattr(config, 'PROFILE_ADMIN_IPS', ())
+    sample_rate = getattr(config, 'PROFILE_SAMPLE_RATE', 0)
+
+    if token and header_value == token:
+        reason = 'header'
+    elif query_value == '1' and client_ip and client_ip in admin_ips:
+        reason = 'admin'
+    elif sample_rate > 0 and random.random() < sample_rate:
+        reason = 'sample'
+
+    if reason and not _within_limit(getattr(config, 'PROFILE_MAX_PER_MINUTE', 10)):
+        logger.warning(f"פרופיל לא נשמר - חריגה מ-PROFILE_MAX_PER_MINUTE (סיבה: {reason})")
+        return None
+    return reason
+
+
+class RequestProfile:
+    """הפרופיל של בקשה אחת (הפעולה, ב-thread שמריץ אותה)"""
+
+    def __init__(self, directory: str, reason: str):
+        self.directory = directory
+        self.reason = reason
+        self.stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        self.call_id = None
+        self.node = None
+
+    def bind(self, call_id: str, node: str):
+        self.call_id = call_id
+        self.node = node
+
+    def wrap(self, operation: Callable) -> Callable:
+        """הרצת הפעולה תחת פרופיילר (ב-thread שמריץ אותה)"""
+        def profiled():
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError as e:
+                # פרופיילר אחר כבר פעיל בתהליך (sys.monitoring ב-3.12 ומעלה)
+                logger.warning(f"פרופיל לא נשמר עבור שיחה {self.call_id}: {str(e)}")
+                return operation()
+            try:
+                return operation()
+            finally:
+                profile.disable()
+                self._save(profile)
+        return profiled
+
+    def _save(self, profile: cProfile.Profile):
+        if not self.call_id:
+            return
+        directory = os.path.join(self.directory, _safe_name(self.call_id))
+        path = os.path.join(directory, f"{self.stamp}-{_safe_name(self.node)}.prof")
+        try:
+            os.makedirs(directory, exist_ok=True)
+            profile.dump_stats(path)
+            logger.info(structured('pbx_profile_saved', call_id=self.call_id, node=self.node,
+                                   reason=self.reason, path=path))
+        except OSError as e:
+            logger.warning(f"שמירת פרופיל נכשלה: {str(e)}")
+
+
+@contextlib.contextmanager
+def profile_request(config, header_value: Optional[str], query_value: Optional[str],
+                    client_ip: Optional[str]):
+    """פרופיל לבקשה אם נדרש (אחרת None). לקרוא ל-bind כשהשיחה והצומת ידועים"""
+    reason = profile_requested(config, header_value, query_value, client_ip)
+    yield RequestProfile(getattr(config, 'PROFILE_DIR', 'profiles'), reason) if reason else None
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+תיבת ההודעות של הצוות - משותף לנתיבים ב-Flask (cloud_pbx_server) וב-ASGI
+
+    GET  /inbox/messages?status=new&limit=50&cursor=...   עמוד הודעות: דחוף קודם, ותיק קודם
+    POST /inbox/messages/transition  {"ids": [...], "status": "processed"}
+    GET  /inbox/unread                                    מספר ההודעות החדשות (מהמונים, בלי סריקה)
+
+העמודים ב-keyset: ה-cursor מקודד את (priority, created_at, id) של ההודעה האחרונה
+בעמוד, כך שכל עמוד הוא קריאת טווח ב-idx_messages_inbox גם עמוק ברשימה.
+הגישה בכותרת X-Inbox-Token עם INBOX_API_TOKEN (ריק - חסום).
+"""
+
+import base64
+import hmac
+import json
+from typing import Any, Dict, Optional, Tuple
+
+from config import Config
+from database_handler import DatabaseHandler, MESSAGE_PRIORITIES, MESSAGE_TRANSITIONS
+
+TOKEN_HEADER = 'X-Inbox-Token'
+MESSAGE_STATUSES = ('new', 'processed', 'archived')
+
+
+def inbox_authorized(config, token: Optional[str]) -> bool:
+    expected = getattr(config, 'INBOX_API_TOKEN', '')
+    return bool(expected and token and hmac.compare_digest(token.encode('utf-8'), expected.encode('utf-8')))
+
+
+def encode_cursor(message: Dict[str, Any]) -> str:
+    position = [message['priority'], message['created_at'], message['id']]
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str, int]:
+    """(priority, created_at, id) מתוך cursor. ValueError אם לא תקין"""
+    try:
+        priority, created_at, message_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (TypeError, ValueError) as e:
+        raise ValueError('cursor לא תקין') from e
+    if priority not in MESSAGE_PRIORITIES or not isinstance(created_at, str) or not isinstance(message_id, int):
+        raise ValueError('cursor לא תקין')
+    return priority, created_at, message_id
+
+
+def list_inbox(db: DatabaseHandler, args, config=Config) -> Tuple[int, Dict]:
+    """עמוד הודעות לפי פרמטרי הבקשה (status, limit, cursor)"""
+    status = args.get('status') or 'new'
+    if status not in MESSAGE_STATUSES:
+        return 400, {'error': f'status לא מוכר: {status}'}
+    try:
+        limit = min(max(int(args.get('limit') or config.INBOX_PAGE_SIZE), 1), config.INBOX_MAX_PAGE_SIZE)
+        after = decode_cursor(args['cursor']) if args.get('cursor') else None
+    except ValueError as e:
+        return 400, {'error': str(e)}
+
+    # הודעה אחת מעבר לעמוד - לדעת אם יש עמוד נוסף
+    messages = db.list_messages(status, limit + 1, after)
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    return 200, {
+        'messages': messages,
+        'next_cursor': encode_cursor(messages[-1]) if has_more else None
+    }
+
+
+def transition(db: DatabaseHandler, payload: Any, config=Config) -> Tuple[int, Dict]:
+    """מעבר מנת הודעות לסטטוס הבא"""
+    if not isinstance(payload, dict):
+        return 400, {'error': 'נדרש גוף JSON עם ids ו-status'}
+    status = payload.get('status')
+    ids = payload.get('ids')
+    if status not in MESSAGE_TRANSITIONS:
+        return 400, {'error': f"status חייב להיות אחד מ: {', '.join(MESSAGE_TRANSITIONS)}"}
+    if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        return 400, {'error': 'ids חייב להיות רשימת מספרים'}
+    if len(ids) > config.INBOX_MAX_TRANSITION:
+        return 413, {'error': f'עד {config.INBOX_MAX_TRANSITION} הודעות בבקשה'}
+
+    updated = db.transition_messages(ids, status)
+    return 200, {'status': status, 'requested': len(set(ids)), 'updated': updated}
+
+
+def unread(db: DatabaseHandler) -> Tuple[int, Dict]:
+    """מספר ההודעות החדשות לפי עדיפות"""
+    counts = db.get_message_counts('new')
+    return 200, {'unread': sum(counts.values()), 'by_priority': counts}
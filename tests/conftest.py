@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+
+# קובץ הלוג, העקבות והמאגר של ברירת המחדל נקבעים ב-Config בייבוא - לתיקייה זמנית
+# ולא לתיקיית הקוד
+_scratch = tempfile.mkdtemp(prefix='pbx-tests-')
+os.environ.setdefault('DATABASE_PATH', os.path.join(_scratch, 'pbx_system.db'))
+os.environ.setdefault('LOG_FILE', os.path.join(_scratch, 'pbx_system.log'))
+os.environ.setdefault('TRACE_FILE', os.path.join(_scratch, 'pbx_traces.jsonl'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database_handler import DatabaseHandler  # noqa: E402
+
+PHONE = '0501234567'
+
+
+@pytest.fixture
+def db(tmp_path):
+    return DatabaseHandler(str(tmp_path / 'pbx.db'))
+
+
+@pytest.fixture
+def customer_id(db):
+    return db.create_customer(PHONE, 'ישראל ישראלי')
+
+
+@pytest.fixture
+def age_claims(db):
+    """הזזת claimed_at של כל השורות בטבלה לעבר - כאילו העובד שתפס אותן נתקע"""
+    def age(table: str, minutes: int = 120):
+        conn = db.get_connection()
+        conn.execute(f'UPDATE {table} SET claimed_at = ?', (datetime.now() - timedelta(minutes=minutes),))
+        conn.commit()
+        conn.close()
+    return age
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+"""אורך הקלטה מכותרות WAV, RF64 ו-MP3 - קבצים שנבנים בבדיקה"""
+
+import io
+import struct
+import wave
+
+import pytest
+
+from audio_header import probe_duration
+
+RATE = 8000  # 8kHz, 16 ביט, מונו - 16000 בתים לשנייה
+
+
+def _wav(seconds: float) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(RATE)
+        w.writeframes(b'\x00\x00' * int(RATE * seconds))
+    return buffer.getvalue()
+
+
+def _rf64(seconds: float) -> bytes:
+    data = b'\x00\x00' * int(RATE * seconds)
+    fmt = struct.pack('<HHIIHH', 1, 1, RATE, RATE * 2, 2, 16)
+    ds64 = struct.pack('<QQQI', 0, len(data), len(data) // 2, 0)
+    return (b'RF64' + struct.pack('<I', 0xFFFFFFFF) + b'WAVE'
+            + b'ds64' + struct.pack('<I', len(ds64)) + ds64
+            + b'fmt ' + struct.pack('<I', len(fmt)) + fmt
+            + b'data' + struct.pack('<I', 0xFFFFFFFF) + data)
+
+
+# MPEG-1 Layer III, 128kbps, 44.1kHz, סטריאו: 417 בתים ו-1152 דגימות למסגרת
+MP3_HEADER = b'\xff\xfb\x90\x00'
+MP3_FRAME = 417
+
+
+def _mp3_frames(count: int, first: bytes = b'') -> bytes:
+    frames = [MP3_HEADER + first + b'\x00' * (MP3_FRAME - 4 - len(first))]
+    frames += [MP3_HEADER + b'\x00' * (MP3_FRAME - 4)] * (count - 1)
+    return b''.join(frames)
+
+
+def _id3(size: int) -> bytes:
+    synchsafe = bytes([(size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F])
+    return b'ID3\x03\x00\x00' + synchsafe + b'\x00' * size
+
+
+def _probe(content: bytes, total_size=True):
+    return probe_duration(io.BytesIO(content), len(content) if total_size else None)
+
+
+def test_wav():
+    assert _probe(_wav(2.5)) == ('wav', 2.5)
+
+
+def test_wav_streamed_with_unknown_data_size():
+    # מרכזיה שמקליטה בזרימה משאירה data בגודל 0 - לפי גודל הקובץ
+    content = bytearray(_wav(1.5))
+    data = content.index(b'data')
+    content[data + 4:data + 8] = struct.pack('<I', 0)
+    assert _probe(bytes(content)) == ('wav', 1.5)
+    assert _probe(bytes(content), total_size=False) == ('wav', None)
+
+
+def test_truncated_wav_uses_available_data():
+    content = _wav(2)
+    assert _probe(content[:len(content) - RATE * 2]) == ('wav', 1.0)
+
+
+def test_rf64():
+    assert _probe(_rf64(3)) == ('wav', 3.0)
+
+
+def test_mp3_cbr_from_file_size():
+    content = _mp3_frames(100)
+    assert _probe(content)[0] == 'mp3'
+    assert _probe(content)[1] == pytest.approx(100 * MP3_FRAME * 8 / 128000)
+    # בלי כותרת Xing ובלי גודל הקובץ אי אפשר לדעת
+    assert _probe(content, total_size=False) == ('mp3', None)
+
+
+def test_mp3_cbr_after_id3_tag():
+    content = _id3(300) + _mp3_frames(100)
+    assert _probe(content)[1] == pytest.approx(100 * MP3_FRAME * 8 / 128000)
+
+
+def test_mp3_xing_frame_count():
+    # כותרת Xing אחרי ה-side info (32 בתים בסטריאו), עם מספר המסגרות
+    xing = b'\x00' * 32 + b'Xing' + struct.pack('>II', 1, 250)
+    content = _mp3_frames(10, first=xing)
+    assert _probe(content, total_size=False) == ('mp3', pytest.approx(250 * 1152 / 44100))
+
+
+def test_not_audio():
+    assert _probe(b'<html>not audio</html>') == (None, None)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+"""תוצאה של עובד שהתפיסה שלו נלקחה (claim_token ישן) לא נכתבת"""
+
+
+def test_cancellation_finish_requires_current_claim(db, customer_id, age_claims):
+    request_id = db.create_cancellation_request(customer_id, 'call-1', '1001')
+    [stale] = db.claim_cancellation_requests()
+    age_claims('receipt_cancellations')
+    [current] = db.claim_cancellation_requests()
+    assert current['claim_token'] != stale['claim_token']
+
+    assert not db.finish_cancellation_request(request_id, stale['claim_token'], 'failed', error='timeout')
+    assert db.finish_cancellation_request(request_id, current['claim_token'], 'completed')
+
+    conn = db.get_connection()
+    row = conn.execute('SELECT status, last_error FROM receipt_cancellations WHERE id = ?', (request_id,)).fetchone()
+    conn.close()
+    assert tuple(row) == ('completed', None)
+
+
+def _transcription_job(db, customer_id):
+    message_id = db.save_message(customer_id, 'call-1', 'message.wav', recording_source='http://pbx.invalid/1.wav')
+    [recording] = db.claim_pending_recordings()
+    assert db.finish_recording(message_id, recording['claim_token'], 'stored', file_path='message.wav',
+                               file_format='wav', size_bytes=16000, duration=2.0)
+    return message_id
+
+
+def _message_text(db, message_id):
+    conn = db.get_connection()
+    text = conn.execute('SELECT message_text FROM messages WHERE id = ?', (message_id,)).fetchone()[0]
+    conn.close()
+    return text
+
+
+def test_transcription_finish_requires_current_claim(db, customer_id, age_claims):
+    message_id = _transcription_job(db, customer_id)
+    [stale] = db.claim_transcription_jobs(10)
+    age_claims('transcription_jobs')
+    [current] = db.claim_transcription_jobs(10)
+    assert current['attempts'] == 2
+
+    assert db.finish_transcription_jobs([(message_id, stale['claim_token'], 'done', 'טקסט ישן', 'fake', 1.0, None)]) == 0
+    assert _message_text(db, message_id) is None
+
+    assert db.finish_transcription_jobs([(message_id, current['claim_token'], 'done', 'שלום', 'fake', 1.0, None)]) == 1
+    assert _message_text(db, message_id) == 'שלום'
+
+
+def test_transcription_fails_after_max_attempts(db, customer_id, age_claims):
+    message_id = _transcription_job(db, customer_id)
+    for _ in range(2):
+        assert len(db.claim_transcription_jobs(10, max_attempts=2)) == 1
+        age_claims('transcription_jobs')
+    assert db.claim_transcription_jobs(10, max_attempts=2) == []
+
+    conn = db.get_connection()
+    status = conn.execute('SELECT status FROM transcription_jobs WHERE message_id = ?', (message_id,)).fetchone()[0]
+    conn.close()
+    assert status == 'failed'
+
+
+def test_annual_report_finish_requires_current_claim(db, customer_id, age_claims):
+    report_id = db.request_annual_report(customer_id, 2025)
+    stale_token, _ = db.claim_annual_reports(10)
+    age_claims('annual_reports')
+    current_token, [report] = db.claim_annual_reports(10)
+    assert report['id'] == report_id
+
+    assert db.finish_annual_reports(stale_token, [(report_id, 'failed', None, None, 'OSError')]) == 0
+    assert db.finish_annual_reports(current_token, [(report_id, 'generated', '{}', 'report.txt', None)]) == 1
+
+    conn = db.get_connection()
+    row = conn.execute('SELECT status, attempts FROM annual_reports WHERE id = ?', (report_id,)).fetchone()
+    conn.close()
+    assert tuple(row) == ('generated', 2)
+
+
+def test_failed_annual_report_is_retried_until_max_attempts(db, customer_id, age_claims):
+    report_id = db.request_annual_report(customer_id, 2025)
+    for _ in range(2):
+        token, _ = db.claim_annual_reports(10, max_attempts=2)
+        db.finish_annual_reports(token, [(report_id, 'failed', None, None, 'OSError')])
+        # דיווח שנכשל נתפס שוב רק אחרי stale_minutes
+        assert db.claim_annual_reports(10, max_attempts=2)[1] == []
+        age_claims('annual_reports')
+    assert db.claim_annual_reports(10, max_attempts=2)[1] == []
+
+
+def test_stuck_annual_report_fails_after_max_attempts(db, customer_id, age_claims):
+    report_id = db.request_annual_report(customer_id, 2025)
+    for _ in range(2):
+        assert len(db.claim_annual_reports(10, max_attempts=2)[1]) == 1
+        age_claims('annual_reports')
+    assert db.claim_annual_reports(10, max_attempts=2)[1] == []
+
+    conn = db.get_connection()
+    status = conn.execute('SELECT status FROM annual_reports WHERE id = ?', (report_id,)).fetchone()[0]
+    conn.close()
+    assert status == 'failed'
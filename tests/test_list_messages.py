@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+"""דפדוף בתיבת ההודעות לפי מפתח (priority, created_at, id)"""
+
+from datetime import datetime, timedelta
+
+
+def _messages(db, customer_id, priorities):
+    """הודעה לכל עדיפות ברשימה, עם created_at עולה; חלקן באותה שנייה"""
+    started = datetime(2026, 1, 1, 9, 0, 0)
+    conn = db.get_connection()
+    ids = []
+    for i, priority in enumerate(priorities):
+        cursor = conn.execute('''
+            INSERT INTO messages (customer_id, call_id, message_text, priority, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (customer_id, f'call-{i}', f'הודעה {i}', priority,
+              (started + timedelta(seconds=i // 2)).strftime('%Y-%m-%d %H:%M:%S')))
+        ids.append(cursor.lastrowid)
+    conn.commit()
+    conn.close()
+    return ids
+
+
+def _pages(db, limit):
+    pages, after = [], None
+    while True:
+        page = db.list_messages('new', limit=limit, after=after)
+        if not page:
+            return pages
+        pages.append([m['id'] for m in page])
+        last = page[-1]
+        after = (last['priority'], last['created_at'], last['id'])
+
+
+def test_pages_cross_priority_boundaries(db, customer_id):
+    priorities = ['normal', 'urgent', 'low', 'urgent', 'normal', 'high', 'urgent', 'normal', 'low']
+    ids = _messages(db, customer_id, priorities)
+    expected = [message_id for priority in ('urgent', 'high', 'normal', 'low')
+                for message_id, p in zip(ids, priorities) if p == priority]
+
+    for limit in (1, 2, 3, 4, 50):
+        pages = _pages(db, limit)
+        assert [message_id for page in pages for message_id in page] == expected
+        assert all(len(page) <= limit for page in pages)
+
+
+def test_page_ending_on_last_message_of_a_priority(db, customer_id):
+    ids = _messages(db, customer_id, ['urgent', 'urgent', 'low', 'low'])
+    first = db.list_messages('new', limit=2)
+    assert [m['id'] for m in first] == ids[:2]
+
+    last = first[-1]
+    second = db.list_messages('new', limit=2, after=(last['priority'], last['created_at'], last['id']))
+    assert [m['id'] for m in second] == ids[2:]
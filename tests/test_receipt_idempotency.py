@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+"""קבלה אחת לכל בקשה, גם כשהמרכזיה שולחת אותה שוב (PBXcallId + נתוני הקבלה)"""
+
+import pytest
+
+from cloud_pbx_server import PBXHandler
+from conftest import PHONE
+
+
+class FakeICount:
+    """iCount בזיכרון: create_receipt מחזיר את התוצאות שנקבעו מראש, find_receipt מחפש לפי reference"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.created = {}
+        self.create_calls = 0
+        self.find_calls = 0
+
+    def create_receipt(self, receipt_data, reference=None):
+        self.create_calls += 1
+        result = self.results.pop(0) if self.results else {'status': True}
+        if result['status'] or result.get('created'):
+            doc_num = str(1000 + len(self.created))
+            self.created[reference] = {'doc_id': f'doc-{doc_num}', 'doc_num': doc_num}
+        if result['status']:
+            return {'status': True, **self.created[reference]}
+        return result
+
+    def find_receipt(self, reference):
+        self.find_calls += 1
+        found = self.created.get(reference)
+        return {'status': True, 'found': found is not None, **(found or {})}
+
+
+@pytest.fixture
+def handler(db, customer_id):
+    handler = PBXHandler(db=db)
+    handler.current_calls['call-1'] = {'PBXphone': PHONE, 'receiptAmount': '120'}
+    return handler
+
+
+def _receipts(db):
+    conn = db.get_connection()
+    rows = conn.execute('SELECT status, icount_doc_num FROM receipts').fetchall()
+    conn.close()
+    return [tuple(row) for row in rows]
+
+
+def test_repeated_request_returns_stored_result(db, handler):
+    handler.icount = FakeICount()
+    first = handler.process_receipt_description('call-1', 'שיעור פרטי')
+    again = handler.process_receipt_description('call-1', 'שיעור פרטי')
+
+    assert first['name'] == again['name'] == 'receiptSuccess'
+    assert first['files'] == again['files']
+    assert handler.icount.create_calls == 1
+    assert _receipts(db) == [('completed', '1000')]
+
+
+def test_different_input_in_same_call_is_a_new_receipt(db, handler):
+    handler.icount = FakeICount()
+    handler.process_receipt_description('call-1', 'שיעור פרטי')
+    handler.process_receipt_description('call-1', 'ייעוץ')
+    assert handler.icount.create_calls == 2
+    assert len(_receipts(db)) == 2
+
+
+def test_unknown_result_is_reconciled_before_posting_again(db, handler):
+    # המסמך נוצר ב-iCount אבל התשובה לא הגיעה
+    handler.icount = FakeICount({'status': False, 'unknown': True, 'created': True})
+    assert handler.process_receipt_description('call-1', 'שיעור פרטי')['name'] == 'receiptPending'
+    assert _receipts(db) == [('unknown', None)]
+
+    retry = handler.process_receipt_description('call-1', 'שיעור פרטי')
+    assert retry['name'] == 'receiptSuccess'
+    assert handler.icount.create_calls == 1
+    assert handler.icount.find_calls == 1
+    assert _receipts(db) == [('completed', '1000')]
+
+
+def test_unknown_result_not_found_is_posted_once_more(db, handler):
+    handler.icount = FakeICount({'status': False, 'unknown': True})
+    handler.process_receipt_description('call-1', 'שיעור פרטי')
+
+    assert handler.process_receipt_description('call-1', 'שיעור פרטי')['name'] == 'receiptSuccess'
+    assert handler.icount.create_calls == 2
+    assert _receipts(db) == [('completed', '1000')]
+
+
+def test_request_while_receipt_is_in_progress_does_not_post(db, handler):
+    handler.icount = FakeICount({'status': False, 'unknown': True})
+    handler.process_receipt_description('call-1', 'שיעור פרטי')
+    # בקשה קודמת תפסה את הקבלה לטיפול חוזר וממתינה עכשיו ל-iCount
+    conn = db.get_connection()
+    receipt_id = conn.execute('SELECT id FROM receipts').fetchone()[0]
+    conn.close()
+    assert db.claim_receipt_retry(receipt_id, 'unknown')
+
+    assert handler.process_receipt_description('call-1', 'שיעור פרטי')['name'] == 'receiptPending'
+    assert handler.icount.create_calls == 1
+    assert handler.icount.find_calls == 0
+    assert _receipts(db) == [('pending', None)]
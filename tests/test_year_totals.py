@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""customer_year_totals ו-message_counts מתעדכנים בטריגרים - מול חישוב מחדש"""
+
+from database_handler import MESSAGE_PRIORITIES
+
+
+def _receipt(db, customer_id, call_id, amount):
+    receipt_id = db.create_receipt(customer_id, call_id, {'amount': amount, 'description': 'שירות'})
+    conn = db.get_connection()
+    created_at = conn.execute('SELECT created_at FROM receipts WHERE id = ?', (receipt_id,)).fetchone()[0]
+    conn.close()
+    return receipt_id, int(created_at[:4])
+
+
+def _totals(db, customer_id, year):
+    totals = db.get_customer_year_totals(customer_id, year)
+    return totals['receipts'], totals['total_amount'], totals['cancelled_receipts'], totals['cancelled_amount']
+
+
+def test_year_totals_follow_receipt_changes(db, customer_id):
+    first, year = _receipt(db, customer_id, 'call-1', 120.5)
+    second, _ = _receipt(db, customer_id, 'call-2', 80)
+    # קבלה שעדיין לא הושלמה לא נספרת
+    assert _totals(db, customer_id, year) == (0, 0, 0, 0)
+
+    db.update_receipt(first, status='completed')
+    db.update_receipt(second, status='completed')
+    assert _totals(db, customer_id, year) == (2, 200.5, 0, 0)
+
+    db.update_receipt(first, amount=100.25)
+    assert _totals(db, customer_id, year) == (2, 180.25, 0, 0)
+
+    db.update_receipt(second, status='cancelled')
+    assert _totals(db, customer_id, year) == (1, 100.25, 1, 80)
+
+    conn = db.get_connection()
+    conn.execute('DELETE FROM receipts WHERE id = ?', (first,))
+    conn.commit()
+    conn.close()
+    assert _totals(db, customer_id, year) == (0, 0, 1, 80)
+    assert db.verify_customer_year_totals()['mismatches'] == 0
+
+
+def test_verify_reports_drift_and_rebuild_fixes_it(db, customer_id):
+    receipt_id, year = _receipt(db, customer_id, 'call-1', 50)
+    db.update_receipt(receipt_id, status='completed')
+
+    conn = db.get_connection()
+    conn.execute('UPDATE customer_year_totals SET completed_cents = completed_cents + 1')
+    conn.commit()
+    conn.close()
+    assert db.verify_customer_year_totals()['mismatches'] == 1
+
+    db.rebuild_customer_year_totals()
+    assert db.verify_customer_year_totals()['mismatches'] == 0
+    assert _totals(db, customer_id, year) == (1, 50, 0, 0)
+
+
+def _counted_messages(db, status):
+    conn = db.get_connection()
+    rows = conn.execute('SELECT priority, COUNT(*) FROM messages WHERE status = ? GROUP BY priority',
+                        (status,)).fetchall()
+    conn.close()
+    counts = {priority: 0 for priority in MESSAGE_PRIORITIES}
+    counts.update({priority: count for priority, count in rows})
+    return counts
+
+
+def test_message_counts_follow_messages(db, customer_id):
+    ids = [db.save_message(customer_id, f'call-{i}', message_text='שלום') for i in range(4)]
+    conn = db.get_connection()
+    conn.execute("UPDATE messages SET priority = 'urgent' WHERE id = ?", (ids[0],))
+    conn.execute("UPDATE messages SET priority = 'low' WHERE id = ?", (ids[1],))
+    conn.commit()
+    conn.close()
+    assert db.get_message_counts('new') == {'urgent': 1, 'high': 0, 'normal': 2, 'low': 1}
+
+    assert db.transition_messages([ids[0], ids[2]], 'processed') == 2
+    # הודעה שכבר עברה לא נספרת פעמיים
+    assert db.transition_messages([ids[0]], 'processed') == 0
+
+    conn = db.get_connection()
+    conn.execute('DELETE FROM messages WHERE id = ?', (ids[3],))
+    conn.commit()
+    conn.close()
+
+    for status in ('new', 'processed'):
+        assert db.get_message_counts(status) == _counted_messages(db, status)
+    assert db.get_message_counts('new') == {'urgent': 0, 'high': 0, 'normal': 0, 'low': 1}
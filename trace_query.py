@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+ציר הזמן של שיחה אחת מקובץ ה-spans
+
+    python trace_query.py <PBXcallId>
+    python trace_query.py <PBXcallId> --file pbx_traces.jsonl --json
+
+לכל פנייה מוצגים הצומת, התוצאה וזמן השרת, עם פעולות המאגר ו-iCount שבתוכה.
+בין פנייה לפנייה מוצג זמן המתקשר (הקראת התפריט, הקשה, ורשת המרכזיה).
+"""
+
+import argparse
+import json
+from datetime import datetime
+from typing import Any, Dict, List
+
+from config import Config
+from tracing import trace_id_for_call
+
+
+def load_spans(path: str, trace_id: str) -> List[Dict[str, Any]]:
+    """כל ה-spans של trace אחד (כל שורה בקובץ היא אצווה)"""
+    spans = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if trace_id not in line:
+                continue
+            try:
+                batch = json.loads(line)
+            except ValueError:
+                continue
+            spans.extend(span for span in batch if span.get('traceId') == trace_id)
+    return spans
+
+
+def build_timeline(spans: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """הפניות לפי סדר, עם spans הילדים, זמן שרת וזמן מתקשר"""
+    children = {}
+    for span in spans:
+        if span.get('parentId'):
+            children.setdefault(span['parentId'], []).append(span)
+
+    def descendants(span_id: str, depth: int) -> List[Dict[str, Any]]:
+        result = []
+        for child in sorted(children.get(span_id, []), key=lambda s: s['timestamp']):
+            result.append({**child, 'depth': depth})
+            result.extend(descendants(child['id'], depth + 1))
+        return result
+
+    request_spans = sorted((s for s in spans if s.get('kind') == 'SERVER'), key=lambda s: s['timestamp'])
+    timeline = []
+    server_us = think_us = 0
+    previous_end = None
+    for span in request_spans:
+        think = span['timestamp'] - previous_end if previous_end is not None else None
+        if think is not None:
+            think_us += max(0, think)
+        server_us += span['duration']
+        previous_end = span['timestamp'] + span['duration']
+        timeline.append({'request': span, 'think_us': think, 'children': descendants(span['id'], 1)})
+
+    call_us = previous_end - request_spans[0]['timestamp'] if request_spans else 0
+    return {
+        'requests': timeline,
+        'request_count': len(request_spans),
+        'server_ms': server_us / 1000,
+        'caller_think_ms': think_us / 1000,
+        'call_ms': call_us / 1000
+    }
+
+
+def print_timeline(call_id: str, timeline: Dict[str, Any]):
+    print(f"שיחה {call_id}: {timeline['request_count']} פניות, "
+          f"משך {timeline['call_ms'] / 1000:.1f}s, זמן שרת {timeline['server_ms']:.1f}ms, "
+          f"זמן מתקשר {timeline['caller_think_ms'] / 1000:.1f}s")
+    for item in timeline['requests']:
+        span = item['request']
+        tags = span.get('tags', {})
+        if item['think_us'] is not None:
+            print(f"    ... מתקשר {item['think_us'] / 1_000_000:.2f}s")
+        started = datetime.fromtimestamp(span['timestamp'] / 1_000_000).strftime('%H:%M:%S.%f')[:-3]
+        print(f"{started}  {tags.get('node', '?'):<22} {tags.get('outcome', ''):<8} "
+              f"{span['duration'] / 1000:8.1f}ms")
+        for child in item['children']:
+            marker = ' error=' + child['tags']['error'] if child.get('tags', {}).get('error') else ''
+            print(f"{'':14}{'  ' * child['depth']}{child['name']:<36} {child['duration'] / 1000:8.1f}ms{marker}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ציר הזמן של שיחה')
+    parser.add_argument('call_id', help='PBXcallId')
+    parser.add_argument('--file', default=Config.TRACE_FILE)
+    parser.add_argument('--json', action='store_true', help='פלט JSON במקום טבלה')
+    args = parser.parse_args()
+
+    spans = load_spans(args.file, trace_id_for_call(args.call_id))
+    if not spans:
+        raise SystemExit(f"לא נמצאו spans לשיחה {args.call_id} ב-{args.file}")
+
+    timeline = build_timeline(spans)
+    if args.json:
+        print(json.dumps(timeline, ensure_ascii=False, indent=2))
+    else:
+        print_timeline(args.call_id, timeline)
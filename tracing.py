@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+מעקב (tracing) של שיחה לאורך כל הפניות שלה
+
+כל שיחה היא trace אחד: מזהה ה-trace נגזר מ-PBXcallId, כך שכל הפניות של
+אותה שיחה (גם ב-workers שונים) נקשרות יחד בלי מצב משותף. כל פנייה ל-/pbx
+היא span, ופעולות מאגר ו-iCount בתוכה הן spans ילדים.
+
+ה-spans נכתבים באצוות לקובץ מקומי בפורמט Zipkin v2 (כל שורה היא מערך JSON
+של spans, כמו גוף בקשה ל-/api/v2/spans). הצגת ציר הזמן של שיחה:
+    python trace_query.py <PBXcallId>
+"""
+
+import atexit
+import contextlib
+import contextvars
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = 'cloud-pbx'
+
+_current_span = contextvars.ContextVar('pbx_current_span', default=None)
+
+
+def trace_id_for_call(call_id: str) -> str:
+    """מזהה trace (128 ביט, hex) קבוע לכל PBXcallId"""
+    return hashlib.sha256(call_id.encode('utf-8')).hexdigest()[:32]
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'kind', 'timestamp', 'duration',
+                 'tags', '_started')
+
+    def __init__(self, name: str, trace_id: str = None, parent_id: str = None, kind: str = None,
+                 tags: Dict[str, Any] = None):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.timestamp = int(time.time() * 1_000_000)
+        self.duration = None
+        self.tags = tags or {}
+        self._started = time.perf_counter()
+
+    def tag(self, **tags):
+        self.tags.update(tags)
+
+    def finish(self):
+        self.duration = max(1, int((time.perf_counter() - self._started) * 1_000_000))
+
+    def to_zipkin(self) -> Dict[str, Any]:
+        span = {
+            'traceId': self.trace_id,
+            'id': self.span_id,
+            'name': self.name,
+            'timestamp': self.timestamp,
+            'duration': self.duration,
+            'localEndpoint': {'serviceName': SERVICE_NAME},
+            'tags': {key: str(value) for key, value in self.tags.items() if value is not None}
+        }
+        if self.parent_id:
+            span['parentId'] = self.parent_id
+        if self.kind:
+            span['kind'] = self.kind
+        return span
+
+
+class BatchExporter:
+    """איסוף spans בזיכרון וכתיבה לקובץ באצוות (מ-thread רקע)"""
+
+    def __init__(self, path: str, batch_size: int = 100, flush_seconds: float = 2.0,
+                 max_buffer: int = 10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_buffer = max_buffer
+        self.buffer: List[Span] = []
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.start_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.pid = None
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def add(self, span: Span):
+        if self.pid != os.getpid():
+            self._start()
+        with self.lock:
+            if len(self.buffer) >= self.max_buffer:
+                # הקובץ לא עומד בקצב - מוותרים על spans ולא על זמן הבקשה
+                self.dropped += 1
+                return
+            self.buffer.append(span)
+            full = len(self.buffer) >= self.batch_size
+        if full:
+            self.wake.set()
+
+    def _start(self):
+        # ה-thread שכותב לקובץ מופעל בפעם הראשונה בכל תהליך
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            threading.Thread(target=self._run, name='trace-exporter', daemon=True).start()
+
+    def _after_fork(self):
+        # ה-buffer שהועתק מההורה ייכתב על ידי ההורה
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.start_lock = threading.Lock()
+        self.wake = threading.Event()
+
+    def _run(self):
+        while True:
+            self.wake.wait(self.flush_seconds)
+            self.wake.clear()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            batch, self.buffer = self.buffer, []
+        if not batch:
+            return
+        line = json.dumps([span.to_zipkin() for span in batch], ensure_ascii=False, separators=(',', ':'))
+        try:
+            # כתיבה אחת לכל אצווה - שורות של workers שונים לא מתערבבות
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, (line + '\n').encode('utf-8'))
+            finally:
+                os.close(fd)
+        except OSError as e:
+            logger.warning(f"כתיבת spans נכשלה: {str(e)}")
+
+
+_state = {'exporter': None}
+
+
+def configure(config):
+    """הפעלת המעקב לפי ההגדרות (ללא TRACING_ENABLED - המעקב כבוי)"""
+    if not getattr(config, 'TRACING_ENABLED', False):
+        _state['exporter'] = None
+        return
+    exporter = BatchExporter(config.TRACE_FILE, config.TRACE_BATCH_SIZE, config.TRACE_FLUSH_SECONDS)
+    _state['exporter'] = exporter
+    atexit.register(exporter.flush)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+@contextlib.contextmanager
+def request_span(name: str, **tags):
+    """span של פנייה אחת. ה-trace נקבע ב-set_call כשמזהה השיחה ידוע"""
+    if _state['exporter'] is None:
+        yield None
+        return
+    span = Span(name, kind='SERVER', tags=tags)
+    token = _current_span.set(span)
+    try:
+        yield span
+    finally:
+        _current_span.reset(token)
+        span.finish()
+        if span.trace_id:
+            _state['exporter'].add(span)
+
+
+def set_call(span: Optional[Span], call_id: str):
+    if span is not None and call_id:
+        span.trace_id = trace_id_for_call(call_id)
+        span.tags['call_id'] = call_id
+
+
+@contextlib.contextmanager
+def span(name: str, kind: str = None, **tags):
+    """span ילד של ה-span הנוכחי (לא עושה כלום מחוץ לפנייה מתועדת)"""
+    parent = _current_span.get()
+    if parent is None or parent.trace_id is None or _state['exporter'] is None:
+        yield None
+        return
+    child = Span(name, parent.trace_id, parent.span_id, kind, tags)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except Exception as e:
+        child.tags['error'] = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        child.finish()
+        _state['exporter'].add(child)
+
+
+def trace_methods(prefix: str, exclude=()):
+    """קישוט מחלקה: כל מתודה ציבורית היא span ילד בשם '<prefix> <method>'"""
+    def decorate(cls):
+        for name, member in list(vars(cls).items()):
+            if name.startswith('_') or name in exclude or not inspect.isfunction(member):
+                continue
+            setattr(cls, name, _traced(member, f'{prefix} {name}'))
+        return cls
+    return decorate
+
+
+def _traced(func, span_name: str):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _current_span.get() is None:
+            return func(*args, **kwargs)
+        with span(span_name):
+            return func(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+מנועי תמלול להודעות
+
+מנוע הוא מחלקה עם transcribe(path, language) שמחזירה את הטקסט. המנוע נבחר לפי
+TRANSCRIPTION_ENGINE:
+    stub                     - StubEngine, מנוע מקומי לבדיקות (לא מתמלל באמת)
+    my_module:WhisperEngine  - כל מחלקה שמממשת את TranscriptionEngine
+
+מופע המנוע נוצר פעם אחת בכל תהליך של transcription_worker (טעינת מודל וכו'
+נעשית ב-__init__ ולא בכל הודעה).
+"""
+
+import abc
+import importlib
+import os
+import time
+
+from audio_header import probe_duration
+from config import Config
+
+
+class TranscriptionEngine(abc.ABC):
+    """ממשק מנוע תמלול"""
+
+    name = 'base'
+
+    @abc.abstractmethod
+    def transcribe(self, path: str, language: str) -> str:
+        """הטקסט של קובץ ההקלטה. חריגה - התמלול נכשל וינוסה שוב"""
+
+
+class StubEngine(TranscriptionEngine):
+    """מנוע מקומי לבדיקות: קורא את אורך ההקלטה מהכותרות ומחזיר טקסט קבוע.
+    realtime_factor מדמה זמן עיבוד (שניות לכל שניית שמע)"""
+
+    name = 'stub'
+
+    def __init__(self, realtime_factor: float = None):
+        self.realtime_factor = (realtime_factor if realtime_factor is not None
+                                else Config.TRANSCRIPTION_STUB_REALTIME_FACTOR)
+
+    def transcribe(self, path: str, language: str) -> str:
+        with open(path, 'rb') as f:
+            file_format, seconds = probe_duration(f, os.fstat(f.fileno()).st_size)
+        if seconds is None:
+            raise ValueError(f'לא ניתן לקרוא את אורך ההקלטה {path}')
+        if self.realtime_factor:
+            time.sleep(seconds * self.realtime_factor)
+        return f"[תמלול בדיקה] הקלטת {file_format} באורך {seconds:.1f} שניות ({language})"
+
+
+def load_engine(spec: str = None) -> TranscriptionEngine:
+    """יצירת המנוע לפי 'stub' או 'module:Class'"""
+    spec = spec or Config.TRANSCRIPTION_ENGINE
+    if spec == StubEngine.name:
+        return StubEngine()
+    module_name, _, class_name = spec.partition(':')
+    if not class_name:
+        raise ValueError(f"TRANSCRIPTION_ENGINE לא תקין: {spec} (צריך 'stub' או 'module:Class')")
+    engine = getattr(importlib.import_module(module_name), class_name)()
+    if not isinstance(engine, TranscriptionEngine):
+        raise TypeError(f'{spec} אינו TranscriptionEngine')
+    return engine
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+תמלול הודעות ברקע
+
+הודעה נכנסת לתור (transcription_jobs) כשההקלטה שלה נשמרה (recording_ingest).
+העובד מריץ את המנוע (transcription_engines) במאגר תהליכים בגודל קבוע, ותופס
+מהתור רק כמה שהתהליכים יכולים לקבל (TRANSCRIPTION_QUEUE_PER_PROCESS לכל תהליך),
+כך שמנוע איטי לא גורם לתפיסת כל התור. הודעות דחופות (messages.priority) נתפסות
+קודם. התוצאות נאספות ומעודכנות ב-message_text ובסטטוס התמלול במנות, בטרנזקציה
+אחת לכל מנה.
+
+    python transcription_worker.py run     # כל התור עכשיו, עם סיכום תפוקה לדקת שמע
+    python transcription_worker.py watch   # ממשיך לרוץ ובודק את התור כל TRANSCRIPTION_POLL_SECONDS
+    python transcription_worker.py stats   # מצב התור ותפוקת התמלולים האחרונים
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import Config
+from database_handler import DatabaseHandler
+from transcription_engines import load_engine
+
+logger = logging.getLogger(__name__)
+
+# המנוע של תהליך המאגר (נוצר פעם אחת ב-_init_process)
+_engine = None
+_language = None
+
+
+def _init_process(engine_spec: str, language: str):
+    global _engine, _language
+    _engine = load_engine(engine_spec)
+    _language = language
+
+
+def transcribe_job(job: Dict[str, Any]) -> Tuple[int, Optional[str], Optional[str], float]:
+    """תמלול הודעה אחת (רץ בתהליך של המאגר). מחזיר (message_id, טקסט, שגיאה, שניות עיבוד)"""
+    started = time.perf_counter()
+    try:
+        if not job.get('file_path'):
+            raise ValueError('אין קובץ הקלטה להודעה')
+        text = _engine.transcribe(job['file_path'], _language)
+    except Exception as e:
+        return job['message_id'], None, str(e) or type(e).__name__, time.perf_counter() - started
+    return job['message_id'], text, None, time.perf_counter() - started
+
+
+class TranscriptionWorker:
+    """תמלול הודעות מהתור במאגר תהליכים חסום"""
+
+    def __init__(self, db: DatabaseHandler = None, engine: str = None, processes: int = None,
+                 queue_per_process: int = None, batch_size: int = None, flush_seconds: float = None,
+                 max_attempts: int = None, language: str = None):
+        self.db = db or DatabaseHandler()
+        self.engine = engine or Config.TRANSCRIPTION_ENGINE
+        processes = processes if processes is not None else Config.TRANSCRIPTION_PROCESSES
+        self.processes = processes or os.cpu_count() or 1
+        self.max_in_flight = self.processes * (queue_per_process or Config.TRANSCRIPTION_QUEUE_PER_PROCESS)
+        self.batch_size = batch_size or Config.TRANSCRIPTION_BATCH_SIZE
+        self.flush_seconds = flush_seconds if flush_seconds is not None else Config.TRANSCRIPTION_FLUSH_SECONDS
+        self.max_attempts = max_attempts or Config.TRANSCRIPTION_MAX_ATTEMPTS
+        self.language = language or Config.TRANSCRIPTION_LANGUAGE
+
+    def _pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.processes, initializer=_init_process,
+                                   initargs=(self.engine, self.language))
+
+    def _result(self, job: Dict, text: Optional[str], error: Optional[str], seconds: float) -> Tuple:
+        """שורת עדכון ל-finish_transcription_jobs. כישלון חוזר לתור עד max_attempts"""
+        if error is None:
+            return job['message_id'], job['claim_token'], 'done', text, self.engine, seconds, None
+        status = 'failed' if job.get('attempts', 0) >= self.max_attempts else 'queued'
+        logger.warning(f"תמלול הודעה {job['message_id']} נכשל ({status}): {error}")
+        return job['message_id'], job['claim_token'], status, None, self.engine, seconds, error
+
+    def _flush(self, results: List[Tuple], summary: Dict[str, Any]):
+        if not results:
+            return
+        self.db.finish_transcription_jobs(results)
+        for row in results:
+            outcome = {'done': 'done', 'queued': 'retry'}.get(row[2], 'failed')
+            summary[outcome] += 1
+        summary['jobs'] += len(results)
+        results.clear()
+
+    def run(self, watch: bool = False, poll_seconds: float = None) -> Dict[str, Any]:
+        """תמלול עד שהתור מתרוקן (או ללא הפסקה ב-watch). מחזיר סיכום עם התפוקה לדקת שמע"""
+        poll_seconds = poll_seconds if poll_seconds is not None else Config.TRANSCRIPTION_POLL_SECONDS
+        started = time.monotonic()
+        summary = {'jobs': 0, 'done': 0, 'retry': 0, 'failed': 0, 'audio_seconds': 0.0, 'engine_seconds': 0.0}
+        in_flight = {}
+        results = []
+        last_flush = time.monotonic()
+
+        pool = self._pool()
+        try:
+            while True:
+                # לחץ חוזר: נתפסות רק הודעות שיש להן מקום בתהליכים
+                free = self.max_in_flight - len(in_flight)
+                if free > 0:
+                    for job in self.db.claim_transcription_jobs(free, max_attempts=self.max_attempts):
+                        in_flight[pool.submit(transcribe_job, job)] = job
+
+                if not in_flight:
+                    self._flush(results, summary)
+                    last_flush = time.monotonic()
+                    if not watch:
+                        break
+                    time.sleep(poll_seconds)
+                    continue
+
+                done, _ = wait(in_flight, timeout=self.flush_seconds, return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    job = in_flight.pop(future)
+                    try:
+                        _, text, error, seconds = future.result()
+                    except BrokenProcessPool as e:
+                        broken = True
+                        text, error, seconds = None, f'תהליך התמלול קרס: {e}', 0.0
+                    if error is None:
+                        summary['audio_seconds'] += job.get('audio_seconds') or 0
+                        summary['engine_seconds'] += seconds
+                    results.append(self._result(job, text, error, seconds))
+
+                if broken:
+                    # כל מה שנשלח למאגר שקרס לא יסתיים - חוזר לתור, ומאגר חדש נבנה
+                    for job in in_flight.values():
+                        results.append(self._result(job, None, 'תהליך התמלול קרס', 0.0))
+                    in_flight.clear()
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    pool = self._pool()
+
+                if len(results) >= self.batch_size or (results and time.monotonic() - last_flush >= self.flush_seconds):
+                    self._flush(results, summary)
+                    last_flush = time.monotonic()
+        finally:
+            # תמלולים שלא הסתיימו נשארים ב-processing ונתפסים מחדש אחרי claim_transcription_jobs(stale_minutes),
+            # עד max_attempts
+            self._flush(results, summary)
+            pool.shutdown(cancel_futures=True)
+
+        duration = time.monotonic() - started
+        audio_minutes = summary['audio_seconds'] / 60
+        summary['processes'] = self.processes
+        summary['engine'] = self.engine
+        summary['audio_minutes'] = round(audio_minutes, 2)
+        summary['duration_seconds'] = round(duration, 3)
+        # דקות שמע שתומללו לכל דקת ריצה, וזמן המנוע לכל דקת שמע
+        summary['audio_minutes_per_minute'] = round(audio_minutes / (duration / 60), 2) if duration else 0.0
+        summary['engine_seconds_per_audio_minute'] = (round(summary['engine_seconds'] / audio_minutes, 3)
+                                                      if audio_minutes else None)
+        summary['audio_seconds'] = round(summary['audio_seconds'], 2)
+        summary['engine_seconds'] = round(summary['engine_seconds'], 3)
+        if summary['jobs']:
+            logger.info(f"תמלול הסתיים: {summary}")
+        return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='תמלול הודעות')
+    parser.add_argument('command', choices=['run', 'watch', 'stats'])
+    parser.add_argument('--processes', type=int, help='מספר תהליכי התמלול (ברירת מחדל TRANSCRIPTION_PROCESSES)')
+    parser.add_argument('--engine', help="מנוע התמלול (ברירת מחדל TRANSCRIPTION_ENGINE)")
+    parser.add_argument('--hours', type=float, default=24, help='טווח סטטיסטיקת התפוקה (stats)')
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=getattr(logging, Config.LOG_LEVEL),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    if args.command == 'stats':
+        print(json.dumps(DatabaseHandler().get_transcription_stats(args.hours), ensure_ascii=False, indent=2))
+    else:
+        worker = TranscriptionWorker(engine=args.engine, processes=args.processes)
+        print(json.dumps(worker.run(watch=args.command == 'watch'), ensure_ascii=False, indent=2))